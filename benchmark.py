@@ -0,0 +1,924 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for the diff.py pipeline, on synthetic objdump output.
+
+For each architecture and size, this generates objdump-style text with
+relocations, branches, jump tables, data pools and source lines, and times
+arch preprocessing, process(), do_diff(), each formatter and scoring. The time
+to import diff.py is measured too, with python -X importtime.
+
+    ./benchmark.py                                  # print timings
+    ./benchmark.py --save bench.json                # ... and save them
+    ./benchmark.py --compare bench.json             # fail on regressions
+    ./benchmark.py --corpus corpus                  # time recorded dumps
+"""
+import argparse
+from dataclasses import dataclass
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Tuple, Type
+
+import corpus
+import diff
+
+DEFAULT_SIZES = [1000, 10000, 25000]
+
+# Lines of each function before the next function label
+FUNCTION_LINES = 400
+
+
+@dataclass
+class Insn:
+    mnemonic: str
+    args: str
+    size: int
+    relocs: List[str]
+
+
+class DumpGenerator:
+    """Generates objdump output for one architecture. Subclasses provide
+    instructions; this handles addresses, labels, source lines and layout."""
+
+    arch: str = ""
+    raw_insn = True
+    word_size = 4
+    function_lines = FUNCTION_LINES
+
+    def __init__(self, seed: int) -> None:
+        self.rng = random.Random(seed)
+        self.fn_start = 0
+        self.fn_name = "func_00000000"
+
+    def reg(self) -> str:
+        raise NotImplementedError
+
+    def sym(self) -> str:
+        return f"D_{self.rng.randrange(0x80000000, 0x80100000):08X}"
+
+    def target(self, addr: int) -> str:
+        dest = max(self.fn_start, addr + self.rng.randrange(-64, 128, self.word_size))
+        return f"{dest:x} <{self.fn_name}+0x{dest - self.fn_start:x}>"
+
+    def instructions(self, addr: int) -> List[Insn]:
+        """Instructions for the next bit of code at the given address."""
+        raise NotImplementedError
+
+    def raw_bytes(self, size: int) -> str:
+        return "".join(f"{self.rng.randrange(256):02x}" for _ in range(size))
+
+    def row(self, addr: int, insn: Insn) -> str:
+        if not self.raw_insn:
+            return f"{addr:>4x}:\t{insn.mnemonic}\t{insn.args}"
+        return (
+            f"{addr:>4x}:\t{self.raw_bytes(insn.size)} \t{insn.mnemonic}\t{insn.args}"
+        )
+
+    def generate(self, num_lines: int) -> str:
+        out: List[str] = []
+        addr = 0
+        fn_lines = self.function_lines
+        source_line = 1
+        while len(out) < num_lines:
+            if fn_lines >= self.function_lines:
+                self.fn_start = addr
+                self.fn_name = f"func_{0x80000000 + addr:08X}"
+                out.append("")
+                out.append(f"{addr:08x} <{self.fn_name}>:")
+                fn_lines = 0
+            if self.rng.random() < 0.1:
+                source_line += self.rng.randrange(1, 5)
+                out.append(f"src/{self.arch}/module.c:{source_line}")
+            for insn in self.instructions(addr):
+                out.append(self.row(addr, insn))
+                for reloc in insn.relocs:
+                    out.append(f"\t\t\t{addr:x}: {reloc}")
+                addr += insn.size
+                fn_lines += 1 + len(insn.relocs)
+        return "\n".join(out)
+
+
+class MipsGenerator(DumpGenerator):
+    arch = "mips"
+    REGS = ["v0", "v1", "a0", "a1", "a2", "a3", "t0", "t1", "t6", "t7", "s0", "s1"]
+
+    def reg(self) -> str:
+        return self.rng.choice(self.REGS)
+
+    def instructions(self, addr: int) -> List[Insn]:
+        r = self.rng.random()
+        rng = self.rng
+        if r < 0.15:
+            sym = self.sym()
+            return [
+                Insn("lui", f"{self.reg()},0x0", 4, [f"R_MIPS_HI16\t{sym}"]),
+                Insn("lw", f"{self.reg()},0({self.reg()})", 4, [f"R_MIPS_LO16\t{sym}"]),
+            ]
+        if r < 0.25:
+            return [
+                Insn("jal", "0 <func>", 4, [f"R_MIPS_26\tfunc_{rng.randrange(999)}"]),
+                Insn("nop", "", 4, []),
+            ]
+        if r < 0.4:
+            return [
+                Insn("beqz", f"{self.reg()},{self.target(addr)}", 4, []),
+                Insn("nop", "", 4, []),
+            ]
+        if r < 0.55:
+            op = rng.choice(["lw", "sw"])
+            return [Insn(op, f"{self.reg()},{rng.randrange(0, 64, 4)}(sp)", 4, [])]
+        if r < 0.58:
+            return [
+                Insn("lw", "at,0(at)", 4, [f"R_MIPS_LO16\tjtbl_{addr:x}"]),
+                Insn("jr", "at", 4, []),
+                Insn("nop", "", 4, []),
+            ]
+        op = rng.choice(["addu", "subu", "or", "and", "sll", "addiu"])
+        if op in ("sll", "addiu"):
+            return [Insn(op, f"{self.reg()},{self.reg()},{rng.randrange(32)}", 4, [])]
+        return [Insn(op, f"{self.reg()},{self.reg()},{self.reg()}", 4, [])]
+
+
+class MipsPicGenerator(MipsGenerator):
+    """Position-independent code, where data and calls go through the GOT."""
+
+    def instructions(self, addr: int) -> List[Insn]:
+        r = self.rng.random()
+        rng = self.rng
+        if r < 0.25:
+            sym = self.sym()
+            reg = self.reg()
+            return [
+                Insn("lw", f"{reg},0(gp)", 4, [f"R_MIPS_GOT16\t{sym}"]),
+                Insn("addiu", f"{reg},{reg},0", 4, [f"R_MIPS_LO16\t{sym}"]),
+            ]
+        if r < 0.45:
+            func = f"func_{rng.randrange(999)}"
+            return [
+                Insn("lw", "t9,0(gp)", 4, [f"R_MIPS_CALL16\t{func}"]),
+                Insn("jalr", "t9", 4, [f"R_MIPS_JALR\t{func}"]),
+                Insn("nop", "", 4, []),
+            ]
+        if r < 0.6:
+            op = rng.choice(["lw", "sw"])
+            return [
+                Insn(op, f"{self.reg()},0(gp)", 4, [f"R_MIPS_GPREL16\t{self.sym()}"])
+            ]
+        return super().instructions(addr)
+
+
+class PpcGenerator(DumpGenerator):
+    arch = "ppc"
+
+    def reg(self) -> str:
+        return f"r{self.rng.randrange(3, 32)}"
+
+    def raw_bytes(self, size: int) -> str:
+        return " ".join(f"{self.rng.randrange(256):02x}" for _ in range(size))
+
+    def instructions(self, addr: int) -> List[Insn]:
+        r = self.rng.random()
+        rng = self.rng
+        if r < 0.15:
+            sym = self.sym()
+            reg = self.reg()
+            return [
+                Insn("lis", f"{reg},0", 4, [f"R_PPC_ADDR16_HA\t{sym}"]),
+                Insn("addi", f"{reg},{reg},0", 4, [f"R_PPC_ADDR16_LO\t{sym}"]),
+            ]
+        if r < 0.25:
+            return [
+                Insn(
+                    "bl",
+                    f"{addr:x} <{self.fn_name}+0x{addr - self.fn_start:x}>",
+                    4,
+                    [f"R_PPC_REL24\tfunc_{rng.randrange(999)}"],
+                )
+            ]
+        if r < 0.4:
+            return [
+                Insn(rng.choice(["beq", "bne", "blt", "b"]), self.target(addr), 4, [])
+            ]
+        if r < 0.55:
+            op = rng.choice(["lwz", "stw"])
+            return [Insn(op, f"{self.reg()},{rng.randrange(8, 64, 4)}(r1)", 4, [])]
+        if r < 0.58:
+            return [
+                Insn("mtctr", self.reg(), 4, []),
+                Insn("bctr", "", 4, []),
+            ]
+        op = rng.choice(["add", "subf", "or", "and", "mullw"])
+        return [Insn(op, f"{self.reg()},{self.reg()},{self.reg()}", 4, [])]
+
+
+class PpcSdaGenerator(PpcGenerator):
+    """Code with small data area accesses and GCC-style local branches, which
+    are relocated against .text."""
+
+    def instructions(self, addr: int) -> List[Insn]:
+        r = self.rng.random()
+        rng = self.rng
+        if r < 0.3:
+            base = rng.choice(["r2", "r13"])
+            op = rng.choice(["lwz", "stw", "lfs"])
+            return [
+                Insn(
+                    op, f"{self.reg()},0({base})", 4, [f"R_PPC_EMB_SDA21\t{self.sym()}"]
+                )
+            ]
+        if r < 0.35:
+            return [
+                Insn("li", f"{self.reg()},0", 4, [f"R_PPC_EMB_SDA21\t{self.sym()}"])
+            ]
+        if r < 0.5:
+            dest = self.target(addr).split()[0]
+            op = rng.choice(["bl", "b"])
+            return [Insn(op, "0", 4, [f"R_PPC_REL24\t.text+0x{dest}"])]
+        if r < 0.6:
+            dest = self.target(addr).split()[0]
+            op = rng.choice(["beq", "bne", "bge"])
+            return [Insn(op, "cr7,0", 4, [f"R_PPC_REL14\t.text+0x{dest}"])]
+        return super().instructions(addr)
+
+
+class AArch64Generator(DumpGenerator):
+    arch = "aarch64"
+    raw_insn = False
+
+    def reg(self) -> str:
+        return f"{self.rng.choice('xw')}{self.rng.randrange(31)}"
+
+    def instructions(self, addr: int) -> List[Insn]:
+        r = self.rng.random()
+        rng = self.rng
+        if r < 0.15:
+            sym = self.sym()
+            reg = f"x{rng.randrange(31)}"
+            return [
+                Insn(
+                    "adrp",
+                    f"{reg}, 0 <{self.fn_name}>",
+                    4,
+                    [f"R_AARCH64_ADR_PREL_PG_HI21\t{sym}"],
+                ),
+                Insn(
+                    "add",
+                    f"{reg}, {reg}, #0x0",
+                    4,
+                    [f"R_AARCH64_ADD_ABS_LO12_NC\t{sym}"],
+                ),
+            ]
+        if r < 0.25:
+            return [
+                Insn(
+                    "bl",
+                    f"0 <{self.fn_name}>",
+                    4,
+                    [f"R_AARCH64_CALL26\tfunc_{rng.randrange(999)}"],
+                )
+            ]
+        if r < 0.4:
+            return [
+                Insn(rng.choice(["b.eq", "b.ne", "cbz", "b"]), self.target(addr), 4, [])
+            ]
+        if r < 0.55:
+            op = rng.choice(["ldr", "str"])
+            return [Insn(op, f"{self.reg()}, [sp, #{rng.randrange(8, 128, 8)}]", 4, [])]
+        if r < 0.58:
+            reg = f"x{rng.randrange(31)}"
+            return [
+                Insn(
+                    "ldrb",
+                    f"w{rng.randrange(31)}, [{reg}, w{rng.randrange(31)}, uxtw]",
+                    4,
+                    [],
+                ),
+                Insn("br", reg, 4, []),
+            ]
+        op = rng.choice(["add", "sub", "orr", "and", "mul"])
+        return [Insn(op, f"{self.reg()}, {self.reg()}, {self.reg()}", 4, [])]
+
+
+class Arm32Generator(DumpGenerator):
+    """Thumb code with data pools and .short jump tables."""
+
+    arch = "arm32"
+    word_size = 2
+
+    def reg(self) -> str:
+        return f"r{self.rng.randrange(8)}"
+
+    def instructions(self, addr: int) -> List[Insn]:
+        r = self.rng.random()
+        rng = self.rng
+        if r < 0.1:
+            # Load from a data pool right after a branch over it
+            pool = addr + 4
+            return [
+                Insn(
+                    "ldr",
+                    f"{self.reg()}, [pc, #0]\t; ({pool:x} <{self.fn_name}+0x{pool - self.fn_start:x}>)",
+                    2,
+                    [],
+                ),
+                Insn(
+                    "b.n",
+                    f"{pool + 4:x} <{self.fn_name}+0x{pool + 4 - self.fn_start:x}>",
+                    2,
+                    [],
+                ),
+                Insn(".word", "0x00000000", 4, [f"R_ARM_ABS32\t{self.sym()}"]),
+            ]
+        if r < 0.2:
+            return [
+                Insn(
+                    "bl",
+                    f"0 <{self.fn_name}>",
+                    4,
+                    [f"R_ARM_THM_CALL\tfunc_{rng.randrange(999)}"],
+                )
+            ]
+        if r < 0.35:
+            return [
+                Insn(
+                    rng.choice(["beq.n", "bne.n", "bgt.n", "b.n"]),
+                    self.target(addr),
+                    2,
+                    [],
+                )
+            ]
+        if r < 0.5:
+            op = rng.choice(["ldr", "str"])
+            return [Insn(op, f"{self.reg()}, [sp, #{rng.randrange(0, 64, 4)}]", 2, [])]
+        if r < 0.52:
+            count = rng.randrange(2, 12)
+            ret = [
+                Insn("cmp", f"{self.reg()}, #{count - 1}", 2, []),
+                Insn("bhi.n", self.target(addr), 2, []),
+                Insn("add", f"pc, {self.reg()}", 2, []),
+            ]
+            ret += [
+                Insn(".short", f"0x{rng.randrange(0, 0x80, 2):04x}", 2, [])
+                for _ in range(count)
+            ]
+            return ret
+        op = rng.choice(["adds", "subs", "orrs", "ands", "lsls"])
+        if op == "lsls":
+            return [
+                Insn(op, f"{self.reg()}, {self.reg()}, #{rng.randrange(32)}", 2, [])
+            ]
+        return [Insn(op, f"{self.reg()}, {self.reg()}, {self.reg()}", 2, [])]
+
+    def raw_bytes(self, size: int) -> str:
+        return super().raw_bytes(size).ljust(8)
+
+
+class ThumbSwitchGenerator(Arm32Generator):
+    """Large Thumb functions with many switch statements bounds checked
+    against a register, for which no number of cases can be found, and "cmp
+    rN, #0" null checks."""
+
+    function_lines = 25000
+
+    def instructions(self, addr: int) -> List[Insn]:
+        r = self.rng.random()
+        rng = self.rng
+        if r < 0.05:
+            return [Insn("cmp", f"{self.reg()}, #0", 2, [])]
+        if r < 0.1:
+            ret = [
+                Insn("cmp", f"{self.reg()}, {self.reg()}", 2, []),
+                Insn("bhi.n", self.target(addr), 2, []),
+                Insn("add", f"pc, {self.reg()}", 2, []),
+            ]
+            ret += [
+                Insn(".short", f"0x{rng.randrange(0, 0x80, 2):04x}", 2, [])
+                for _ in range(rng.randrange(2, 12))
+            ]
+            return ret
+        while True:
+            # Skip Arm32Generator's switches, whose immediate bounds would be
+            # picked up by the following ones
+            insns = super().instructions(addr)
+            if insns[0].mnemonic != "cmp":
+                return insns
+
+
+class X86Generator(DumpGenerator):
+    arch = "i686"
+    raw_insn = False
+    word_size = 1
+
+    def reg(self) -> str:
+        return "%" + self.rng.choice(["eax", "ebx", "ecx", "edx", "esi", "edi"])
+
+    def instructions(self, addr: int) -> List[Insn]:
+        r = self.rng.random()
+        rng = self.rng
+        if r < 0.15:
+            return [Insn("mov", f"0x0,{self.reg()}", 5, [f"R_386_32\t{self.sym()}"])]
+        if r < 0.25:
+            return [
+                Insn(
+                    "call",
+                    f"{addr + 1:x} <{self.fn_name}+0x{addr + 1 - self.fn_start:x}>",
+                    5,
+                    [f"R_386_PC32\tfunc_{rng.randrange(999)}"],
+                )
+            ]
+        if r < 0.4:
+            return [
+                Insn(rng.choice(["je", "jne", "jg", "jmp"]), self.target(addr), 2, [])
+            ]
+        if r < 0.55:
+            return [
+                Insn("mov", f"-0x{rng.randrange(4, 64, 4):x}(%ebp),{self.reg()}", 3, [])
+            ]
+        if r < 0.58:
+            return [Insn("jmp", f"*0x0(,{self.reg()},4)", 7, ["R_386_32\t.rodata"])]
+        op = rng.choice(["add", "sub", "or", "and", "imul"])
+        return [Insn(op, f"{self.reg()},{self.reg()}", 2, [])]
+
+
+class Sh2Generator(DumpGenerator):
+    """SH2 code with pc-relative pools and mova/braf jump tables."""
+
+    arch = "sh2"
+    word_size = 2
+
+    def reg(self) -> str:
+        return f"r{self.rng.randrange(15)}"
+
+    def raw_bytes(self, size: int) -> str:
+        return " ".join(f"{self.rng.randrange(256):02x}" for _ in range(size)).ljust(12)
+
+    def instructions(self, addr: int) -> List[Insn]:
+        r = self.rng.random()
+        rng = self.rng
+        if r < 0.1:
+            # Pool load, a branch over the pool, and the pool entry
+            pool = (addr + 8) & ~3
+            if pool < addr + 6:
+                pool += 4
+            after = pool + 4
+            ret = [
+                Insn(
+                    "mov.l",
+                    f"{pool:x} <{self.fn_name}+0x{pool - self.fn_start:x}>,{self.reg()}\t! 0",
+                    2,
+                    [],
+                ),
+                Insn(
+                    "bra",
+                    f"{after:x} <{self.fn_name}+0x{after - self.fn_start:x}>",
+                    2,
+                    [],
+                ),
+                Insn("nop", "", 2, []),
+            ]
+            if addr + 6 < pool:
+                ret.append(Insn("nop", "", 2, []))
+            ret.append(Insn(".word", "0x0000", 2, [f"R_SH_DIR32\t{self.sym()}"]))
+            ret.append(Insn(".word", "0x0000", 2, []))
+            return ret
+        if r < 0.13:
+            count = rng.randrange(2, 10)
+            reg = self.reg()
+            table = (addr + 16) & ~3
+            ret = [
+                Insn("mov", f"#{count - 1},{reg}", 2, []),
+                Insn("cmp/hi", f"{reg},r4", 2, []),
+                Insn("bt", self.target(addr), 2, []),
+                Insn(
+                    "mova",
+                    f"{table:x} <{self.fn_name}+0x{table - self.fn_start:x}>,r0",
+                    2,
+                    [],
+                ),
+                Insn("add", "r4,r4", 2, []),
+                Insn("mov.w", "@(r0,r4),r0", 2, []),
+                Insn("braf", "r0", 2, []),
+                Insn("nop", "", 2, []),
+            ]
+            if addr + 16 < table:
+                ret.append(Insn("nop", "", 2, []))
+            ret += [
+                Insn("mov.l", f"r{rng.randrange(8)},@r{rng.randrange(8)}", 2, [])
+                for _ in range(count)
+            ]
+            return ret
+        if r < 0.2:
+            return [
+                Insn("jsr", f"@{self.reg()}", 2, []),
+                Insn("nop", "", 2, []),
+            ]
+        if r < 0.35:
+            return [Insn(rng.choice(["bt", "bf", "bra"]), self.target(addr), 2, [])]
+        if r < 0.5:
+            return [
+                Insn("mov.l", f"@({rng.randrange(0, 60, 4)},r15),{self.reg()}", 2, [])
+            ]
+        op = rng.choice(["add", "sub", "or", "and", "shll", "mov"])
+        if op == "shll":
+            return [Insn(op, self.reg(), 2, [])]
+        return [Insn(op, f"{self.reg()},{self.reg()}", 2, [])]
+
+
+class Sh2ObjectGenerator(Sh2Generator):
+    """A large unlinked SH2 object, with relocated calls and word pools on top
+    of Sh2Generator's code."""
+
+    function_lines = 25000
+
+    def instructions(self, addr: int) -> List[Insn]:
+        r = self.rng.random()
+        rng = self.rng
+        if r < 0.05:
+            after = addr + 4
+            return [
+                Insn(
+                    "bsr",
+                    f"{after:x} <{self.fn_name}+0x{after - self.fn_start:x}>",
+                    2,
+                    [f"R_SH_IND12W\t_func_{rng.randrange(999)}-0x4"],
+                ),
+                Insn("nop", "", 2, []),
+            ]
+        if r < 0.1:
+            # Word pool load, a branch over the pool, and the pool entry
+            value = rng.randrange(0x10000)
+            pool = addr + 6
+            after = pool + 2
+            return [
+                Insn(
+                    "mov.w",
+                    f"{pool:x} <{self.fn_name}+0x{pool - self.fn_start:x}>,{self.reg()}\t! {value:x}",
+                    2,
+                    [],
+                ),
+                Insn(
+                    "bra",
+                    f"{after:x} <{self.fn_name}+0x{after - self.fn_start:x}>",
+                    2,
+                    [],
+                ),
+                Insn("nop", "", 2, []),
+                Insn(".word", f"0x{value:04x}", 2, []),
+            ]
+        return super().instructions(addr)
+
+
+class Sh4Generator(Sh2Generator):
+    arch = "sh4"
+
+    def instructions(self, addr: int) -> List[Insn]:
+        if self.rng.random() < 0.1:
+            return [
+                Insn(
+                    "fmov.s",
+                    f"@r{self.rng.randrange(8)},fr{self.rng.randrange(16)}",
+                    2,
+                    [],
+                )
+            ]
+        return super().instructions(addr)
+
+
+class M68kGenerator(DumpGenerator):
+    arch = "m68k"
+    word_size = 2
+
+    def reg(self) -> str:
+        return "%" + self.rng.choice(["d0", "d1", "d2", "d3", "a0", "a1", "a2"])
+
+    def raw_bytes(self, size: int) -> str:
+        return " ".join(
+            f"{self.rng.randrange(0x10000):04x}" for _ in range(size // 2)
+        ).ljust(14)
+
+    def row(self, addr: int, insn: Insn) -> str:
+        # m68k objdump separates the mnemonic and arguments by a space
+        return f"{addr:>4x}:\t{self.raw_bytes(insn.size)}\t{insn.mnemonic} {insn.args}"
+
+    def instructions(self, addr: int) -> List[Insn]:
+        r = self.rng.random()
+        rng = self.rng
+        if r < 0.15:
+            return [Insn("movel", f"0x0,{self.reg()}", 6, [f"R_68K_32\t{self.sym()}"])]
+        if r < 0.25:
+            return [Insn("jsr", "0x0", 6, [f"R_68K_32\tfunc_{rng.randrange(999)}"])]
+        if r < 0.4:
+            return [
+                Insn(rng.choice(["beqs", "bnes", "bras"]), self.target(addr), 2, [])
+            ]
+        if r < 0.55:
+            return [
+                Insn("movel", f"%fp@(-{rng.randrange(4, 64, 4)}),{self.reg()}", 4, [])
+            ]
+        op = rng.choice(["addl", "subl", "orl", "andl"])
+        return [Insn(op, f"{self.reg()},{self.reg()}", 2, [])]
+
+
+GENERATORS: Dict[str, Type[DumpGenerator]] = {
+    "mips": MipsGenerator,
+    "mips-pic": MipsPicGenerator,
+    "ppc": PpcGenerator,
+    "ppc-sda": PpcSdaGenerator,
+    "aarch64": AArch64Generator,
+    "arm32": Arm32Generator,
+    "thumb-switch": ThumbSwitchGenerator,
+    "x86": X86Generator,
+    "sh2": Sh2Generator,
+    "sh2-object": Sh2ObjectGenerator,
+    "sh4": Sh4Generator,
+    "m68k": M68kGenerator,
+}
+
+
+# Instructions that mutate() may change or drop without confusing the
+# arch-specific preprocessing of pools, jump tables and relocations
+MUTABLE_MNEMONICS = {
+    "add",
+    "addu",
+    "subu",
+    "sub",
+    "subf",
+    "or",
+    "orr",
+    "and",
+    "mullw",
+    "mul",
+    "adds",
+    "subs",
+    "orrs",
+    "ands",
+    "imul",
+    "addl",
+    "subl",
+    "orl",
+    "andl",
+}
+
+
+def mutate(dump: str, seed: int) -> str:
+    """Derive a "current" dump with some register changes and missing lines."""
+    rng = random.Random(seed)
+    out = []
+    for line in dump.split("\n"):
+        parts = line.split("\t")
+        mnemonic = parts[-1].split(" ")[0] if len(parts) < 3 else parts[-2].strip()
+        if line.startswith("\t") or mnemonic not in MUTABLE_MNEMONICS:
+            out.append(line)
+            continue
+        r = rng.random()
+        if r < 0.03:
+            continue
+        if r < 0.15:
+            parts[-1] = parts[-1].replace("1", "2", 1)
+            if len(parts) >= 4:
+                # Keep the instruction bytes in sync, like a real recompile.
+                raw = parts[1].rstrip()
+                digit = "{:x}".format((int(raw[-1], 16) + 1) % 16)
+                parts[1] = raw[:-1] + digit + parts[1][len(raw) :]
+        out.append("\t".join(parts))
+    return "\n".join(out)
+
+
+def best_time(fn: Callable[[], object], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def bench_arch(arch_name: str, num_lines: int, repeat: int) -> Dict[str, float]:
+    generator = GENERATORS[arch_name](seed=num_lines)
+    config = diff.make_config(generator.arch)
+    config.max_function_size_lines = num_lines * 2
+    base_raw = generator.generate(num_lines)
+    my_raw = mutate(base_raw, seed=num_lines)
+
+    def preprocess(raw: str) -> str:
+        return config.arch.proc(config).preprocess_objdump(raw)
+
+    base_dump = preprocess(base_raw)
+    my_dump = preprocess(my_raw)
+    base_lines = diff.process(base_dump, config)
+    my_lines = diff.process(my_dump, config)
+    errors = [line.original for line in base_lines if line.mnemonic == "ERROR"]
+    if errors:
+        raise Exception(f"{arch_name}: failed to process generated dump: {errors[0]}")
+
+    parsed_dump = diff.parse_dump(base_dump, config)
+    results = {
+        "preprocess": best_time(lambda: preprocess(base_raw), repeat),
+        "parse": best_time(lambda: diff.parse_dump(base_dump, config), repeat),
+        "process": best_time(lambda: diff.process(base_dump, config), repeat),
+        "process_parsed": best_time(lambda: diff.process(parsed_dump, config), repeat),
+    }
+
+    def run_do_diff() -> diff.Diff:
+        return diff.do_diff(base_lines, diff.process(my_dump, config), config)
+
+    results["do_diff"] = best_time(run_do_diff, repeat)
+    diff_output = run_do_diff()
+    data = diff.align_diffs(diff_output, diff_output, config)
+    formatters: List[Tuple[str, diff.Formatter]] = [
+        ("plain", diff.PlainFormatter(column_width=50)),
+        ("color", diff.AnsiFormatter(column_width=50)),
+        ("html", diff.HtmlFormatter()),
+        ("json", diff.JsonFormatter(arch_str=config.arch.name)),
+    ]
+    for name, formatter in formatters:
+        results[f"format_{name}"] = best_time(lambda: formatter.table(data), repeat)
+
+    def run_score() -> int:
+        diffed = diff.diff_lines(base_lines, my_lines, config.algorithm, config.arch)
+        return diff.score_diff_lines(diffed, config, {})
+
+    results["score"] = best_time(run_score, repeat)
+    target = diff.PreparedTarget(base_lines, config)
+    results["prepared_score"] = best_time(lambda: target.score(my_lines), repeat)
+    return results
+
+
+def bench_case(case: corpus.CorpusCase, repeat: int) -> Dict[str, float]:
+    config = corpus.case_config(case, "json")
+    base_lines = diff.process(case.base, config)
+    results = {
+        "process": best_time(
+            lambda: (
+                diff.process(case.base, config),
+                diff.process(case.current, config),
+            ),
+            repeat,
+        ),
+        "do_diff": best_time(
+            lambda: diff.do_diff(
+                base_lines, diff.process(case.current, config), config
+            ),
+            repeat,
+        ),
+    }
+    for fmt in corpus.EXPECTED_FILES:
+        results[f"total_{fmt}"] = best_time(lambda: corpus.run_case(case, fmt), repeat)
+    return results
+
+
+def record(results: Dict[str, float], key: str, seconds: float) -> None:
+    results[key] = seconds
+    print(f"{key:<40} {seconds * 1000:>10.2f} ms", flush=True)
+
+
+def bench_import(repeat: int) -> Dict[str, float]:
+    """Time `import diff` in new interpreters with python -X importtime, with
+    bytecode cached as it would be for an installed copy."""
+    best: Dict[str, float] = {}
+    with tempfile.TemporaryDirectory() as pycache:
+        env = dict(os.environ, PYTHONPYCACHEPREFIX=pycache)
+        env.pop("PYTHONDONTWRITEBYTECODE", None)
+        # The first run writes the bytecode cache
+        for i in range(repeat + 1):
+            proc = subprocess.run(
+                [sys.executable, "-X", "importtime", "-c", "import diff"],
+                cwd=os.path.dirname(os.path.abspath(__file__)),
+                env=env,
+                stderr=subprocess.PIPE,
+                universal_newlines=True,
+                check=True,
+            )
+            if i == 0:
+                continue
+            for line in proc.stderr.splitlines():
+                # import time: self [us] | cumulative | imported package
+                fields = line.split(":", 1)[1].split("|")
+                if fields[2].strip() == "diff":
+                    for stage, us in [("self", fields[0]), ("total", fields[1])]:
+                        seconds = int(us) / 1e6
+                        best[stage] = min(best.get(stage, seconds), seconds)
+    return {"import_self": best["self"], "import_total": best["total"]}
+
+
+def run(arches: List[str], sizes: List[int], repeat: int) -> Dict[str, float]:
+    results: Dict[str, float] = {}
+    for stage, seconds in bench_import(repeat).items():
+        record(results, f"startup/{stage}", seconds)
+    for arch_name in arches:
+        for num_lines in sizes:
+            for stage, seconds in bench_arch(arch_name, num_lines, repeat).items():
+                record(results, f"{arch_name}/{num_lines}/{stage}", seconds)
+    return results
+
+
+def run_corpus(directory: str, repeat: int) -> Dict[str, float]:
+    results: Dict[str, float] = {}
+    for case in corpus.load_cases(directory):
+        errors = corpus.check_case(case)
+        if errors:
+            raise Exception(f"Corpus output does not match:\n{errors[0]}")
+        for stage, seconds in bench_case(case, repeat).items():
+            record(results, f"corpus/{case.name}/{stage}", seconds)
+    return results
+
+
+def compare(
+    results: Dict[str, float],
+    baseline: Dict[str, float],
+    threshold: float,
+    min_diff: float,
+) -> List[str]:
+    regressions = []
+    for key, seconds in results.items():
+        old = baseline.get(key)
+        if old is None:
+            continue
+        if seconds > old * (1 + threshold) and seconds - old > min_diff:
+            regressions.append(
+                f"{key}: {old * 1000:.2f} ms -> {seconds * 1000:.2f} ms "
+                f"(+{(seconds / old - 1) * 100:.0f}%)"
+            )
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the diff.py pipeline.")
+    parser.add_argument(
+        "--arch",
+        action="append",
+        choices=list(GENERATORS),
+        help="Architecture to benchmark (repeatable). Defaults to all.",
+    )
+    parser.add_argument(
+        "--sizes",
+        type=lambda s: [int(x) for x in s.split(",")],
+        default=DEFAULT_SIZES,
+        help="Comma-separated dump sizes in lines, default %(default)s.",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=3,
+        help="Take the best of this many runs, default %(default)s.",
+    )
+    parser.add_argument(
+        "--corpus",
+        metavar="DIR",
+        help="Time the recorded cases in a corpus directory (see corpus.py) "
+        "instead of synthetic dumps, after checking their output.",
+    )
+    parser.add_argument("--save", metavar="FILE", help="Save results as JSON.")
+    parser.add_argument(
+        "--compare",
+        metavar="FILE",
+        help="Compare against results saved with --save, and exit with an error on regressions.",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.25,
+        help="Relative slowdown that counts as a regression, default %(default)s.",
+    )
+    parser.add_argument(
+        "--min-diff-ms",
+        type=float,
+        default=1.0,
+        help="Ignore slowdowns smaller than this, default %(default)s ms.",
+    )
+    args = parser.parse_args()
+
+    if args.corpus:
+        results = run_corpus(args.corpus, args.repeat)
+    else:
+        results = run(args.arch or list(GENERATORS), args.sizes, args.repeat)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(
+                {"python": platform.python_version(), "results": results},
+                f,
+                indent=2,
+            )
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(
+            results, baseline, args.threshold, args.min_diff_ms / 1000
+        )
+        if regressions:
+            print("Regressions:", file=sys.stderr)
+            for regression in regressions:
+                print("  " + regression, file=sys.stderr)
+            sys.exit(1)
+        print("No regressions.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+Regression tests against a corpus of recorded dumps.
+
+Each case is a directory containing base.s and current.s, as written by
+--write-asm, and a case.json giving the architecture, options for
+diff.make_config and the output formats to check, e.g.
+
+    {"arch": "sh2", "options": {"ignore_addr_diffs": true}, "formats": ["json"]}
+
+The expected output for each format is stored next to these as
+expected.json, expected.txt (plain) or expected.html.
+
+    ./corpus.py                     # check all cases in corpus/
+    ./corpus.py --update            # rewrite the expected outputs
+    ./benchmark.py --corpus corpus  # time the cases
+"""
+import argparse
+from dataclasses import dataclass
+import difflib
+import json
+import os
+import sys
+from typing import Any, Dict, List, Optional
+
+import diff
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "corpus")
+
+EXPECTED_FILES = {
+    "json": "expected.json",
+    "plain": "expected.txt",
+    "html": "expected.html",
+}
+
+
+@dataclass
+class CorpusCase:
+    name: str
+    path: str
+    arch: str
+    options: Dict[str, Any]
+    formats: List[str]
+    base: str
+    current: str
+
+    def expected_path(self, fmt: str) -> str:
+        return os.path.join(self.path, EXPECTED_FILES[fmt])
+
+
+def read_file(path: str) -> str:
+    with open(path, encoding="utf-8") as f:
+        return f.read()
+
+
+def load_case(path: str) -> CorpusCase:
+    with open(os.path.join(path, "case.json")) as f:
+        spec = json.load(f)
+    formats = spec.get("formats", ["json"])
+    for fmt in formats:
+        if fmt not in EXPECTED_FILES:
+            raise ValueError(f"{path}: unsupported format {fmt}")
+    return CorpusCase(
+        name=os.path.basename(os.path.normpath(path)),
+        path=path,
+        arch=spec["arch"],
+        options=spec.get("options", {}),
+        formats=formats,
+        base=read_file(os.path.join(path, "base.s")),
+        current=read_file(os.path.join(path, "current.s")),
+    )
+
+
+def load_cases(directory: str, names: Optional[List[str]] = None) -> List[CorpusCase]:
+    cases = []
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if not os.path.isfile(os.path.join(path, "case.json")):
+            continue
+        if names and name not in names:
+            continue
+        cases.append(load_case(path))
+    return cases
+
+
+def make_formatter(fmt: str, arch: str) -> diff.Formatter:
+    if fmt == "json":
+        return diff.JsonFormatter(arch_str=arch)
+    if fmt == "html":
+        return diff.HtmlFormatter()
+    return diff.PlainFormatter(column_width=50)
+
+
+def case_config(case: CorpusCase, fmt: str) -> diff.Config:
+    config = diff.make_config(case.arch, **case.options)
+    config.formatter = make_formatter(fmt, config.arch.name)
+    return config
+
+
+def run_case(case: CorpusCase, fmt: str) -> str:
+    """The output of diff.py for the case, as with --base-asm and --format."""
+    display = diff.Display(case.base, case.current, case_config(case, fmt))
+    return display.run_diff()[0]
+
+
+def check_case(case: CorpusCase) -> List[str]:
+    """Compare the output of a case against its expected outputs, and return
+    a description of each mismatch."""
+    errors = []
+    for fmt in case.formats:
+        path = case.expected_path(fmt)
+        if not os.path.exists(path):
+            errors.append(f"{case.name}: missing {EXPECTED_FILES[fmt]}")
+            continue
+        expected = read_file(path)
+        output = run_case(case, fmt)
+        if output != expected:
+            udiff = difflib.unified_diff(
+                expected.splitlines(),
+                output.splitlines(),
+                EXPECTED_FILES[fmt],
+                "output",
+                lineterm="",
+            )
+            errors.append(
+                f"{case.name}: {fmt} output differs\n" + "\n".join(list(udiff)[:40])
+            )
+    return errors
+
+
+def update_case(case: CorpusCase) -> None:
+    for fmt in case.formats:
+        with open(case.expected_path(fmt), "w", encoding="utf-8") as f:
+            f.write(run_case(case, fmt))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Check diff.py output against a corpus of recorded dumps."
+    )
+    parser.add_argument(
+        "names", nargs="*", metavar="CASE", help="Cases to run. Defaults to all."
+    )
+    parser.add_argument(
+        "--dir",
+        default=CORPUS_DIR,
+        help="Corpus directory, default corpus/ next to this script.",
+    )
+    parser.add_argument(
+        "--update",
+        action="store_true",
+        help="Write the current output as the expected output.",
+    )
+    args = parser.parse_args()
+
+    cases = load_cases(args.dir, args.names)
+    if not cases:
+        print(f"No cases found in {args.dir}.", file=sys.stderr)
+        sys.exit(1)
+
+    if args.update:
+        for case in cases:
+            update_case(case)
+        print(f"Updated {len(cases)} cases.")
+        return
+
+    failures = 0
+    for case in cases:
+        errors = check_case(case)
+        for error in errors:
+            print(error, file=sys.stderr)
+        if errors:
+            failures += 1
+    if failures:
+        print(f"{failures} of {len(cases)} cases failed.", file=sys.stderr)
+        sys.exit(1)
+    print(f"All {len(cases)} cases passed.")
+
+
+if __name__ == "__main__":
+    main()
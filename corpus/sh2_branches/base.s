@@ -0,0 +1,14 @@
+func():
+   0:	8d 02       	bt.s	8 <lab_0606B780>
+   2:	6e f3       	mov	r15,r14
+   4:	a0 01       	bra	a <lab_0606B8E0>
+   6:	00 09       	nop	
+
+00000008 <lab_0606B780>:
+lab_0606B780():
+   8:	db 32       	mov.l	@(0xcc,pc),r11 ! d4
+
+0000000a <lab_0606B8E0>:
+lab_0606B8E0():
+   a:	00 0b       	rts	
+   c:	00 09       	nop	
\ No newline at end of file
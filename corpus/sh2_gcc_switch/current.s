@@ -0,0 +1,33 @@
+00000000 <_jtbl_test>:
+   0:	2f e6       	mov.l	r14,@-r15
+   2:	e1 05       	mov	#5,r1
+   4:	34 16       	cmp/hi	r1,r4
+   6:	8d 17       	bt.s	38 <_jtbl_test+0x38>
+   8:	6d f3       	mov	r15,r13
+   a:	61 43       	mov	r4,r1
+   c:	31 1c       	add	r1,r1
+   e:	c7 02       	mova	@(0xa,pc),r0 ! 18
+  10:	01 1d       	mov.w	@(r0,r1),r1
+  12:	30 1c       	add	r1,r0
+  14:	40 2b       	jmp	@r0
+  16:	00 09       	nop	
+  18:	00 10       	.word 0x0010 ! tgt 28
+  1a:	00 1c       	.word 0x001c ! tgt 34
+  1c:	00 1c       	.word 0x001c ! tgt 34
+  1e:	00 0c       	.word 0x000c ! tgt 24
+  20:	00 14       	.word 0x0014 ! tgt 2c
+  22:	00 18       	.word 0x0018 ! tgt 30
+  24:	a0 09       	bra	3a <_jtbl_test+0x3a>
+  26:	e0 01       	mov	#1,r0
+  28:	a0 07       	bra	3a <_jtbl_test+0x3a>
+  2a:	e0 02       	mov	#2,r0
+  2c:	a0 05       	bra	3a <_jtbl_test+0x3a>
+  2e:	e0 05       	mov	#5,r0
+  30:	a0 03       	bra	3a <_jtbl_test+0x3a>
+  32:	e0 06       	mov	#6,r0
+  34:	a0 01       	bra	3a <_jtbl_test+0x3a>
+  36:	e0 00       	mov	#0,r0
+  38:	e0 ff       	mov	#-1,r0
+  3a:	6f e3       	mov	r14,r15
+  3c:	00 0b       	rts	
+  3e:	6e f6       	mov.l	@r15+,r14
\ No newline at end of file
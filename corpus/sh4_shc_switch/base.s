@@ -0,0 +1,45 @@
+00000000 <_jtbl_test>:
+_jtbl_test():
+   0:	43 60       	mov	r4,r0
+   2:	10 e1       	mov	#16,r1
+   4:	12 30       	cmp/hs	r1,r0
+   6:	23 89       	bt	50 <_jtbl_test+0x50>
+   8:	00 40       	shll	r0
+   a:	03 61       	mov	r0,r1
+   c:	01 c7       	mova	@(0x8,pc),r0 ! 14
+   e:	1d 00       	mov.w	@(r0,r1),r0
+  10:	23 00       	braf	r0
+  12:	09 00       	nop	
+  14:	20 00       	.word 0x0020 ! tgt 34
+  16:	24 00       	.word 0x0024 ! tgt 38
+  18:	28 00       	.word 0x0028 ! tgt 3c
+  1a:	2c 00       	.word 0x002c ! tgt 40
+  1c:	30 00       	.word 0x0030 ! tgt 44
+  1e:	34 00       	.word 0x0034 ! tgt 48
+  20:	34 00       	.word 0x0034 ! tgt 48
+  22:	34 00       	.word 0x0034 ! tgt 48
+  24:	34 00       	.word 0x0034 ! tgt 48
+  26:	34 00       	.word 0x0034 ! tgt 48
+  28:	34 00       	.word 0x0034 ! tgt 48
+  2a:	34 00       	.word 0x0034 ! tgt 48
+  2c:	38 00       	.word 0x0038 ! tgt 4c
+  2e:	38 00       	.word 0x0038 ! tgt 4c
+  30:	38 00       	.word 0x0038 ! tgt 4c
+  32:	38 00       	.word 0x0038 ! tgt 4c
+  34:	0b 00       	rts	
+  36:	02 e0       	mov	#2,r0
+  38:	04 a0       	bra	44 <_jtbl_test+0x44>
+  3a:	09 00       	nop	
+  3c:	0b 00       	rts	
+  3e:	00 e0       	mov	#0,r0
+  40:	0b 00       	rts	
+  42:	01 e0       	mov	#1,r0
+  44:	0b 00       	rts	
+  46:	05 e0       	mov	#5,r0
+  48:	0b 00       	rts	
+  4a:	07 e0       	mov	#7,r0
+  4c:	0b 00       	rts	
+  4e:	06 e0       	mov	#6,r0
+  50:	ff e0       	mov	#-1,r0
+  52:	0b 00       	rts	
+  54:	09 00       	nop	
\ No newline at end of file
@@ -6,6 +6,7 @@ import sys
 from typing import (
     Any,
     Callable,
+    Collection,
     Dict,
     Iterator,
     List,
@@ -18,7 +19,10 @@ from typing import (
     Set,
     Tuple,
     Type,
+    TypeVar,
     Union,
+    ClassVar,
+    cast,
 )
 
 
@@ -76,6 +80,7 @@ def main_early() -> None:
 
     start_argument = parser.add_argument(
         "start",
+        nargs="?",
         help="Function name or address to start diffing from.",
     )
 
@@ -216,6 +221,14 @@ def main_early() -> None:
         action="store_true",
         help="Show inline function calls (if possible). Only works with -o or -e.",
     )
+    parser.add_argument(
+        "--lean-dump",
+        dest="lean_dump",
+        action="store_true",
+        help="""Run objdump with --no-show-raw-insn on every architecture, and
+        read instruction bytes from the disassembled file where they are needed.
+        This makes objdump's output, and the work of parsing it, smaller.""",
+    )
     parser.add_argument(
         "--base-asm",
         dest="base_asm",
@@ -300,6 +313,23 @@ def main_early() -> None:
         help="""Automatically update when source/object files change.
         Recommended in combination with -m.""",
     )
+    parser.add_argument(
+        "--watch-depfile",
+        dest="watch_depfile",
+        action="store_true",
+        help="""With -mw, only watch the files listed in the compiler-generated .d
+        depfile for the diffed object, instead of everything in source_directories.
+        The depfile is re-read after each build.""",
+    )
+    parser.add_argument(
+        "--direct-compile",
+        dest="direct_compile",
+        action="store_true",
+        help="""With -mw, rebuild the object by running its compile command directly
+        instead of going through make, skipping make's dependency scan. The command
+        is taken from compile_commands.json, or from a compile_command_for_target
+        function in diff_settings.py. Falls back to make if the command is unknown.""",
+    )
     parser.add_argument(
         "-y",
         "--yes",
@@ -354,9 +384,12 @@ def main_early() -> None:
         "--algorithm",
         dest="algorithm",
         default="levenshtein",
-        choices=["levenshtein", "difflib"],
+        choices=["levenshtein", "difflib", "blocks"],
         help="""Diff algorithm to use. Levenshtein gives the minimum diff, while difflib
-        aims for long sections of equal opcodes. Defaults to %(default)s.""",
+        aims for long sections of equal opcodes. Blocks lines up identical basic
+        blocks first, and only runs Levenshtein on the code between them, which
+        keeps differences local but may give a slightly larger diff. Defaults to
+        %(default)s.""",
     )
     parser.add_argument(
         "--max-size",
@@ -405,6 +438,90 @@ def main_early() -> None:
         action="store_true",
         help="Include and diff function symbols.",
     )
+    parser.add_argument(
+        "--batch",
+        metavar="SOURCE",
+        help="""Print a table of scores for many functions instead of a diff:
+        CSV, or JSON with --format=json. SOURCE is an object file (for all of its
+        functions), "map" (for all functions of all objects in the map file), or
+        a file listing function names, one per line. Requires -o. Each function
+        is diffed up to the next function symbol, and each object is
+        disassembled only once.""",
+    )
+    parser.add_argument(
+        "--jobs",
+        metavar="N",
+        type=int,
+        help="Number of processes to use with --batch. Defaults to the number of CPUs.",
+    )
+    parser.add_argument(
+        "--top",
+        metavar="N",
+        type=int,
+        help="With --batch, only list the N worst-scoring functions.",
+    )
+    parser.add_argument(
+        "--score-store",
+        metavar="FILE",
+        help="""With --batch, keep per-function scores in the given sqlite
+        database, and only re-diff objects that changed, or whose reference
+        object changed, since they were stored.""",
+    )
+    parser.add_argument(
+        "--timings",
+        action="store_true",
+        help="""Report wall and CPU time and output line counts per stage on
+        stderr when the program finishes. JSON output (--format=json) also gets
+        a "timings" section.""",
+    )
+    parser.add_argument(
+        "--timings-out",
+        metavar="FILE",
+        help="Write the --timings report as JSON to FILE instead of stderr.",
+    )
+    parser.add_argument(
+        "--profile-out",
+        metavar="FILE",
+        help="Write a cProfile dump of the run to FILE, for use with pstats.",
+    )
+    parser.add_argument(
+        "--memory-report",
+        action="store_true",
+        help="""Trace memory allocations, and report per stage the most memory
+        allocated at once and how much of it is still allocated when the stage
+        ends, on stderr like --timings. Tracing slows the program down
+        considerably, so the timings in the report are inflated. Requires
+        Python 3.9 or later.""",
+    )
+    parser.add_argument(
+        "--memory-report-out",
+        metavar="FILE",
+        help="Write the memory report as JSON to FILE instead of stderr.",
+    )
+    parser.add_argument(
+        "--memory-budget",
+        metavar="MB",
+        type=float,
+        help="""Keep the memory used by processed assembly and diffs under
+        roughly MB megabytes: when it would be exceeded, source lines (as
+        shown by --source) are dropped, and threeway diffing (-3/-b) no longer
+        keeps the previous diff. With -b, a dropped base stays dropped for the
+        rest of the run.""",
+    )
+    parser.add_argument(
+        "--serve",
+        metavar="SOCKET",
+        help="""Run as a daemon listening on the given Unix socket, keeping project
+        settings, map files and processed reference assembly in memory between
+        requests from --connect. Restart it after changing diff_settings.py.""",
+    )
+    parser.add_argument(
+        "--connect",
+        metavar="SOCKET",
+        help="""Have the daemon listening on the given socket (see --serve) compute
+        the diff. Falls back to diffing locally if no daemon is running.
+        Not used together with -w.""",
+    )
 
     # Project-specific flags, e.g. different versions/make arguments.
     add_custom_arguments_fn = getattr(diff_settings, "add_custom_arguments", None)
@@ -414,6 +531,89 @@ def main_early() -> None:
     if argcomplete:
         argcomplete.autocomplete(parser)
 
+    if any(arg.startswith("--connect") for arg in sys.argv[1:]):
+        args = parser.parse_args()
+        if args.connect and not args.watch:
+            run_client(args)
+
+
+BUFFER_CMD: List[str] = ["tail", "-c", str(10**9)]
+
+# -S truncates long lines instead of wrapping them
+# -R interprets color escape sequences
+# -i ignores case when searching
+# -c something about how the screen gets redrawn; I don't remember the purpose
+# -#6 makes left/right arrow keys scroll by 6 characters
+LESS_CMD: List[str] = ["less", "-SRic", "-+F", "-+X", "-#6"]
+
+
+def run_less(output: str) -> "Tuple[subprocess.Popen[bytes], subprocess.Popen[bytes]]":
+    import subprocess
+
+    # Pipe the output through 'tail' and only then to less, to ensure the
+    # write call doesn't block. ('tail' has to buffer all its input before
+    # it starts writing.) This also means we don't have to deal with pipe
+    # closure errors.
+    buffer_proc = subprocess.Popen(
+        BUFFER_CMD, stdin=subprocess.PIPE, stdout=subprocess.PIPE
+    )
+    less_proc = subprocess.Popen(LESS_CMD, stdin=buffer_proc.stdout)
+    assert buffer_proc.stdin
+    assert buffer_proc.stdout
+    buffer_proc.stdin.write(output.encode())
+    buffer_proc.stdin.close()
+    buffer_proc.stdout.close()
+    return (buffer_proc, less_proc)
+
+
+def run_client(args: argparse.Namespace) -> None:
+    """Send the command line to a daemon started with --serve, and show its
+    output. Returns if no daemon could be reached, so that the caller can fall
+    back to diffing locally; exits otherwise. This runs before the rest of the
+    module is loaded, so keep it light."""
+    import json
+    import os
+    import socket
+
+    argv = []
+    argv_iter = iter(sys.argv[1:])
+    for arg in argv_iter:
+        if arg == "--connect":
+            next(argv_iter, None)
+        elif not arg.startswith("--connect="):
+            argv.append(arg)
+
+    request = json.dumps({"cwd": os.getcwd(), "argv": argv}) + "\n"
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(args.connect)
+            sock.sendall(request.encode())
+            sock.shutdown(socket.SHUT_WR)
+            with sock.makefile("rb") as f:
+                response = json.loads(f.read())
+    except (OSError, ValueError) as e:
+        print(
+            f"Could not get a response from the diff daemon at {args.connect} ({e}); "
+            "diffing locally.",
+            file=sys.stderr,
+        )
+        return
+
+    sys.stderr.write(response["stderr"])
+    output = response["stdout"]
+    if (
+        response["status"] != 0
+        or response["max_score"] is None
+        or args.no_pager
+        or args.format in ("html", "json")
+    ):
+        sys.stdout.write(output)
+    else:
+        proca, procb = run_less(output)
+        procb.wait()
+        proca.wait()
+    sys.exit(response["status"])
+
 
 if __name__ == "__main__":
     main_early()
@@ -423,33 +623,32 @@ if __name__ == "__main__":
 # (We do imports late to optimize auto-complete performance.)
 
 import abc
-from collections import Counter, defaultdict, deque
-from dataclasses import asdict, dataclass, field, replace
-import difflib
-import html
+import bisect
+from collections import Counter, OrderedDict, defaultdict, deque
+import contextlib
+from dataclasses import asdict, astuple, dataclass, field, fields, replace
+import functools
+import hashlib
+import io
 import itertools
-import json
 import os
 import queue
 import re
+import shlex
+import stat
 import string
 import struct
 import subprocess
 import threading
 import time
-import traceback
 
+# colorama (for --format=color), watchdog (for -w), Levenshtein and cxxfilt are
+# imported when needed, so that startup only pays for what is used.
 MISSING_PREREQUISITES = (
     "Missing prerequisite python module {}. "
     "Run `python3 -m pip install --user colorama watchdog levenshtein cxxfilt` to install prerequisites (cxxfilt only needed with --source)."
 )
 
-try:
-    from colorama import Back, Fore, Style
-    import watchdog
-except ModuleNotFoundError as e:
-    fail(MISSING_PREREQUISITES.format(e.name))
-
 # ==== CONFIG ====
 
 
@@ -463,6 +662,7 @@ class ProjectSettings:
     build_dir: str
     map_address_offset: int
     baseimg: Optional[str]
+    base_code_range: Optional[Tuple[int, int]]
     myimg: Optional[str]
     mapfile: Optional[str]
     source_directories: Optional[List[str]]
@@ -471,6 +671,9 @@ class ProjectSettings:
     disassemble_all: bool
     reg_categories: Dict[str, int]
     expected_dir: str
+    compile_commands: str
+    cache_dir: str
+    cache_base_lines: bool
 
 
 @dataclass
@@ -510,6 +713,10 @@ class Config:
     algorithm: str
     reg_categories: Dict[str, int]
     diff_function_symbols: bool
+    # Approximate limit in bytes for retained Lines and diffs, see --memory-budget
+    memory_budget: Optional[int] = None
+    # Read instruction bytes from files rather than from objdump, see --lean-dump
+    lean_dump: bool = False
 
     # Score options
     score_stack_differences = True
@@ -524,6 +731,7 @@ def create_project_settings(settings: Dict[str, Any]) -> ProjectSettings:
     return ProjectSettings(
         arch_str=settings.get("arch", "mips"),
         baseimg=settings.get("baseimg"),
+        base_code_range=settings.get("base_code_range"),
         myimg=settings.get("myimg"),
         mapfile=settings.get("mapfile"),
         build_command=settings.get(
@@ -536,6 +744,9 @@ def create_project_settings(settings: Dict[str, Any]) -> ProjectSettings:
         objdump_executable=get_objdump_executable(settings.get("objdump_executable")),
         objdump_flags=settings.get("objdump_flags", []),
         expected_dir=settings.get("expected_dir", "expected/"),
+        compile_commands=settings.get("compile_commands", "compile_commands.json"),
+        cache_dir=settings.get("cache_dir", ".asm-differ-cache/"),
+        cache_base_lines=settings.get("cache_base_lines", False),
         map_format=settings.get("map_format", "gnu"),
         map_address_offset=settings.get(
             "map_address_offset", settings.get("ms_map_address_offset", 0)
@@ -607,6 +818,12 @@ def create_config(args: argparse.Namespace, project: ProjectSettings) -> Config:
         algorithm=args.algorithm,
         reg_categories=project.reg_categories,
         diff_function_symbols=args.diff_function_symbols,
+        memory_budget=(
+            int(args.memory_budget * 1024 * 1024)
+            if args.memory_budget is not None
+            else None
+        ),
+        lean_dump=args.lean_dump,
     )
 
 
@@ -640,23 +857,259 @@ def get_objdump_executable(objdump_executable: Optional[str]) -> str:
     )
 
 
+_arch_settings: Dict[str, "ArchSettings"] = {}
+
+
 def get_arch(arch_str: str) -> "ArchSettings":
-    for settings in ARCH_SETTINGS:
-        if arch_str == settings.name:
-            return settings
-    raise ValueError(f"Unknown architecture: {arch_str}")
+    settings = _arch_settings.get(arch_str)
+    if settings is None:
+        factory = ARCH_FACTORIES.get(arch_str)
+        if factory is None:
+            raise ValueError(f"Unknown architecture: {arch_str}")
+        settings = factory()
+        _arch_settings[arch_str] = settings
+    return settings
+
+
+# Time to wait for more file system events before rebuilding. The delay adapts
+# between these bounds based on build times and event patterns (see Debouncer).
+DEBOUNCE_DELAY: float = 0.1
+MAX_DEBOUNCE_DELAY: float = 1.5
 
+# ==== TIMINGS ====
 
-BUFFER_CMD: List[str] = ["tail", "-c", str(10**9)]
 
-# -S truncates long lines instead of wrapping them
-# -R interprets color escape sequences
-# -i ignores case when searching
-# -c something about how the screen gets redrawn; I don't remember the purpose
-# -#6 makes left/right arrow keys scroll by 6 characters
-LESS_CMD: List[str] = ["less", "-SRic", "-+F", "-+X", "-#6"]
+@dataclass
+class StageTiming:
+    calls: int = 0
+    wall: float = 0.0
+    cpu: float = 0.0
+    # Lines of output produced by the stage
+    lines: int = 0
+    # With --memory-report: the most memory allocated at once during a call,
+    # and how much was still allocated at the end of the last call, in bytes
+    peak_bytes: int = 0
+    retained_bytes: int = 0
+
+
+class Timings:
+    """Time spent per pipeline stage, for --timings. Times of a stage include
+    those of stages nested in it (e.g. do_diff includes diff_lines). CPU times
+    are for this process only, and so exclude objdump and make.
+
+    With track_memory, tracemalloc must be tracing, and memory use is
+    recorded per stage as well, for --memory-report."""
+
+    def __init__(self, *, track_memory: bool = False) -> None:
+        self.stages: Dict[str, StageTiming] = {}
+        self.track_memory = track_memory
+        # Traced memory at the start of each active stage, and the most
+        # allocated since then
+        self.memory_stack: List[List[int]] = []
+        self.peak_bytes = 0
+        self.notes: List[str] = []
+
+    @contextlib.contextmanager
+    def stage(self, name: str) -> Iterator[StageTiming]:
+        timing = self.stages.setdefault(name, StageTiming())
+        if self.track_memory:
+            self.start_memory()
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield timing
+        finally:
+            timing.calls += 1
+            timing.wall += time.perf_counter() - wall
+            timing.cpu += time.process_time() - cpu
+            if self.track_memory:
+                self.end_memory(timing)
+
+    def start_memory(self) -> None:
+        import tracemalloc
+
+        current, peak = tracemalloc.get_traced_memory()
+        if self.memory_stack:
+            # The peak is reset below, so save it for the enclosing stage
+            outer = self.memory_stack[-1]
+            outer[1] = max(outer[1], peak)
+        if sys.version_info >= (3, 9):
+            tracemalloc.reset_peak()
+        self.memory_stack.append([current, current])
+
+    def end_memory(self, timing: StageTiming) -> None:
+        import tracemalloc
+
+        current, peak = tracemalloc.get_traced_memory()
+        start, stage_peak = self.memory_stack.pop()
+        stage_peak = max(stage_peak, peak)
+        timing.peak_bytes = max(timing.peak_bytes, stage_peak - start)
+        timing.retained_bytes = current - start
+        self.peak_bytes = max(self.peak_bytes, stage_peak)
+        if self.memory_stack:
+            outer = self.memory_stack[-1]
+            outer[1] = max(outer[1], stage_peak)
+
+    def note(self, message: str) -> None:
+        if message not in self.notes:
+            self.notes.append(message)
+
+    def add(self, name: str, wall: float) -> None:
+        """Record time spent outside of this process's control, e.g. waiting."""
+        timing = self.stages.setdefault(name, StageTiming())
+        timing.calls += 1
+        timing.wall += wall
+
+    def as_dict(self) -> Dict[str, Dict[str, Any]]:
+        ret = {}
+        for name, timing in self.stages.items():
+            ret[name] = asdict(timing)
+            if not self.track_memory:
+                del ret[name]["peak_bytes"]
+                del ret[name]["retained_bytes"]
+        return ret
+
+    def memory_dict(self) -> Dict[str, Any]:
+        import tracemalloc
+
+        current, peak = tracemalloc.get_traced_memory()
+        return {
+            "stages": self.as_dict(),
+            "current_bytes": current,
+            "peak_bytes": max(self.peak_bytes, peak),
+            "notes": self.notes,
+        }
+
+    def report(self) -> str:
+        header = (
+            f"{'stage':<16} {'calls':>6} {'wall ms':>10} {'cpu ms':>10} {'lines':>8}"
+        )
+        if self.track_memory:
+            header += f" {'peak KiB':>10} {'kept KiB':>10}"
+        lines = [header]
+        for name, timing in self.stages.items():
+            line = (
+                f"{name:<16} {timing.calls:>6} {timing.wall * 1000:>10.1f} "
+                f"{timing.cpu * 1000:>10.1f} {timing.lines:>8}"
+            )
+            if self.track_memory:
+                line += (
+                    f" {timing.peak_bytes / 1024:>10.1f}"
+                    f" {timing.retained_bytes / 1024:>10.1f}"
+                )
+            lines.append(line)
+        if self.track_memory:
+            memory = self.memory_dict()
+            lines.append(
+                f"traced memory: {memory['current_bytes'] / 1024:.1f} KiB at exit, "
+                f"{memory['peak_bytes'] / 1024:.1f} KiB peak"
+            )
+            lines.extend(self.notes)
+        return "\n".join(lines)
+
+
+_timings: Optional[Timings] = None
+
+
+def memory_note(message: str) -> None:
+    """Mention a memory-saving measure that was taken in --memory-report."""
+    if _timings is not None:
+        _timings.note(message)
+
+
+@contextlib.contextmanager
+def timing_stage(name: str) -> Iterator[Optional[StageTiming]]:
+    if _timings is None:
+        yield None
+    else:
+        with _timings.stage(name) as timing:
+            yield timing
+
+
+def count_output_lines(value: object) -> int:
+    if isinstance(value, str):
+        return value.count("\n") + 1 if value else 0
+    if isinstance(value, list):
+        return len(value)
+    if isinstance(value, (Diff, TableData)):
+        return len(value.lines)
+    return 0
+
+
+AnyCallable = TypeVar("AnyCallable", bound=Callable[..., Any])
+
+
+def timed(name: str) -> Callable[[AnyCallable], AnyCallable]:
+    """Record calls to the decorated function as a stage for --timings."""
+
+    def decorator(fn: AnyCallable) -> AnyCallable:
+        @functools.wraps(fn)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            if _timings is None:
+                return fn(*args, **kwargs)
+            with _timings.stage(name) as timing:
+                ret = fn(*args, **kwargs)
+                timing.lines += count_output_lines(ret)
+                return ret
+
+        return cast(AnyCallable, wrapper)
+
+    return decorator
+
+
+@contextlib.contextmanager
+def timing_session(args: argparse.Namespace) -> Iterator[None]:
+    """Collect timings, memory use and/or a profile, as asked for by --timings,
+    --memory-report and --profile-out, while running the body."""
+    global _timings
+    want_timings = args.timings or args.timings_out is not None
+    want_memory = args.memory_report or args.memory_report_out is not None
+    if not want_timings and not want_memory and args.profile_out is None:
+        yield
+        return
+
+    profiler = None
+    if args.profile_out is not None:
+        import cProfile
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+    if want_memory:
+        import tracemalloc
+
+        if sys.version_info < (3, 9):
+            fail("--memory-report requires Python 3.9 or later.")
+        tracemalloc.start()
+        _timings = Timings(track_memory=True)
+    elif want_timings:
+        _timings = Timings()
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(args.profile_out)
+        timings = _timings
+        _timings = None
+        import json
+
+        if timings is not None:
+            if args.timings_out is not None:
+                with open(args.timings_out, "w") as f:
+                    json.dump(timings.as_dict(), f, indent=2)
+            elif args.timings:
+                print(timings.report(), file=sys.stderr)
+        if timings is not None and want_memory:
+            if args.memory_report_out is not None:
+                with open(args.memory_report_out, "w") as f:
+                    json.dump(timings.memory_dict(), f, indent=2)
+            elif not args.timings or args.timings_out is not None:
+                print(timings.report(), file=sys.stderr)
+        if want_memory:
+            import tracemalloc
+
+            tracemalloc.stop()
 
-DEBOUNCE_DELAY: float = 0.1
 
 # ==== FORMATTING ====
 
@@ -779,6 +1232,8 @@ class TableData:
     max_score: int
     previous_score: Optional[int]
     lines: List[TableLine]
+    # Stage timings so far, with --timings
+    timings: Optional[Dict[str, Dict[str, Any]]] = None
 
 
 class Formatter(abc.ABC):
@@ -823,46 +1278,64 @@ class AnsiFormatter(Formatter):
     STYLE_INVERT = "\x1b[7m"
     STYLE_RESET = "\x1b[0m"
 
-    BASIC_ANSI_CODES = {
-        BasicFormat.NONE: "",
-        BasicFormat.IMMEDIATE: Fore.LIGHTBLUE_EX,
-        BasicFormat.STACK: Fore.YELLOW,
-        BasicFormat.REGISTER: Fore.YELLOW,
-        BasicFormat.REGISTER_CATEGORY: Fore.LIGHTYELLOW_EX,
-        BasicFormat.DIFF_CHANGE: Fore.LIGHTBLUE_EX,
-        BasicFormat.DIFF_ADD: Fore.GREEN,
-        BasicFormat.DIFF_REMOVE: Fore.RED,
-        BasicFormat.SOURCE_FILENAME: Style.DIM + Style.BRIGHT,
-        BasicFormat.SOURCE_FUNCTION: Style.DIM + Style.BRIGHT + STYLE_UNDERLINE,
-        BasicFormat.SOURCE_LINE_NUM: Fore.LIGHTBLACK_EX,
-        BasicFormat.SOURCE_OTHER: Style.DIM,
-    }
+    # Filled in from colorama when first used, see load_colors()
+    BASIC_ANSI_CODES: ClassVar[Dict[BasicFormat, str]] = {}
+    BASIC_ANSI_CODES_UNDO: ClassVar[Dict[BasicFormat, str]] = {}
+    ROTATION_ANSI_COLORS: ClassVar[List[str]] = []
+    STYLE_RESET_FOREGROUND: ClassVar[str] = ""
 
-    BASIC_ANSI_CODES_UNDO = {
-        BasicFormat.NONE: "",
-        BasicFormat.SOURCE_FILENAME: Style.NORMAL,
-        BasicFormat.SOURCE_FUNCTION: Style.NORMAL + STYLE_NO_UNDERLINE,
-        BasicFormat.SOURCE_OTHER: Style.NORMAL,
-    }
+    column_width: int
 
-    ROTATION_ANSI_COLORS = [
-        Fore.MAGENTA,
-        Fore.CYAN,
-        Fore.GREEN,
-        Fore.RED,
-        Fore.LIGHTYELLOW_EX,
-        Fore.LIGHTMAGENTA_EX,
-        Fore.LIGHTCYAN_EX,
-        Fore.LIGHTGREEN_EX,
-        Fore.LIGHTBLACK_EX,
-    ]
+    def __post_init__(self) -> None:
+        if not self.BASIC_ANSI_CODES:
+            AnsiFormatter.load_colors()
 
-    column_width: int
+    @classmethod
+    def load_colors(cls) -> None:
+        try:
+            from colorama import Fore, Style
+        except ModuleNotFoundError as e:
+            fail(MISSING_PREREQUISITES.format(e.name))
+
+        cls.STYLE_RESET_FOREGROUND = Fore.RESET
+        cls.BASIC_ANSI_CODES = {
+            BasicFormat.NONE: "",
+            BasicFormat.IMMEDIATE: Fore.LIGHTBLUE_EX,
+            BasicFormat.STACK: Fore.YELLOW,
+            BasicFormat.REGISTER: Fore.YELLOW,
+            BasicFormat.REGISTER_CATEGORY: Fore.LIGHTYELLOW_EX,
+            BasicFormat.DIFF_CHANGE: Fore.LIGHTBLUE_EX,
+            BasicFormat.DIFF_ADD: Fore.GREEN,
+            BasicFormat.DIFF_REMOVE: Fore.RED,
+            BasicFormat.SOURCE_FILENAME: Style.DIM + Style.BRIGHT,
+            BasicFormat.SOURCE_FUNCTION: Style.DIM + Style.BRIGHT + cls.STYLE_UNDERLINE,
+            BasicFormat.SOURCE_LINE_NUM: Fore.LIGHTBLACK_EX,
+            BasicFormat.SOURCE_OTHER: Style.DIM,
+        }
+
+        cls.BASIC_ANSI_CODES_UNDO = {
+            BasicFormat.NONE: "",
+            BasicFormat.SOURCE_FILENAME: Style.NORMAL,
+            BasicFormat.SOURCE_FUNCTION: Style.NORMAL + cls.STYLE_NO_UNDERLINE,
+            BasicFormat.SOURCE_OTHER: Style.NORMAL,
+        }
+
+        cls.ROTATION_ANSI_COLORS = [
+            Fore.MAGENTA,
+            Fore.CYAN,
+            Fore.GREEN,
+            Fore.RED,
+            Fore.LIGHTYELLOW_EX,
+            Fore.LIGHTMAGENTA_EX,
+            Fore.LIGHTCYAN_EX,
+            Fore.LIGHTGREEN_EX,
+            Fore.LIGHTBLACK_EX,
+        ]
 
     def apply_format(self, chunk: str, f: Format) -> str:
         if f == BasicFormat.NONE:
             return chunk
-        undo_ansi_code = Fore.RESET
+        undo_ansi_code = self.STYLE_RESET_FOREGROUND
         if isinstance(f, BasicFormat):
             ansi_code = self.BASIC_ANSI_CODES[f]
             undo_ansi_code = self.BASIC_ANSI_CODES_UNDO.get(f, undo_ansi_code)
@@ -893,12 +1366,18 @@ class AnsiFormatter(Formatter):
         )
 
 
+# The same escapes as html.escape, without importing html
+HTML_ESCAPES = str.maketrans(
+    {"&": "&amp;", "<": "&lt;", ">": "&gt;", '"': "&quot;", "'": "&#x27;"}
+)
+
+
 @dataclass
 class HtmlFormatter(Formatter):
     rotation_formats: int = 9
 
     def apply_format(self, chunk: str, f: Format) -> str:
-        chunk = html.escape(chunk)
+        chunk = chunk.translate(HTML_ESCAPES)
         if f == BasicFormat.NONE:
             return chunk
         if isinstance(f, BasicFormat):
@@ -906,7 +1385,7 @@ class HtmlFormatter(Formatter):
             data_attr = ""
         elif isinstance(f, RotationFormat):
             class_name = f"rotation-{f.index % self.rotation_formats}"
-            rotation_key = html.escape(f"{f.group};{f.key}", quote=True)
+            rotation_key = f"{f.group};{f.key}".translate(HTML_ESCAPES)
             data_attr = f'data-rotation="{rotation_key}"'
         else:
             static_assert_unreachable(f)
@@ -1008,12 +1487,16 @@ class PythonFormatter(Formatter):
                     output_row[column_name] = column
             output_rows.append(output_row)
         output["rows"] = output_rows
+        if data.timings is not None:
+            output["timings"] = data.timings
         return output
 
 
 @dataclass
 class JsonFormatter(PythonFormatter):
     def table(self, data: TableData) -> str:
+        import json
+
         output = super().raw(data)
         return json.dumps(output)
 
@@ -1119,10 +1602,21 @@ def eval_int(expr: str, emsg: str) -> int:
     return ret
 
 
+@timed("make")
 def run_make(target: str, project: ProjectSettings) -> None:
-    subprocess.check_call(project.build_command + [target])
+    if sys.stdout is sys.__stdout__ and sys.stderr is sys.__stderr__:
+        subprocess.check_call(project.build_command + [target])
+        return
+    # Output is redirected, as for a --connect client, which the build output
+    # has to reach too
+    proc = run_make_capture_output(target, project)
+    sys.stdout.write(proc.stdout.decode("utf-8", "replace"))
+    sys.stderr.write(proc.stderr.decode("utf-8", "replace"))
+    if proc.returncode != 0:
+        fail(f"Building {target} failed with exit code {proc.returncode}.")
 
 
+@timed("make")
 def run_make_capture_output(
     target: str, project: ProjectSettings
 ) -> "subprocess.CompletedProcess[bytes]":
@@ -1133,16 +1627,89 @@ def run_make_capture_output(
     )
 
 
-def restrict_to_function(dump: str, fn_name: str) -> str:
+@dataclass
+class CompileCommand:
+    directory: str
+    arguments: List[str]
+
+
+def find_compile_command(
+    target: str, project: ProjectSettings
+) -> Optional[CompileCommand]:
+    """Look up the command that compiles `target` in compile_commands.json."""
+    import json
+
+    try:
+        with open(project.compile_commands) as f:
+            entries = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    target_path = os.path.abspath(target)
+    for entry in entries:
+        directory = entry.get("directory", ".")
+        if "arguments" in entry:
+            arguments = entry["arguments"]
+        elif "command" in entry:
+            arguments = shlex.split(entry["command"])
+        else:
+            continue
+        output = entry.get("output")
+        if output is None:
+            for i, arg in enumerate(arguments):
+                if arg == "-o" and i + 1 < len(arguments):
+                    output = arguments[i + 1]
+                elif arg.startswith("-o") and len(arg) > 2:
+                    output = arg[2:]
+        if output is None:
+            continue
+        if os.path.abspath(os.path.join(directory, output)) == target_path:
+            return CompileCommand(directory=directory, arguments=arguments)
+    return None
+
+
+@timed("make")
+def run_compile_capture_output(
+    cmd: CompileCommand,
+) -> "subprocess.CompletedProcess[bytes]":
+    return subprocess.run(
+        cmd.arguments,
+        cwd=cmd.directory,
+        stderr=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+    )
+
+
+def hash_objdump_target(cmd: ObjdumpCommand) -> Optional[bytes]:
+    """Hash the contents of the file an objdump command reads. This is cheap
+    compared to running objdump, and lets watch mode skip the whole
+    objdump/process/diff pipeline when a rebuild produced an identical file."""
+    _, target, _ = cmd
+    try:
+        with open(target, "rb") as f:
+            return hashlib.sha1(f.read()).digest()
+    except OSError:
+        return None
+
+
+def decode_objdump_out(out: bytes, start: int = 0, end: Optional[int] = None) -> str:
+    """Decode a part of objdump's output, without copying the rest of it."""
+    text = str(memoryview(out)[start:end], "utf-8", "replace")
+    if "\r" in text:
+        text = text.replace("\r\n", "\n")
+    return text
+
+
+def restrict_to_function(dump: bytes, fn_name: str) -> str:
     try:
         # Find the start of the line that contains "<fn_name>:"
-        ind = dump.rfind("\n", 0, dump.index(f"<{fn_name}>:")) + 1
-        return dump[ind:]
+        ind = dump.rfind(b"\n", 0, dump.index(f"<{fn_name}>:".encode())) + 1
+        return decode_objdump_out(dump, ind)
     except ValueError:
         return ""
 
 
-def serialize_rodata_references(references: List[Tuple[int, int, str]]) -> str:
+def serialize_rodata_references(references: Sequence[Tuple[int, int, str]]) -> str:
     return "".join(
         f"DATAREF {text_offset} {from_offset} {from_section}\n"
         for (text_offset, from_offset, from_section) in references
@@ -1167,63 +1734,344 @@ def maybe_get_objdump_source_flags(config: Config) -> List[str]:
     return flags
 
 
-def run_objdump(cmd: ObjdumpCommand, config: Config, project: ProjectSettings) -> str:
+def run_objdump(
+    cmd: ObjdumpCommand, config: Config, project: ProjectSettings
+) -> "AsmDump":
     flags, target, restrict = cmd
+    out = run_objdump_raw(cmd, config, project)
+
+    data: Optional[bytes] = None
+    if config.diff_obj or config.lean_dump:
+        with open(target, "rb") as f:
+            data = f.read()
+    obj_data = data if config.diff_obj else None
+    code = lean_dump_bytes(data, flags, target, config) if data else None
+
+    return preprocess_objdump_out(restrict, obj_data, out, config, code)
+
+
+def objdump_arch_flags(config: Config) -> List[str]:
+    if config.lean_dump and "--no-show-raw-insn" not in config.arch.arch_flags:
+        return config.arch.arch_flags + ["--no-show-raw-insn"]
+    return config.arch.arch_flags
+
+
+def dump_has_raw_insn(config: Config) -> bool:
+    """Whether the instruction lines of dumps have objdump's raw bytes column."""
+    if "--no-show-raw-insn" in config.arch.arch_flags:
+        return False
+    return not config.lean_dump or config.arch.proc.reads_raw_insn
+
+
+def lean_dump_bytes(
+    data: bytes, flags: List[str], target: str, config: Config
+) -> Optional["InstructionBytes"]:
+    """With --lean-dump, the instruction bytes of a file disassembled with the
+    given flags."""
+    if not config.lean_dump:
+        return None
+    code = InstructionBytes.from_file(data, flags, config)
+    if code is None and config.arch.proc.reads_raw_insn:
+        fail(
+            f"--lean-dump needs a single {config.diff_section} section in "
+            f"{target} to read instruction bytes from."
+        )
+    return code
+
+
+# objdump prints "..." for skipped blocks of zeros, so larger gaps between
+# instructions don't belong to a single instruction.
+MAX_INSTRUCTION_SIZE = 32
+
+OBJDUMP_INSN_PATTERN = re.compile(r"^ *([0-9a-f]+):\t", re.MULTILINE)
+
+
+def instruction_sizes(addrs: List[int], arch: "ArchSettings") -> List[Optional[int]]:
+    """The sizes of the consecutive instructions at the given addresses. If
+    the architecture has no fixed instruction size, each instruction reaches
+    up to the next one, and the size of the last one is unknown."""
+    if arch.instruction_size is not None:
+        return [arch.instruction_size] * len(addrs)
+    sizes: List[Optional[int]] = [
+        end - start if 0 < end - start <= MAX_INSTRUCTION_SIZE else None
+        for start, end in zip(addrs, addrs[1:])
+    ]
+    sizes.append(None)
+    return sizes
+
+
+def insert_raw_insn_column(
+    dump: str, code: "InstructionBytes", processor: "AsmProcessor"
+) -> str:
+    """Put the raw bytes column, which --no-show-raw-insn leaves out, back
+    into the instruction lines of objdump output."""
+    insns = []
+    for insn_match in OBJDUMP_INSN_PATTERN.finditer(dump):
+        end = dump.find("\n", insn_match.end())
+        insn = dump[insn_match.end() : end if end != -1 else len(dump)]
+        insns.append((int(insn_match.group(1), 16), insn))
+    columns = iter(processor.raw_insn_columns(insns, code))
+
+    def insert(insn_match: Match[str]) -> str:
+        column = next(columns)
+        if not column:
+            return insn_match.group(0)
+        return insn_match.group(0) + column + "\t"
+
+    return OBJDUMP_INSN_PATTERN.sub(insert, dump)
+
+
+@timed("objdump")
+def run_objdump_raw(
+    cmd: ObjdumpCommand, config: Config, project: ProjectSettings
+) -> bytes:
+    flags, target, restrict = cmd
+    if (
+        target == project.baseimg
+        and project.base_code_range is not None
+        and "-bbinary" in flags
+    ):
+        out = base_rom_window(flags, config, project)
+        if out is not None:
+            return out
+    flags = bound_disassembled_symbol(flags, target, config)
+    return run_objdump_process(flags, target, config, project)
+
+
+def run_objdump_process(
+    flags: List[str], target: str, config: Config, project: ProjectSettings
+) -> bytes:
     try:
-        out = subprocess.run(
+        return subprocess.run(
             [project.objdump_executable]
-            + config.arch.arch_flags
+            + objdump_arch_flags(config)
             + project.objdump_flags
             + flags
             + [target],
             check=True,
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
-            universal_newlines=True,
         ).stdout
     except subprocess.CalledProcessError as e:
-        print(e.stdout)
-        print(e.stderr)
-        if "unrecognized option '--source-comment" in e.stderr:
+        stderr = e.stderr.decode("utf-8", "replace")
+        print(e.stdout.decode("utf-8", "replace"))
+        print(stderr)
+        if "unrecognized option '--source-comment" in stderr:
             fail("** Try using --source-old-binutils instead of --source **")
         raise e
 
-    obj_data: Optional[bytes] = None
-    if config.diff_obj:
-        with open(target, "rb") as f:
-            obj_data = f.read()
-
-    return preprocess_objdump_out(restrict, obj_data, out, config)
-
 
+@timed("preprocess")
 def preprocess_objdump_out(
-    restrict: Optional[str], obj_data: Optional[bytes], objdump_out: str, config: Config
-) -> str:
+    restrict: Optional[str],
+    obj_data: Optional[bytes],
+    objdump_out: bytes,
+    config: Config,
+    code: Optional["InstructionBytes"] = None,
+) -> "AsmDump":
     """
-    Preprocess the output of objdump into a format that `process()` expects.
-    This format is suitable for saving to disk with `--write-asm`.
+    Preprocess the output of objdump and parse it into the rows that `process()`
+    expects. The text form of the result is suitable for saving to disk with
+    `--write-asm`.
 
     - Optionally filter the output to a single function (`restrict`)
     - Otherwise, strip objdump header (6 lines)
-    - Prepend .data references ("DATAREF" lines) when working with object files
-    """
-    out = objdump_out
+    - Find .data references when working with object files
+    - With --lean-dump, get instruction bytes from `code`
 
+    Only the part of the output that is kept gets decoded.
+    """
     if restrict is not None:
-        out = restrict_to_function(out, restrict)
+        out = restrict_to_function(objdump_out, restrict)
     else:
+        start = 0
         for i in range(6):
-            out = out[out.find("\n") + 1 :]
-        out = out.rstrip("\n")
+            newline = objdump_out.find(b"\n", start)
+            if newline == -1:
+                break
+            start = newline + 1
+        end = len(objdump_out)
+        while end > start and objdump_out[end - 1] in b"\r\n":
+            end -= 1
+        out = decode_objdump_out(objdump_out, start, end)
 
+    rodata_refs: List[Tuple[int, int, str]] = []
     if obj_data and config.show_rodata_refs:
-        out = (
-            serialize_rodata_references(parse_elf_rodata_references(obj_data, config))
-            + out
-        )
+        rodata_refs = parse_elf_rodata_references(obj_data, config)
+
+    processor = config.arch.proc(config)
+    if code is not None and processor.reads_raw_insn:
+        out = insert_raw_insn_column(out, code, processor)
+    return parse_dump_lines(
+        processor.preprocess_objdump_lines(out), config, rodata_refs, code
+    )
 
+
+def preprocess_function_dump(
+    out: str, rodata_refs: str, config: Config, code: Optional["InstructionBytes"]
+) -> Tuple[str, Optional["InstructionBytes"]]:
+    """The text form of a preprocessed dump, for --batch workers to parse,
+    and with --lean-dump the instruction bytes that parse_dump should read
+    for it."""
     processor = config.arch.proc(config)
-    return processor.preprocess_objdump(out)
+    if code is not None:
+        if processor.reads_raw_insn:
+            out = insert_raw_insn_column(out, code, processor)
+            code = None
+        else:
+            addrs = [int(addr, 16) for addr in OBJDUMP_INSN_PATTERN.findall(out)]
+            code = (
+                code.window(min(addrs), max(addrs) + MAX_INSTRUCTION_SIZE)
+                if addrs
+                else None
+            )
+    return processor.preprocess_objdump(rodata_refs + out), code
+
+
+OBJDUMP_ADDRESS_PATTERN = re.compile(rb"^ *([0-9a-f]+):", re.MULTILINE)
+OBJDUMP_LABEL_PATTERN = re.compile(rb"^([0-9a-f]+) <([^+>]*)", re.MULTILINE)
+
+
+class BaseRomDump:
+    """objdump output for the `base_code_range` of a binary base image, with
+    an index from instruction addresses to their lines, so that the output for
+    any address window within the range can be sliced out of it."""
+
+    def __init__(
+        self, out: bytes, stop: int, addresses: List[int], offsets: List[int]
+    ) -> None:
+        self.out = out
+        self.stop = stop
+        self.addresses = addresses
+        self.offsets = offsets
+        label = OBJDUMP_LABEL_PATTERN.search(out)
+        self.header = out[: label.start()] if label else b""
+        self.address_width = len(label.group(1)) if label else 8
+        self.section = label.group(2).decode() if label else ".data"
+
+    @staticmethod
+    def from_objdump(out: bytes, stop: int) -> "BaseRomDump":
+        addresses = []
+        offsets = []
+        for m in OBJDUMP_ADDRESS_PATTERN.finditer(out):
+            addresses.append(int(m.group(1), 16))
+            offsets.append(m.start())
+        return BaseRomDump(out, stop, addresses, offsets)
+
+    def window(self, start: int, stop: int) -> Optional[bytes]:
+        """The output of objdump for --start-address=start and
+        --stop-address=stop, or None if the window is not within the range or
+        does not start and end at instruction boundaries, since objdump would
+        then decode it differently."""
+        i = bisect.bisect_left(self.addresses, start)
+        if i == len(self.addresses) or self.addresses[i] != start:
+            return None
+        j = bisect.bisect_left(self.addresses, stop)
+        if j < len(self.addresses):
+            if self.addresses[j] != stop:
+                return None
+            end = self.offsets[j]
+        elif stop == self.stop:
+            end = len(self.out)
+        else:
+            return None
+        suffix = f"+0x{start:x}" if start else ""
+        label = f"{start:0{self.address_width}x} <{self.section}{suffix}>:\n"
+        return self.header + label.encode() + self.out[self.offsets[i] : end]
+
+
+_base_rom_dumps: Dict[Tuple[str, ...], Tuple[Tuple[int, int], BaseRomDump]] = {}
+
+
+def load_base_rom_dump(
+    flags: List[str], config: Config, project: ProjectSettings
+) -> Optional[BaseRomDump]:
+    """Disassemble the `base_code_range` of the base image with the given
+    objdump flags, or load that disassembly from the cache directory, where it
+    is keyed by the contents of the image and the objdump command."""
+    import json
+
+    path = project.baseimg
+    assert path is not None and project.base_code_range is not None
+    stamp = file_stamp(path)
+    if stamp is None:
+        return None
+    start, stop = project.base_code_range
+    range_flags = flags + [f"--start-address={start}", f"--stop-address={stop}"]
+    mem_key = (path, *range_flags)
+    cached = _base_rom_dumps.get(mem_key)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+
+    with open(path, "rb") as f:
+        rom_hash = hashlib.sha1(f.read()).hexdigest()
+    key = (
+        rom_hash,
+        project.objdump_executable,
+        objdump_arch_flags(config),
+        project.objdump_flags,
+        range_flags,
+    )
+    cache_path = os.path.join(
+        project.cache_dir,
+        f"base-rom-{hashlib.sha1(repr(key).encode()).hexdigest()}.json",
+    )
+    try:
+        with open(cache_path, encoding="utf-8") as f:
+            data = json.load(f)
+        out = data["out"].encode("utf-8", "surrogateescape")
+        dump = BaseRomDump(out, stop, data["addresses"], data["offsets"])
+    except (OSError, ValueError, KeyError):
+        out = run_objdump_process(range_flags, path, config, project)
+        dump = BaseRomDump.from_objdump(out, stop)
+        write_cache_file(
+            cache_path,
+            {
+                "out": out.decode("utf-8", "surrogateescape"),
+                "addresses": dump.addresses,
+                "offsets": dump.offsets,
+            },
+        )
+    _base_rom_dumps[mem_key] = (stamp, dump)
+    return dump
+
+
+def base_rom_window(
+    flags: List[str], config: Config, project: ProjectSettings
+) -> Optional[bytes]:
+    """Serve a binary-mode objdump of the base image from the disassembly of
+    its whole `base_code_range`, or return None to fall back to objdump."""
+    start = stop = None
+    other_flags = []
+    for flag in flags:
+        if flag.startswith("--start-address="):
+            start = int(flag.split("=", 1)[1], 0)
+        elif flag.startswith("--stop-address="):
+            stop = int(flag.split("=", 1)[1], 0)
+        else:
+            other_flags.append(flag)
+    if start is None or stop is None:
+        return None
+    dump = load_base_rom_dump(other_flags, config, project)
+    if dump is None:
+        return None
+    return dump.window(start, stop)
+
+
+def split_objdump_functions(dump: str, fn_names: Set[str]) -> Dict[str, str]:
+    """Split objdump output into the parts that start at the labels of the
+    given functions. Each part runs until the next of these labels, so labels
+    of other symbols within a function don't cut it short."""
+    starts = [
+        (m.start(), m.group(1))
+        for m in re.finditer(r"^[0-9a-f]+ <(.*)>:$", dump, re.MULTILINE)
+        if m.group(1) in fn_names
+    ]
+    ret = {}
+    for i, (start, fn_name) in enumerate(starts):
+        end = starts[i + 1][0] if i + 1 < len(starts) else len(dump)
+        ret[fn_name] = dump[start:end].rstrip("\n")
+    return ret
 
 
 def search_build_objects(objname: str, project: ProjectSettings) -> Optional[str]:
@@ -1245,6 +2093,104 @@ def search_build_objects(objname: str, project: ProjectSettings) -> Optional[str
     return None
 
 
+# (line, object file, ram-to-rom offset) for a line of a GNU map file
+GnuMapLine = Tuple[str, Optional[str], Optional[int]]
+
+
+class MapFile:
+    """A linker map file, kept in memory across lookups (in daemon and batch
+    modes). GNU maps get indexed by symbol name from the second lookup on; a
+    one-shot run looks up a single function, for which a linear scan is
+    cheaper than building the index."""
+
+    contents: str
+    lookups: int
+
+    def __init__(self, contents: str) -> None:
+        self.contents = contents
+        self.lookups = 0
+        self._gnu_index: Dict[str, Dict[str, List[GnuMapLine]]] = {}
+
+    def _scan_gnu(self, diff_section: str, fn_name: Optional[str]) -> List[GnuMapLine]:
+        section_prefix = " " + diff_section
+        suffix = f" {fn_name}"
+        infix = f" {fn_name} = 0x"
+        ret = []
+        cur_objfile = None
+        ram_to_rom = None
+        last_line = ""
+        for line in self.contents.split("\n"):
+            if line.startswith(section_prefix):
+                cur_objfile = line.split()[3]
+            if "load address" in line:
+                tokens = last_line.split() + line.split()
+                ram = int(tokens[1], 0)
+                rom = int(tokens[5], 0)
+                ram_to_rom = rom - ram
+            if fn_name is None or line.endswith(suffix) or infix in line:
+                ret.append((line, cur_objfile, ram_to_rom))
+            last_line = line
+        return ret
+
+    def gnu_object_files(self, diff_section: str) -> List[str]:
+        section_prefix = " " + diff_section
+        ret: Dict[str, None] = {}
+        for line in self.contents.split("\n"):
+            if line.startswith(section_prefix):
+                tokens = line.split()
+                if len(tokens) >= 4:
+                    ret[tokens[3]] = None
+        return list(ret)
+
+    def gnu_symbol_lines(self, fn_name: str, diff_section: str) -> List[GnuMapLine]:
+        """Find the lines that define `fn_name`, with the object file and
+        ram-to-rom offset in effect at that point."""
+        self.lookups += 1
+        if self.lookups == 1 or " " in fn_name:
+            return self._scan_gnu(diff_section, fn_name)
+
+        index = self._gnu_index.get(diff_section)
+        if index is None:
+            index = defaultdict(list)
+            for entry in self._scan_gnu(diff_section, None):
+                line = entry[0]
+                keys = {line.rpartition(" ")[2]}
+                pos = line.find(" = 0x")
+                while pos != -1:
+                    keys.add(line[:pos].rpartition(" ")[2])
+                    pos = line.find(" = 0x", pos + 1)
+                for key in keys:
+                    index[key].append(entry)
+            self._gnu_index[diff_section] = index
+
+        suffix = f" {fn_name}"
+        infix = f" {fn_name} = 0x"
+        return [
+            entry
+            for entry in index.get(fn_name, [])
+            if entry[0].endswith(suffix) or infix in entry[0]
+        ]
+
+
+_map_files: Dict[str, Tuple[Tuple[int, int], MapFile]] = {}
+
+
+def load_map_file(path: str) -> MapFile:
+    st = os.stat(path)
+    stamp = (st.st_mtime_ns, st.st_size)
+    cached = _map_files.get(path)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+    with open(
+        path,
+        encoding=MAPFILE_ENCODING,
+        errors=MAPFILE_ENCODING_ERROR_HANDLER,
+    ) as f:
+        map_file = MapFile(f.read())
+    _map_files[path] = (stamp, map_file)
+    return map_file
+
+
 def search_map_file(
     fn_name: str, project: ProjectSettings, config: Config, *, for_binary: bool
 ) -> Tuple[Optional[str], Optional[int]]:
@@ -1252,14 +2198,10 @@ def search_map_file(
         fail(f"No map file configured; cannot find function {fn_name}.")
 
     try:
-        with open(
-            project.mapfile,
-            encoding=MAPFILE_ENCODING,
-            errors=MAPFILE_ENCODING_ERROR_HANDLER,
-        ) as f:
-            contents = f.read()
+        map_file = load_map_file(project.mapfile)
     except Exception:
         fail(f"Failed to open map file {project.mapfile} for reading.")
+    contents = map_file.contents
 
     if project.map_format == "gnu":
         if for_binary and "load address" not in contents:
@@ -1268,29 +2210,19 @@ def search_map_file(
                 '"export LANG := C" to your Makefile to avoid localized output?'
             )
 
-        lines = contents.split("\n")
-
         try:
-            cur_objfile = None
-            ram_to_rom = None
             cands = []
-            last_line = ""
-            for line in lines:
-                if line.startswith(" " + config.diff_section):
-                    cur_objfile = line.split()[3]
-                if "load address" in line:
-                    tokens = last_line.split() + line.split()
-                    ram = int(tokens[1], 0)
-                    rom = int(tokens[5], 0)
-                    ram_to_rom = rom - ram
-                if line.endswith(" " + fn_name) or f" {fn_name} = 0x" in line:
-                    ram = int(line.split()[0], 0)
-                    if (for_binary and ram_to_rom is not None) or (
-                        not for_binary and cur_objfile is not None
-                    ):
-                        cands.append((cur_objfile, ram + (ram_to_rom or 0)))
-                last_line = line
+            for line, cur_objfile, ram_to_rom in map_file.gnu_symbol_lines(
+                fn_name, config.diff_section
+            ):
+                ram = int(line.split()[0], 0)
+                if (for_binary and ram_to_rom is not None) or (
+                    not for_binary and cur_objfile is not None
+                ):
+                    cands.append((cur_objfile, ram + (ram_to_rom or 0)))
         except Exception as e:
+            import traceback
+
             traceback.print_exc()
             fail(f"Internal error while parsing map file")
 
@@ -1369,16 +2301,247 @@ def search_map_file(
     return None, None
 
 
-def parse_elf_rodata_references(
-    data: bytes, config: Config
-) -> List[Tuple[int, int, str]]:
+@dataclass
+class ElfSymbol:
+    name: str
+    value: int
+    size: int
+    type: int
+    bind: int
+    # Name of the section the symbol is defined in, "" if undefined/absolute.
+    section: str
+
+
+STT_NOTYPE = 0
+STT_FUNC = 2
+STB_GLOBAL = 1
+
+
+def parse_elf_symbols(data: bytes) -> List[ElfSymbol]:
     e_ident = data[:16]
     if e_ident[:4] != b"\x7fELF":
         return []
 
     SHT_SYMTAB = 2
-    SHT_REL = 9
-    SHT_RELA = 4
+
+    is_32bit = e_ident[4] == 1
+    is_little_endian = e_ident[5] == 1
+    str_end = "<" if is_little_endian else ">"
+    str_off = "I" if is_32bit else "Q"
+
+    def read(spec: str, offset: int) -> Tuple[int, ...]:
+        spec = spec.replace("P", str_off)
+        size = struct.calcsize(spec)
+        return struct.unpack(str_end + spec, data[offset : offset + size])
+
+    def read_str(offset: int) -> str:
+        return data[offset : data.index(b"\0", offset)].decode("latin1")
+
+    # e_shoff, e_flags, e_ehsize, e_phentsize, e_phnum, e_shentsize, ...
+    e_shoff, _, _, _, _, e_shentsize, e_shnum, e_shstrndx = read(
+        "PIHHHHHH", 32 if is_32bit else 40
+    )
+    if e_shoff == 0 or e_shnum == 0:
+        return []
+
+    # (sh_name, sh_type, sh_offset, sh_size, sh_link, sh_entsize)
+    sections = []
+    for i in range(e_shnum):
+        sh_name, sh_type, _, _, sh_offset, sh_size, sh_link, _, _, sh_entsize = read(
+            "IIPPPPIIPP", e_shoff + i * e_shentsize
+        )
+        sections.append((sh_name, sh_type, sh_offset, sh_size, sh_link, sh_entsize))
+    shstr_offset = sections[e_shstrndx][2]
+    sec_names = [read_str(shstr_offset + sec[0]) for sec in sections]
+
+    ret = []
+    for _, sh_type, sh_offset, sh_size, sh_link, sh_entsize in sections:
+        if sh_type != SHT_SYMTAB:
+            continue
+        strtab_offset = sections[sh_link][2]
+        for offset in range(sh_offset + sh_entsize, sh_offset + sh_size, sh_entsize):
+            if is_32bit:
+                st_name, st_value, st_size, st_info, _, st_shndx = read(
+                    "IIIBBH", offset
+                )
+            else:
+                st_name, st_info, _, st_shndx, st_value, st_size = read(
+                    "IBBHQQ", offset
+                )
+            ret.append(
+                ElfSymbol(
+                    name=read_str(strtab_offset + st_name),
+                    value=st_value,
+                    size=st_size,
+                    type=st_info & 0xF,
+                    bind=st_info >> 4,
+                    section=sec_names[st_shndx] if 0 < st_shndx < e_shnum else "",
+                )
+            )
+    return ret
+
+
+def elf_function_names(data: bytes, section: str) -> List[str]:
+    """Functions defined in the given section of an ELF file, in address order.
+    Global untyped symbols count too, since that is how functions written in
+    assembly usually end up."""
+    return [
+        sym.name
+        for sym in sorted(parse_elf_symbols(data), key=lambda sym: sym.value)
+        if sym.section == section
+        and sym.name
+        and (
+            sym.type == STT_FUNC or (sym.type == STT_NOTYPE and sym.bind == STB_GLOBAL)
+        )
+    ]
+
+
+_elf_symbol_indexes: Dict[str, Tuple[Tuple[int, int], Dict[str, List[ElfSymbol]]]] = {}
+
+
+def load_elf_symbol_index(path: str) -> Dict[str, List[ElfSymbol]]:
+    """The symbols of an ELF file by name, cached until the file changes."""
+    st = os.stat(path)
+    stamp = (st.st_mtime_ns, st.st_size)
+    cached = _elf_symbol_indexes.get(path)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+    with open(path, "rb") as f:
+        symbols = parse_elf_symbols(f.read())
+    index: Dict[str, List[ElfSymbol]] = defaultdict(list)
+    for sym in symbols:
+        index[sym.name].append(sym)
+    _elf_symbol_indexes[path] = (stamp, index)
+    return index
+
+
+def elf_symbol_range(path: str, name: str, config: Config) -> Optional[Tuple[int, int]]:
+    """The start and end address of a function in an ELF file, if there is a
+    single symbol with that name and a size in the diffed section."""
+    try:
+        index = load_elf_symbol_index(path)
+    except OSError:
+        return None
+    syms = [
+        sym
+        for sym in index.get(name, [])
+        if sym.section == config.diff_section and sym.size > 0
+    ]
+    if len(syms) != 1:
+        return None
+    start = syms[0].value
+    if config.arch.name == "arm32":
+        # Thumb function symbols have the lowest bit set
+        start &= ~1
+    return start, start + syms[0].size
+
+
+def bound_disassembled_symbol(
+    flags: List[str], target: str, config: Config
+) -> List[str]:
+    """Replace --disassemble=<symbol>, as used by -e, by the address range of
+    the symbol. This saves objdump from going through the symbol table of a
+    large ELF to find it."""
+    for i, flag in enumerate(flags):
+        for prefix in ("--disassemble=", "--disassemble-symbols="):
+            if not flag.startswith(prefix):
+                continue
+            bounds = elf_symbol_range(target, flag[len(prefix) :], config)
+            if bounds is None:
+                return flags
+            return (
+                flags[:i]
+                + [f"--start-address={bounds[0]}", f"--stop-address={bounds[1]}"]
+                + flags[i + 1 :]
+            )
+    return flags
+
+
+def elf_section_contents(data: bytes, section: str) -> Optional[Tuple[int, bytes]]:
+    """The address and contents of a section of an ELF file, if there is a
+    single section with that name that has contents."""
+    e_ident = data[:16]
+    if e_ident[:4] != b"\x7fELF":
+        return None
+
+    SHT_NOBITS = 8
+
+    is_32bit = e_ident[4] == 1
+    is_little_endian = e_ident[5] == 1
+    str_end = "<" if is_little_endian else ">"
+    str_off = "I" if is_32bit else "Q"
+
+    def read(spec: str, offset: int) -> Tuple[int, ...]:
+        spec = spec.replace("P", str_off)
+        size = struct.calcsize(spec)
+        return struct.unpack(str_end + spec, data[offset : offset + size])
+
+    e_shoff, _, _, _, _, e_shentsize, e_shnum, e_shstrndx = read(
+        "PIHHHHHH", 32 if is_32bit else 40
+    )
+    if e_shoff == 0 or e_shnum == 0:
+        return None
+
+    sections = [read("IIPPPPIIPP", e_shoff + i * e_shentsize) for i in range(e_shnum)]
+    shstr_offset = sections[e_shstrndx][4]
+    name = section.encode("utf-8")
+    found = []
+    for sh_name, sh_type, _, sh_addr, sh_offset, sh_size, _, _, _, _ in sections:
+        offset = shstr_offset + sh_name
+        if (
+            data[offset : data.index(b"\0", offset)] == name
+            and sh_type != SHT_NOBITS
+            and sh_size != 0
+        ):
+            found.append((sh_addr, data[sh_offset : sh_offset + sh_size]))
+    if len(found) != 1:
+        return None
+    return found[0]
+
+
+class InstructionBytes:
+    """The contents of the disassembled part of a file by address, for
+    reading the bytes of instructions from it with --lean-dump."""
+
+    def __init__(self, base: int, data: bytes) -> None:
+        self.base = base
+        self.data = data
+
+    @staticmethod
+    def from_file(
+        data: bytes, flags: List[str], config: Config
+    ) -> Optional["InstructionBytes"]:
+        """For a file disassembled with the given objdump flags: a raw binary
+        with -bbinary, an ELF otherwise."""
+        if "-bbinary" in flags:
+            return InstructionBytes(0, data)
+        contents = elf_section_contents(data, config.diff_section)
+        if contents is None:
+            return None
+        return InstructionBytes(*contents)
+
+    def window(self, start: int, end: int) -> "InstructionBytes":
+        """The bytes from `start` up to `end`, to pass on without the rest."""
+        return InstructionBytes(start, self.read(start, end - start))
+
+    def read(self, addr: int, size: int) -> bytes:
+        offset = addr - self.base
+        if offset < 0:
+            return b""
+        return self.data[offset : offset + size]
+
+
+@timed("rodata_refs")
+def parse_elf_rodata_references(
+    data: bytes, config: Config
+) -> List[Tuple[int, int, str]]:
+    e_ident = data[:16]
+    if e_ident[:4] != b"\x7fELF":
+        return []
+
+    SHT_SYMTAB = 2
+    SHT_REL = 9
+    SHT_RELA = 4
     R_MIPS_32 = 2
     R_MIPS_GPREL32 = 12
 
@@ -1505,7 +2668,13 @@ def dump_elf(
     if end is not None:
         end_addr = eval_int(end, "End address must be an integer expression.")
     else:
-        end_addr = start_addr + config.max_function_size_bytes
+        # The base ELF is usually stripped, but if it has the symbol, stop at
+        # the end of it.
+        bounds = elf_symbol_range(project.baseimg, diff_elf_symbol, config)
+        if bounds is not None:
+            end_addr = start_addr + bounds[1] - bounds[0]
+        else:
+            end_addr = start_addr + config.max_function_size_bytes
 
     flags1 = [
         f"--start-address={start_addr}",
@@ -1563,12 +2732,7 @@ def dump_objfile(
     if config.diff_mode != DiffMode.SINGLE and not os.path.isfile(refobjfile):
         fail(f'Please ensure an OK .o file exists at "{refobjfile}".')
 
-    if project.disassemble_all:
-        disassemble_flag = "-D"
-    else:
-        disassemble_flag = "-d"
-
-    objdump_flags = [disassemble_flag, "-rz", "-j", config.diff_section]
+    objdump_flags = objfile_objdump_flags(config, project)
     return (
         objfile,
         (objdump_flags, refobjfile, start),
@@ -1576,6 +2740,15 @@ def dump_objfile(
     )
 
 
+def objfile_objdump_flags(config: Config, project: ProjectSettings) -> List[str]:
+    if project.disassemble_all:
+        disassemble_flag = "-D"
+    else:
+        disassemble_flag = "-d"
+
+    return [disassemble_flag, "-rz", "-j", config.diff_section]
+
+
 def dump_binary(
     start: str, end: Optional[str], config: Config, project: ProjectSettings
 ) -> Tuple[str, ObjdumpCommand, ObjdumpCommand]:
@@ -1611,24 +2784,103 @@ def dump_binary(
     )
 
 
+@dataclass(frozen=True)
+class Relocation:
+    """A relocation as listed by objdump -r, e.g. "4: R_MIPS_HI16 sym+0x10"
+    has type "R_MIPS_HI16", symbol "sym" and addend "+0x10"."""
+
+    type: str
+    symbol: str
+    addend: str = ""
+
+    def target(self) -> str:
+        return self.symbol + self.addend
+
+
+RELOC_TARGET_PATTERN = re.compile(r"(.*?)([+-]0x[0-9a-f]+)?")
+
+
+def parse_reloc(row: str) -> Relocation:
+    parts = row.split(":", 1)[-1].split()
+    target = parts[-1] if len(parts) >= 2 else ""
+    target_match = RELOC_TARGET_PATTERN.fullmatch(target)
+    assert target_match
+    symbol, addend = target_match.groups()
+    return Relocation(parts[0] if parts else "", symbol, addend or "")
+
+
+class UnknownRelocationError(Exception):
+    def __init__(self, reloc: Relocation, line: str) -> None:
+        super().__init__(f"unknown relocation type '{reloc.type}' for line '{line}'")
+        self.reloc = reloc
+        self.line = line
+
+
 # The base class is a no-op.
 class AsmProcessor:
+    # How each relocation type is shown in place of the relocated immediate,
+    # as a format string for the relocation target, or None to leave the line
+    # as it is.
+    reloc_formats: Dict[str, Optional[str]] = {}
+    # The format for relocation types missing from reloc_formats. If None,
+    # they raise UnknownRelocationError.
+    default_reloc_format: Optional[str] = None
+    # Whether preprocess_objdump() reads the raw bytes column of instruction
+    # lines. With --lean-dump, that column gets filled in from the disassembled
+    # file, as formatted by raw_insn_column().
+    reads_raw_insn = False
+
     def __init__(self, config: Config) -> None:
         self.config = config
 
+    def raw_insn_column(self, data: bytes) -> str:
+        return data.hex()
+
+    def raw_insn_columns(
+        self, insns: List[Tuple[int, str]], code: "InstructionBytes"
+    ) -> List[str]:
+        """The raw bytes columns of the instruction lines of a dump, given their
+        addresses and their text after the address, or "" for instructions of
+        unknown size."""
+        addrs = [addr for addr, _ in insns]
+        columns = []
+        for addr, size in zip(addrs, instruction_sizes(addrs, self.config.arch)):
+            data = code.read(addr, size) if size is not None else b""
+            columns.append(self.raw_insn_column(data) if data else "")
+        return columns
+
     # Called during run_objdump() for arch-specific normalization. Runs before
-    # diff-processing, i.e. process().
+    # diff-processing, i.e. process(). Lines that get rewritten can be returned
+    # as rows, so that parse_dump_lines() doesn't have to parse them again.
+    def preprocess_objdump_lines(self, objdump: str) -> List[Union[str, "DumpRow"]]:
+        return list(objdump.split("\n"))
+
     def preprocess_objdump(self, objdump: str) -> str:
-        return objdump
+        """The text form of preprocess_objdump_lines()."""
+        return "\n".join(
+            line if isinstance(line, str) else line.text
+            for line in self.preprocess_objdump_lines(objdump)
+        )
 
     def pre_process(
-        self, mnemonic: str, args: str, next_row: Optional[str], comment: Optional[str]
+        self,
+        mnemonic: str,
+        args: str,
+        next_reloc: Optional[Relocation],
+        comment: Optional[str],
     ) -> Tuple[str, str]:
         return mnemonic, args
 
-    def process_reloc(self, row: str, prev: str) -> Tuple[str, Optional[str]]:
+    def process_reloc(self, reloc: Relocation, prev: str) -> Tuple[str, Optional[str]]:
         return prev, None
 
+    def reloc_format(self, reloc: Relocation, prev: str) -> Optional[str]:
+        if reloc.type in self.reloc_formats:
+            return self.reloc_formats[reloc.type]
+        if self.default_reloc_format is None:
+            raise UnknownRelocationError(reloc, prev)
+        return self.default_reloc_format
+
     def normalize(self, mnemonic: str, row: str) -> str:
         """This should be called exactly once for each line."""
         arch = self.config.arch
@@ -1648,49 +2900,45 @@ class AsmProcessor:
 
 
 class AsmProcessorMIPS(AsmProcessor):
+    reloc_formats = {
+        # GNU as emits no-op relocations immediately after real ones when
+        # assembling with -mabi=64. Leave the line alone without trying to parse
+        # 'imm' as an integer.
+        "R_MIPS_NONE": None,
+        "R_MIPS_JALR": None,
+        "R_MIPS_LO16": "%lo({})",
+        # Ideally we'd pair up R_MIPS_LO16 and R_MIPS_HI16 to generate a
+        # correct addend for each, but objdump doesn't give us the order of
+        # the relocations, so we can't find the right LO16. :(
+        "R_MIPS_HI16": "%hi({})",
+        # Function calls
+        "R_MIPS_26": "{}",
+        # Branch to glabel. This gives confusing output, but there's not much
+        # we can do here.
+        "R_MIPS_PC16": "{}",
+        "R_MIPS_GPREL16": "%gp_rel({})",
+        "R_MIPS_GOT16": "%got({})",
+        "R_MIPS_CALL16": "%call16({})",
+        "R_MIPS_LITERAL": "{}",
+    }
+
     def __init__(self, config: Config) -> None:
         super().__init__(config)
         self.seen_jr_ra = False
 
-    def process_reloc(self, row: str, prev: str) -> Tuple[str, Optional[str]]:
-        arch = self.config.arch
-        if "R_MIPS_NONE" in row or "R_MIPS_JALR" in row:
-            # GNU as emits no-op relocations immediately after real ones when
-            # assembling with -mabi=64. Return without trying to parse 'imm' as an
-            # integer.
+    def process_reloc(self, reloc: Relocation, prev: str) -> Tuple[str, Optional[str]]:
+        fmt = self.reloc_format(reloc, prev)
+        if fmt is None:
             return prev, None
         before, imm, after = parse_relocated_line(prev)
         addend = reloc_addend_from_imm(imm, before, self.config.arch)
-        repl = row.split()[-1] + addend
-        if "R_MIPS_LO16" in row:
-            repl = f"%lo({repl})"
-        elif "R_MIPS_HI16" in row:
-            # Ideally we'd pair up R_MIPS_LO16 and R_MIPS_HI16 to generate a
-            # correct addend for each, but objdump doesn't give us the order of
-            # the relocations, so we can't find the right LO16. :(
-            repl = f"%hi({repl})"
-        elif "R_MIPS_26" in row:
-            # Function calls
-            pass
-        elif "R_MIPS_PC16" in row:
-            # Branch to glabel. This gives confusing output, but there's not much
-            # we can do here.
-            pass
-        elif "R_MIPS_GPREL16" in row:
-            repl = f"%gp_rel({repl})"
-        elif "R_MIPS_GOT16" in row:
-            repl = f"%got({repl})"
-        elif "R_MIPS_CALL16" in row:
-            repl = f"%call16({repl})"
-        elif "R_MIPS_LITERAL" in row:
-            # MWCC emits R_MIPS_LITERAL for float literals which don't have the same structure as the
-            # relocations emitted by GCC
-            # Only remove the addend if it is found in the relocation
-            if addend != "":
-                # .lit4+0x4000-0x4000 -> .lit4+0x4000
-                repl = repl[: -len(addend)]
-        else:
-            assert False, f"unknown relocation type '{row}' for line '{prev}'"
+        if reloc.type == "R_MIPS_LITERAL":
+            # MWCC emits R_MIPS_LITERAL for float literals which don't have the
+            # same structure as the relocations emitted by GCC. The addend is
+            # already in the relocation, so don't add the immediate to it:
+            # .lit4+0x4000-0x4000 -> .lit4+0x4000
+            addend = ""
+        repl = fmt.format(reloc.target() + addend)
         return before + repl + after, repl
 
     def is_end_of_function(self, mnemonic: str, args: str) -> bool:
@@ -1703,10 +2951,43 @@ class AsmProcessorMIPS(AsmProcessor):
 
 
 class AsmProcessorPPC(AsmProcessor):
+    reloc_formats = {
+        # Function calls, or unconditional branches generated by GCC "b offset"
+        "R_PPC_REL24": "{}",
+        "R_PPC_PLTREL24": "{}",
+        "R_PPC_REL14": "{}",
+        "R_PPC_REL14_BRTAKEN": "{}",
+        "R_PPC_REL14_BRNTAKEN": "{}",
+        # absolute hi of addr
+        "R_PPC_ADDR16_HI": "{}@h",
+        # adjusted hi of addr
+        "R_PPC_ADDR16_HA": "{}@ha",
+        # lo of addr
+        "R_PPC_ADDR16_LO": "{}@l",
+        # 16-bit absolute addr
+        "R_PPC_ADDR16": "{}",
+        # sda21 relocations; r2/r13 --> 0 swaps are performed in pre_process
+        "R_PPC_EMB_SDA21": "{}@sda21",
+    }
+
+    def _is_text_branch(self, reloc: Relocation, mnemonic: str) -> bool:
+        """GCC emits branch relocations to .text offsets, which pre_process
+        applies to the arguments."""
+        return (
+            mnemonic in PPC_BRANCH_INSTRUCTIONS
+            and reloc.type in PPC_BRANCH_RELOCS
+            and reloc.symbol == ".text"
+            and reloc.addend.startswith("+0x")
+        )
+
     def pre_process(
-        self, mnemonic: str, args: str, next_row: Optional[str], comment: Optional[str]
+        self,
+        mnemonic: str,
+        args: str,
+        next_reloc: Optional[Relocation],
+        comment: Optional[str],
     ) -> Tuple[str, str]:
-        if next_row and "R_PPC_EMB_SDA21" in next_row:
+        if next_reloc and next_reloc.type == "R_PPC_EMB_SDA21":
             # With sda21 relocs, the linker transforms `r0` into `r2`/`r13`, and
             # we may encounter this in either pre-transformed or post-transformed
             # versions depending on if the .o file comes from compiler output or
@@ -1726,29 +3007,17 @@ class AsmProcessorPPC(AsmProcessor):
                 mnemonic = mnemonic.replace("li", "addi")
                 args_parts = args.split(",")
                 args = args_parts[0] + ",0," + args_parts[1]
-        if (
-            next_row
-            and ("R_PPC_REL24" in next_row or "R_PPC_REL14" in next_row)
-            and ".text+0x" in next_row
-            and mnemonic in PPC_BRANCH_INSTRUCTIONS
-        ):
+        if next_reloc and self._is_text_branch(next_reloc, mnemonic):
             # GCC emits a relocation of "R_PPC_REL14" or "R_PPC_REL24" with a .text offset
             # fixup the args to use the offset from the relocation
 
             # Split args by ',' which will result in either [cr, offset] or [offset]
-            # Replace the current offset with the next line's ".text+0x" offset
+            # Replace the current offset with the relocation's ".text+0x" offset
             splitArgs = args.split(",")
-            splitArgs[-1] = next_row.split(".text+0x")[-1]
+            splitArgs[-1] = next_reloc.addend[len("+0x") :]
             args = ",".join(splitArgs)
 
-        if (
-            comment is not None
-            and (
-                next_row is None
-                or re.search(self.config.arch.re_reloc, next_row) is None
-            )
-            and mnemonic == "bl"
-        ):
+        if comment is not None and next_reloc is None and mnemonic == "bl":
             # if the mnemonic is bl and the comment doesn't match
             # <.text+0x...> replace the args with the contents of the comment
             if re.search(r"<.+\+0x[0-9a-fA-F]+>", comment) is None:
@@ -1756,49 +3025,25 @@ class AsmProcessorPPC(AsmProcessor):
 
         return mnemonic, args
 
-    def process_reloc(self, row: str, prev: str) -> Tuple[str, Optional[str]]:
-        # row is the line with the relocations
-        # prev is the line to apply relocations to
-
-        arch = self.config.arch
-        assert any(
-            r in row
-            for r in ["R_PPC_REL24", "R_PPC_ADDR16", "R_PPC_EMB_SDA21", "R_PPC_REL14"]
-        ), f"unknown relocation type '{row}' for line '{prev}'"
+    def process_reloc(self, reloc: Relocation, prev: str) -> Tuple[str, Optional[str]]:
+        # prev is the line to apply the relocation to
+        fmt = self.reloc_format(reloc, prev)
         before, imm, after = parse_relocated_line(prev)
-        repl = row.split()[-1]
         mnemonic, args = prev.split(maxsplit=1)
+        if fmt is None or self._is_text_branch(reloc, mnemonic):
+            # this has been handled in pre_process
+            return prev, None
 
-        if "R_PPC_REL24" in row:
-            # function calls
-            # or unconditional branches generated by GCC "b offset"
-            if mnemonic in PPC_BRANCH_INSTRUCTIONS and ".text+0x" in row:
-                # this has been handled in pre_process
-                return prev, None
-        elif "R_PPC_REL14" in row:
-            if mnemonic in PPC_BRANCH_INSTRUCTIONS and ".text+0x" in row:
-                # this has been handled in pre_process
-                return prev, None
-        elif "R_PPC_ADDR16_HI" in row:
-            # absolute hi of addr
-            repl = f"{repl}@h"
-        elif "R_PPC_ADDR16_HA" in row:
-            # adjusted hi of addr
-            repl = f"{repl}@ha"
-        elif "R_PPC_ADDR16_LO" in row:
-            # lo of addr
-            repl = f"{repl}@l"
-        elif "R_PPC_ADDR16" in row:
-            # 16-bit absolute addr
-            if "+0x7" in repl:
-                # remove the very large addends as they are an artifact of (label-_SDA(2)_BASE_)
-                # computations and are unimportant in a diff setting.
-                if int(repl.split("+")[1], 16) > 0x70000000:
-                    repl = repl.split("+")[0]
-        elif "R_PPC_EMB_SDA21" in row:
-            # sda21 relocations; r2/r13 --> 0 swaps are performed in pre_process
-            repl = f"{repl}@sda21"
-
+        target = reloc.target()
+        if (
+            reloc.type == "R_PPC_ADDR16"
+            and reloc.addend.startswith("+0x7")
+            and int(reloc.addend[1:], 16) > 0x70000000
+        ):
+            # remove the very large addends as they are an artifact of (label-_SDA(2)_BASE_)
+            # computations and are unimportant in a diff setting.
+            target = reloc.symbol
+        repl = fmt.format(target)
         return before + repl + after, repl
 
     def is_end_of_function(self, mnemonic: str, args: str) -> bool:
@@ -1819,6 +3064,9 @@ ARM32_JUMP_TABLE_START = r"add\s+pc,\s*r"
 #  - ".short  0x0032   ; 0x64"
 ARM32_JUMP_TABLE_ENTRY_PATTERN = r"(?:(\w+):\s+([0-9a-f]+)\s+)?([\w\.]+)\s+([\w,\ ]+)"
 
+# Sizes of literal pool entries
+ARM32_DATA_SIZES = {".word": 4, ".short": 2, ".byte": 1}
+
 # Example: "ldr r4, [pc, #56]    ; (4c <AddCoins+0x4c>)"
 ARM32_LOAD_POOL_PATTERN = (
     r"(ldr\s+r([0-9]|1[0-3]),\s+\[pc,.*[;@]\s*)(\([a-fA-F0-9]+.*\))"
@@ -1826,6 +3074,15 @@ ARM32_LOAD_POOL_PATTERN = (
 
 
 class AsmProcessorARM32(AsmProcessor):
+    reloc_formats = {
+        # R_ARM_V4BX converts "bx <reg>" to "mov pc,<reg>" for some targets.
+        # Ignore for now.
+        "R_ARM_V4BX": None,
+    }
+    default_reloc_format = "{}"
+
+    reads_raw_insn = True
+
     @dataclass
     class JumpTableEntry:
         cur_addr: int
@@ -1833,14 +3090,82 @@ class AsmProcessorARM32(AsmProcessor):
         value: int
         is_word: bool
 
-    def preprocess_objdump(self, objdump: str) -> str:
+    def raw_insn_column(self, data: bytes) -> str:
+        # objdump shows the value of the halfword or word
+        if self.config.arch.big_endian:
+            value = int.from_bytes(data, "big")
+        else:
+            value = int.from_bytes(data, "little")
+        return f"{value:0{2 * len(data)}x} "
+
+    def is_thumb32(self, data: bytes) -> bool:
+        """Whether the first halfword of data starts a 32-bit Thumb encoding."""
+        if len(data) < 2:
+            return False
+        hw1 = int(self.raw_insn_column(data[:2]), 16)
+        return hw1 >> 11 in (0x1D, 0x1E, 0x1F)
+
+    def raw_insn_columns(
+        self, insns: List[Tuple[int, str]], code: "InstructionBytes"
+    ) -> List[str]:
+        if not insns:
+            return []
+        addrs = [addr for addr, _ in insns]
+        sizes = instruction_sizes(addrs, self.config.arch)
+        mnemonics = [insn.split("\t", 1)[0].strip() for _, insn in insns]
+
+        # Whether this is Thumb code, or None if all instructions before the
+        # last one could be 32-bit ones in either ARM or Thumb code.
+        thumb: Optional[bool] = None
+        for addr, size, mnemonic in zip(addrs, sizes[:-1], mnemonics):
+            if mnemonic in ARM32_DATA_SIZES:
+                continue
+            if size == 2:
+                thumb = True
+                break
+            if size == 4 and not self.is_thumb32(code.read(addr, 2)):
+                thumb = False
+
+        if mnemonics[-1] in ARM32_DATA_SIZES:
+            # Literal pools
+            sizes[-1] = ARM32_DATA_SIZES[mnemonics[-1]]
+        elif thumb is False or self.is_thumb32(code.read(addrs[-1], 2)):
+            sizes[-1] = 4
+        elif thumb:
+            sizes[-1] = 2
+
+        columns = []
+        for addr, size, mnemonic in zip(addrs, sizes, mnemonics):
+            data = code.read(addr, size) if size is not None else b""
+            if mnemonic in ARM32_DATA_SIZES:
+                columns.append(self.raw_insn_column(data) if data else "")
+            elif not data or thumb is None:
+                # Without knowing the mode, it's unknown how objdump would
+                # group the bytes.
+                columns.append("")
+            elif thumb and len(data) == 4:
+                # objdump shows 32-bit Thumb encodings as two halfwords
+                hw1 = self.raw_insn_column(data[:2])
+                columns.append(hw1 + self.raw_insn_column(data[2:]))
+            else:
+                columns.append(self.raw_insn_column(data))
+        return columns
+
+    def preprocess_objdump_lines(self, objdump: str) -> List[Union[str, "DumpRow"]]:
         def short_table_entry(
             cur_addr: int, jump_table_start_addr: int, value: int
-        ) -> str:
+        ) -> DumpRow:
             branch_target = jump_table_start_addr + value + 4
-            return f"  {cur_addr:x}:	{value:04x}      	.short	0x{value:04x}  ; 0x{branch_target:x}"
+            args = f"0x{value:04x}  ; 0x{branch_target:x}"
+            return DumpRow(
+                text=f"  {cur_addr:x}:\t{value:04x}      \t.short\t{args}",
+                addr=cur_addr,
+                raw_bytes=f"{value:04x}",
+                mnemonic=".short",
+                args=args,
+            )
 
-        new_lines = []
+        new_lines: List[Union[str, DumpRow]] = []
         lines = objdump.splitlines()
         for i, jump_table_entry in self._lines_iterator(lines):
             if jump_table_entry is None:
@@ -1863,77 +3188,90 @@ class AsmProcessorARM32(AsmProcessor):
                         entry.cur_addr, entry.table_start_addr, entry.value
                     )
                 )
-        return "\n".join(new_lines)
+        return new_lines
 
     # An iterator for each line of assembly, returning the line index and optional
     # metadata if the line is a jump table entry.
+    #
+    # This makes a single forward pass, remembering the most recent `cmp` with a
+    # positive immediate, since that's where the number of entries of a jump
+    # table is found. Regexes are only run on lines that can match them.
     def _lines_iterator(
         self, lines: List[str]
     ) -> Iterator[Tuple[int, Optional[JumpTableEntry]]]:
         jump_table_entries = 0
         table_start_addr = 0
+        # The number of entries given by the most recent `cmp`, or 0 if none.
+        cmp_entries = 0
         for i, line in enumerate(lines):
-            addr_match = re.match(r"^\s*([0-9a-f]+):", line)
-            addr = int(addr_match.group(1), 16) if addr_match else -1
-            entry_match = re.search(ARM32_JUMP_TABLE_ENTRY_PATTERN, line)
-            if jump_table_entries > 0 and entry_match:
-                try:
-                    # Try parsing argument to .short/.word
-                    value = int(entry_match.group(4), 16)
-                except ValueError:
-                    # No luck; maybe it got disassembled to an instruction,
-                    # from which we need to read the instruction bytes instead.
+            if jump_table_entries > 0:
+                entry_match = re.search(ARM32_JUMP_TABLE_ENTRY_PATTERN, line)
+                if entry_match:
                     try:
-                        value = int(entry_match.group(2) or "", 16)
+                        # Try parsing argument to .short/.word
+                        value = int(entry_match.group(4), 16)
                     except ValueError:
-                        # Something went wrong; avoid crashing. This has been
-                        # seen to happen in practice when we misparsed the asm
-                        # when searching for a cmp and ended up with the wrong
-                        # number of entries, after which we ran into a line with
-                        # a relocation rather than instruction bytes.
-                        jump_table_entries = 0
-                        break
-
-                table_entry = self.JumpTableEntry(
-                    cur_addr=addr,
-                    table_start_addr=table_start_addr,
-                    value=value,
-                    is_word=entry_match.group(3) == ".word",
-                )
-                jump_table_entries -= 2 if table_entry.is_word else 1
+                        # No luck; maybe it got disassembled to an instruction,
+                        # from which we need to read the instruction bytes instead.
+                        try:
+                            value = int(entry_match.group(2) or "", 16)
+                        except ValueError:
+                            # Something went wrong; avoid crashing. This has been
+                            # seen to happen in practice when we misparsed the asm
+                            # when searching for a cmp and ended up with the wrong
+                            # number of entries, after which we ran into a line
+                            # with a relocation rather than instruction bytes.
+                            jump_table_entries = 0
+                            break
 
-                yield i, table_entry
-                continue
+                    table_entry = self.JumpTableEntry(
+                        cur_addr=self._line_addr(line),
+                        table_start_addr=table_start_addr,
+                        value=value,
+                        is_word=entry_match.group(3) == ".word",
+                    )
+                    jump_table_entries -= 2 if table_entry.is_word else 1
+
+                    cmp_entries = self._update_cmp_entries(line, cmp_entries)
+                    yield i, table_entry
+                    continue
 
             # Check for jump tables.
-            if re.search(ARM32_JUMP_TABLE_START, line):
-                jump_table_entries = self._jump_table_entries_count(lines, i)
-                table_start_addr = addr
+            if "pc" in line and re.search(ARM32_JUMP_TABLE_START, line):
+                jump_table_entries = cmp_entries
+                table_start_addr = self._line_addr(line)
+            cmp_entries = self._update_cmp_entries(line, cmp_entries)
             yield i, None
 
-    # Returns the number of entries in the jump table starting at `line_no`, or
-    # 0 if it's not a jump table.
-    def _jump_table_entries_count(self, raw_lines: List[str], line_no: int) -> int:
-        # The number of entries should be in the most recent `cmp` before the
-        # jump table.
-        for i in reversed(range(line_no)):
-            cmp_match = re.search(ARM32_COMPARE_IMM_PATTERN, raw_lines[i])
-            if cmp_match:
-                imm_match = re.match(r"#?(0x)?([0-9a-f]+)", cmp_match.group(2))
-                assert imm_match
-                base = 16 if imm_match.group(1) else 10
-                value = int(imm_match.group(2), base)
-                if value > 0:
-                    return value + 1
-        return 0
-
-    def process_reloc(self, row: str, prev: str) -> Tuple[str, Optional[str]]:
-        arch = self.config.arch
-        if "R_ARM_V4BX" in row:
-            # R_ARM_V4BX converts "bx <reg>" to "mov pc,<reg>" for some targets.
-            # Ignore for now.
+    @staticmethod
+    def _line_addr(line: str) -> int:
+        addr_match = re.match(r"^\s*([0-9a-f]+):", line)
+        return int(addr_match.group(1), 16) if addr_match else -1
+
+    # Returns the number of jump table entries given by `line` if it's a `cmp`
+    # against a positive immediate, or else `prev`.
+    @staticmethod
+    def _update_cmp_entries(line: str, prev: int) -> int:
+        if "cmp" not in line:
+            return prev
+        cmp_match = re.search(ARM32_COMPARE_IMM_PATTERN, line)
+        if not cmp_match:
+            return prev
+        imm_match = re.match(r"#?(0x)?([0-9a-f]+)", cmp_match.group(2))
+        if not imm_match:
+            return prev
+        base = 16 if imm_match.group(1) else 10
+        try:
+            value = int(imm_match.group(2), base)
+        except ValueError:
+            return prev
+        return value + 1 if value > 0 else prev
+
+    def process_reloc(self, reloc: Relocation, prev: str) -> Tuple[str, Optional[str]]:
+        fmt = self.reloc_format(reloc, prev)
+        if fmt is None:
             return prev, None
-        if "R_ARM_ABS32" in row and not prev.startswith(".word"):
+        if reloc.type == "R_ARM_ABS32" and not prev.startswith(".word"):
             # Don't crash on R_ARM_ABS32 relocations incorrectly applied to code.
             # (We may want to do something more fancy here that actually shows the
             # related symbol, but this serves as a stop-gap.)
@@ -1943,11 +3281,12 @@ class AsmProcessorARM32(AsmProcessor):
                 # In any case, this case seems safe enough to handle. The ELF
                 # I was looking at also uses RELA relocations, so we don't even
                 # need to parse the underlying bytes from the previous row.
-                sym = row.split()[-1]
+                sym = reloc.target()
                 return ".word " + sym, sym
             return prev, None
         before, imm, after = parse_relocated_line(prev)
-        repl = row.split()[-1] + reloc_addend_from_imm(imm, before, self.config.arch)
+        addend = reloc_addend_from_imm(imm, before, self.config.arch)
+        repl = fmt.format(reloc.target() + addend)
         return before + repl + after, repl
 
     def _normalize_arch_specific(self, mnemonic: str, row: str) -> str:
@@ -2045,29 +3384,55 @@ class AsmProcessorAArch64(AsmProcessor):
                 # ldr xxx, [reg, <imm>]
                 if f", [{reg}" in row_parts[1]:
                     self._adrp_pair_registers.remove(reg)
-                    return normalize_imms(row, AARCH64_SETTINGS)
+                    return normalize_imms(row, get_arch("aarch64"))
         elif mnemonic == "add":
             for reg in self._adrp_pair_registers:
                 # add reg, reg, <imm>
                 if row_parts[1].startswith(f"{reg}, {reg}, "):
                     self._adrp_pair_registers.remove(reg)
-                    return normalize_imms(row, AARCH64_SETTINGS)
+                    return normalize_imms(row, get_arch("aarch64"))
 
         return row
 
 
+# x86 relocations that are shown without a positive addend
+X86_SYMBOL_ONLY_RELOCS = {"dir32", "OFFPC16", "OFFPC32", "FAR16"}
+
+
 class AsmProcessorX86(AsmProcessor):
+    reloc_formats = {
+        "R_386_NONE": "{}",
+        "R_386_32": "{}",
+        "R_386_PC32": "{}",
+        "R_386_16": "{}",
+        "R_386_PC16": "{}",
+        "R_386_8": "{}",
+        "R_386_PC8": "{}",
+        "R_386_GOT32": "%got({})",
+        "R_386_GOT32X": "%got({})",
+        "R_386_PLT32": "%plt({})",
+        "R_386_RELATIVE": "%rel({})",
+        "R_386_GOTOFF": "%got({})",
+        "R_386_GOTPC": "%got({})",
+        "R_386_32PLT": "%plt({})",
+        "dir32": "{}",
+        "DISP32": "{}",
+        "OFF16": "{}",
+        "OFF32": "{}",
+        "OFFPC16": "{}",
+        "OFFPC32": "{}",
+        "FAR16": "{}",
+        "SEG": "{}",
+    }
+
     def pre_process(
-        self, mnemonic: str, args: str, next_row: Optional[str], comment: Optional[str]
+        self,
+        mnemonic: str,
+        args: str,
+        next_reloc: Optional[Relocation],
+        comment: Optional[str],
     ) -> Tuple[str, str]:
-        if (
-            comment is not None
-            and (
-                next_row is None
-                or re.search(self.config.arch.re_reloc, next_row) is None
-            )
-            and mnemonic == "call"
-        ):
+        if comment is not None and next_reloc is None and mnemonic == "call":
             # if the mnemonic is call and the comment doesn't match
             # <.text+0x...> replace the args with the contents of the comment
             if re.search(r"<.+\+0x[0-9a-fA-F]+>", comment) is None:
@@ -2075,7 +3440,7 @@ class AsmProcessorX86(AsmProcessor):
 
         return mnemonic, args
 
-    def process_reloc(self, row: str, prev: str) -> Tuple[str, Optional[str]]:
+    def process_reloc(self, reloc: Relocation, prev: str) -> Tuple[str, Optional[str]]:
         # ignore WRTSEG + FP 16-bit fixup
         ignore = [
             "WRTSEG",
@@ -2094,10 +3459,16 @@ class AsmProcessorX86(AsmProcessor):
             "FJGRQQ",
         ]
 
-        if any(x in row for x in ignore):
+        if any(x in reloc.type or x in reloc.symbol for x in ignore):
             return prev, None
 
-        repl = row.split()[-1]
+        fmt = self.reloc_format(reloc, prev)
+        if fmt is None:
+            return prev, None
+        repl = reloc.target()
+        if reloc.type in X86_SYMBOL_ONLY_RELOCS and reloc.addend.startswith("+"):
+            repl = reloc.symbol
+        repl = fmt.format(repl)
         mnemonic, args = prev.split(maxsplit=1)
         offset = False
         addr_imm = None
@@ -2163,55 +3534,6 @@ class AsmProcessorX86(AsmProcessor):
 
         start, end = addr_imm.span()
 
-        if "R_386_NONE" in row:
-            pass
-        elif "R_386_32" in row:
-            pass
-        elif "R_386_PC32" in row:
-            pass
-        elif "R_386_16" in row:
-            pass
-        elif "R_386_PC16" in row:
-            pass
-        elif "R_386_8" in row:
-            pass
-        elif "R_386_PC8" in row:
-            pass
-        elif "dir32" in row:
-            if "+" in repl:
-                repl = repl.split("+")[0]
-        elif "DISP32" in row:
-            pass
-        elif "OFF16" in row:
-            pass
-        elif "OFF32" in row:
-            pass
-        elif "OFFPC16" in row:
-            if "+" in repl:
-                repl = repl.split("+")[0]
-        elif "OFFPC32" in row:
-            if "+" in repl:
-                repl = repl.split("+")[0]
-        elif "R_386_GOT32" in row:
-            repl = f"%got({repl})"
-        elif "R_386_PLT32" in row:
-            repl = f"%plt({repl})"
-        elif "R_386_RELATIVE" in row:
-            repl = f"%rel({repl})"
-        elif "R_386_GOTOFF" in row:
-            repl = f"%got({repl})"
-        elif "R_386_GOTPC" in row:
-            repl = f"%got({repl})"
-        elif "R_386_32PLT" in row:
-            repl = f"%plt({repl})"
-        elif "FAR16" in row:
-            if "+" in repl:
-                repl = repl.split("+")[0]
-        elif "SEG" in row:
-            pass
-        else:
-            assert False, f"unknown relocation type '{row}' for line '{prev}'"
-
         if offset:
             of = addr_imm.group()
             if of[0] == "$":
@@ -2245,7 +3567,38 @@ SH_POOL_PATTERN = r"(^.+mov\.?([lwa])\s+)(?:0x)?([a-fA-F0-9]+)(\s*<.+>)?,(r[0-9]
 SH_POOL_PATTERN_NORM = r".*(mov\.?([alw])\s+@\(0x[a-fA-F0-9]+,pc\).*,(r[0-9]|r1[0-5])+\s+!)\s+([a-fA-F0-9]+).*"
 
 
+# Address, instruction bytes and mnemonic of a line
+# Examples:
+# "   4:	12 30       	cmp/hs	r1,r0"
+# "			4: R_SH_DIR32	_foo"
+SH_LINE_PATTERN = r"((^\s*([0-9a-f]+):\s+)([a-fA-F0-9]+\s[a-fA-F0-9]+)?\s*?)([\w.\/]+)"
+
+# GNU relocations that don't affect how the code is displayed
+SH_IGNORED_RELOCS = {
+    "R_SH_CODE",
+    "R_SH_DATA",
+    "R_SH_LABEL",
+    "R_SH_ALIGN",
+}
+
+
 class AsmProcessorSH2(AsmProcessor):
+    reloc_formats: Dict[str, Optional[str]] = {
+        "R_SH_DIR32": "{}",
+        "R_SH_DIR16": "{}",
+        # bra <label> or bsr <label>, the latter is handled during pre_process
+        "R_SH_IND12W": None,
+        # pc-rel mov.l <label>
+        "R_SH_DIR8WPL": None,
+        # bt <label>
+        "R_SH_DIR8WPN": None,
+        # pc-rel mov.w <label>
+        "R_SH_DIR8WPZ": None,
+        **{reloc_type: None for reloc_type in SH_IGNORED_RELOCS},
+    }
+
+    reads_raw_insn = True
+
     @dataclass
     class ImmEntry:
         value: int
@@ -2264,97 +3617,93 @@ class AsmProcessorSH2(AsmProcessor):
         self._imms: Dict[int, AsmProcessorSH2.ImmEntry] = {}
         self._relocs: Dict[int, str] = {}
 
-    def preprocess_objdump(self, objdump: str) -> str:
-        new_lines = []
-        lines = objdump.splitlines()
-
-        # Collect jtbl, immediates and reloc
-        norm_lines = self._collect_and_normalize(lines)
-
-        # Finally, fix the wrongly decoded data
-        for line in norm_lines:
-            addr_match = re.match(r"^\s*([0-9a-f]+):\s+", line)
-            addr = int(addr_match.group(1), 16) if addr_match else -1
-
-            if addr in self._imms:
-                imm = self._imms[addr]
-                bytes_str = " ".join(imm.content)
-                left = f"{imm.left_side}{bytes_str:<12}"
+    def raw_insn_column(self, data: bytes) -> str:
+        return " ".join(f"{b:02x}" for b in data).ljust(12)
 
-                if imm.value == -1:
-                    value = self._bytelist_to_value(imm.content)
-                else:
-                    value = imm.value
+    def preprocess_objdump_lines(self, objdump: str) -> List[Union[str, "DumpRow"]]:
+        new_lines: List[Union[str, DumpRow]] = []
 
-                if imm.is_long:
-                    right = f"\t.long 0x{value:08x}"
-                else:
-                    right = f"\t.word 0x{value:04x}"
+        # Data pool entries written out so far whose contents may not have been
+        # read yet, as indices into new_lines and addresses. These are filled in
+        # at the next line of code, when the second half of a .long has been
+        # read.
+        pending_imms: List[Tuple[int, int]] = []
 
-                new_lines.append(left + right)
+        # Collect jtbl, immediates and relocs, and fix the wrongly decoded data
+        # as we go
+        for line, addr in self._collect_and_normalize(objdump.splitlines()):
+            if addr == -1:
+                addr_match = re.match(r"^\s*([0-9a-f]+):\s+", line)
+                addr = int(addr_match.group(1), 16) if addr_match else -1
+            else:
+                for index, imm_addr in pending_imms:
+                    new_lines[index] = self._format_imm(self._imms[imm_addr])
+                pending_imms = []
 
-                if addr in self._relocs:
-                    new_lines.append(self._relocs[addr])
-                continue
+            if addr in self._imms:
+                pending_imms.append((len(new_lines), addr))
 
+            new_lines.append(line)
             if addr in self._relocs:
-                new_lines.append(line)
                 new_lines.append(self._relocs[addr])
-                continue
 
-            # Everything else
-            new_lines.append(line)
+        for index, imm_addr in pending_imms:
+            new_lines[index] = self._format_imm(self._imms[imm_addr])
 
-        return "\n".join(new_lines)
+        return new_lines
 
-    # Collects info on jtbls, imm loads and relocs so data mistakenly treated
-    # as an instruction can be fixed, returns a new list of lines that should
-    # make the fixup job a bit easier
-    def _collect_and_normalize(self, lines: List[str]) -> List[str]:
-        ignored_rels = {
-            "R_SH_CODE",
-            "R_SH_DATA",
-            "R_SH_LABEL",
-            "R_SH_ALIGN",
-        }
+    def _format_imm(self, imm: "AsmProcessorSH2.ImmEntry") -> str:
+        bytes_str = " ".join(imm.content)
+        left = f"{imm.left_side}{bytes_str:<12}"
 
-        # Catalog all relocs, done first just because there might relocs without
-        # mov reference, so we can check for these and join them
-        for i, line in enumerate(lines):
-            addr_match = re.match(
-                r"^\s*([0-9a-f]+):\s+([a-fA-F0-9]+\s[a-fA-F0-9]+)?\s*?([\w.\/]+)", line
-            )
-            addr = int(addr_match.group(1), 16) if addr_match else -1
-            mnemonic = addr_match.group(3) if addr_match else ""
+        if imm.value == -1:
+            value = self._bytelist_to_value(imm.content)
+        else:
+            value = imm.value
 
-            # Reloc line, add to dict
-            if "R_SH_" in mnemonic and mnemonic not in ignored_rels:
-                self._relocs[addr] = line
-                continue
+        if imm.is_long:
+            right = f"\t.long 0x{value:08x}"
+        else:
+            right = f"\t.word 0x{value:04x}"
 
-        norm_lines = []
+        return left + right
+
+    def _collect_reloc(self, line: str) -> None:
+        addr_match = re.match(SH_LINE_PATTERN, line)
+        mnemonic = addr_match.group(5) if addr_match else ""
+        if "R_SH_" in mnemonic and mnemonic not in SH_IGNORED_RELOCS:
+            assert addr_match
+            self._relocs[int(addr_match.group(3), 16)] = line
+
+    # Collects info on jtbls, imm loads and relocs so data mistakenly treated
+    # as an instruction can be fixed. Yields normalized lines, which should make
+    # the fixup job a bit easier, along with their addresses (-1 for non-code).
+    #
+    # This reads the dump in a single pass. Relocations are listed right after
+    # the line they apply to, so they are collected by looking ahead past it.
+    def _collect_and_normalize(self, lines: List[str]) -> Iterator[Tuple[str, int]]:
         jtbl_cnt = 0
         curr_jtbl_addr = 0
         jtbl_search: Deque[str] = deque(maxlen=20)
         skip_next = False
+        lookahead = 0
 
-        for line in lines:
-            addr_match = re.match(
-                r"((^\s*([0-9a-f]+):\s+)([a-fA-F0-9]+\s[a-fA-F0-9]+)?\s*?)([\w.\/]+)",
-                line,
-            )
+        for i, line in enumerate(lines):
+            lookahead = max(lookahead, i + 1)
+            while lookahead < len(lines) and "R_SH_" in lines[lookahead]:
+                self._collect_reloc(lines[lookahead])
+                lookahead += 1
 
-            addr = int(addr_match.group(3), 16) if addr_match else -1
-            left_side = addr_match.group(2) if addr_match else ""
-            left_bytes = addr_match.group(1) if addr_match else ""
-            mnemonic = addr_match.group(5) if addr_match else ""
-            inst_bytes = addr_match.group(4) if addr_match else ""
+            addr_match = re.match(SH_LINE_PATTERN, line)
 
             # Non-code line, leave alone
-            if addr == -1:
-                norm_lines.append(line)
+            if not addr_match:
+                yield line, -1
                 continue
 
+            left_bytes, left_side, addr_str, inst_bytes, mnemonic = addr_match.groups()
+            addr = int(addr_str, 16)
+
             # Reloc line, skip (already collected)
             if "R_SH_" in mnemonic:
                 continue
@@ -2373,7 +3722,7 @@ class AsmProcessorSH2(AsmProcessor):
                     else:
                         target = addr + 4  # This should be impossible
                     nline = line.split("\tbsr\t")[0]
-                    norm_lines.append(f"{nline}\tbsr\t{target:x}")
+                    yield f"{nline}\tbsr\t{target:x}", addr
                     continue
 
             # Address reloc has an entry but isn't from a mov reference, add it as one
@@ -2391,13 +3740,13 @@ class AsmProcessorSH2(AsmProcessor):
                         is_long=False,
                     )
 
-            # It's an imm, will be fixed in the next step
+            # It's an imm, will be fixed by the caller
             if addr in self._imms or skip_next:
                 if skip_next:
                     addr -= 2
                     skip_next = False
                 else:
-                    norm_lines.append(line)
+                    yield line, addr
                     self._imms[addr].left_side = left_side
 
                     if self._imms[addr].is_long:
@@ -2420,11 +3769,11 @@ class AsmProcessorSH2(AsmProcessor):
                 item = self._bytelist_to_value(inst_bytes.split())
 
                 entry = left_bytes + f".word 0x{item:04x} ! tgt {base + item:x}"
-                norm_lines.append(entry)
+                yield entry, addr
                 continue
 
             # Check for pc-rel move instructions
-            mov_match = re.search(SH_POOL_PATTERN, line)
+            mov_match = re.search(SH_POOL_PATTERN, line) if "mov" in line else None
 
             if mov_match:
                 # Add to the jtbl search window
@@ -2460,7 +3809,7 @@ class AsmProcessorSH2(AsmProcessor):
                     # Convert to pc-rel notation while we are at it
                     pc_rel = f"@(0x{mov_tgt - addr:x},pc),{mov_reg}"
 
-                norm_lines.append(fix_line + pc_rel + mov_comm)
+                yield fix_line + pc_rel + mov_comm, addr
                 continue
 
             # Check for jumptables, braf is used by SHC and jmp by GCC
@@ -2501,8 +3850,7 @@ class AsmProcessorSH2(AsmProcessor):
 
             # None of the above
             jtbl_search.append(line)
-            norm_lines.append(line)
-        return norm_lines
+            yield line, addr
 
     def _test_jtbl(self, lines: List[str]) -> int:
         adjust = 0
@@ -2538,48 +3886,14 @@ class AsmProcessorSH2(AsmProcessor):
         else:
             return int("".join(str_bytes[::-1]), 16)
 
-    def process_reloc(self, row: str, prev: str) -> Tuple[str, Optional[str]]:
-        repl = row.split()[-1]
-        before, imm, after = parse_relocated_line(prev)
-
-        if "R_SH_DIR32" in row:
-            repl = row.split()[-1] + reloc_addend_from_imm(
-                imm, before, self.config.arch
-            )
-            return f"{before}{repl}{after}", repl
-        elif "R_SH_DIR16" in row:
-            repl = row.split()[-1] + reloc_addend_from_imm(
-                imm, before, self.config.arch
-            )
-            return f"{before}{repl}{after}", repl
-        elif "R_SH_IND12W" in row:
-            # bra <label> or bsr <label>, the latter is handled during pre_process
+    def process_reloc(self, reloc: Relocation, prev: str) -> Tuple[str, Optional[str]]:
+        fmt = self.reloc_format(reloc, prev)
+        if fmt is None:
             return prev, None
-        elif "R_SH_DIR8WPL" in row:
-            # pc-rel mov.l <label>
-            return prev, None
-        elif "R_SH_DIR8WPN" in row:
-            # bt <label>
-            return prev, None
-        elif "R_SH_DIR8WPZ" in row:
-            # pc-rel mov.w <label>
-            return prev, None
-        elif "R_SH_CODE" in row:
-            # This one is a GNU thing, can be ignored
-            return prev, None
-        elif "R_SH_DATA" in row:
-            # This one is a GNU thing, can be ignored
-            return prev, None
-        elif "R_SH_LABEL" in row:
-            # This one is a GNU thing, can be ignored
-            return prev, None
-        elif "R_SH_ALIGN" in row:
-            # This one is a GNU thing, can be ignored
-            return prev, None
-        else:
-            assert False, f"unknown relocation type '{row}' for line '{prev}'"
-
-        return prev, None
+        before, imm, after = parse_relocated_line(prev)
+        addend = reloc_addend_from_imm(imm, before, self.config.arch)
+        repl = fmt.format(reloc.target() + addend)
+        return f"{before}{repl}{after}", repl
 
     def _normalize_arch_specific(self, mnemonic: str, row: str) -> str:
         row = self._normalize_load(row)
@@ -2627,8 +3941,25 @@ class AsmProcessorSH2(AsmProcessor):
 
 
 class AsmProcessorM68k(AsmProcessor):
+    reloc_formats = {
+        "R_68K_NONE": "{}",
+        "R_68K_32": "{}",
+        "R_68K_16": "{}",
+        "R_68K_8": "{}",
+        "R_68K_GOT32O": "@GOT",
+        "R_68K_GOT16O": "{}@GOT",
+        "R_68K_GOT8O": "{}@GOT",
+        "R_68K_GOT32": "{}@GOTPC",
+        "R_68K_GOT16": "{}@GOTPC",
+        "R_68K_GOT8": "{}@GOTPC",
+    }
+
     def pre_process(
-        self, mnemonic: str, args: str, next_row: Optional[str], comment: Optional[str]
+        self,
+        mnemonic: str,
+        args: str,
+        next_reloc: Optional[Relocation],
+        comment: Optional[str],
     ) -> Tuple[str, str]:
         # replace objdump's syntax of pointer accesses with the equivilant in AT&T syntax for readability
         return mnemonic, re.sub(
@@ -2637,8 +3968,7 @@ class AsmProcessorM68k(AsmProcessor):
             args,
         )
 
-    def process_reloc(self, row: str, prev: str) -> Tuple[str, Optional[str]]:
-        repl = row.split()[-1]
+    def process_reloc(self, reloc: Relocation, prev: str) -> Tuple[str, Optional[str]]:
         mnemonic, args = prev.split(maxsplit=1)
 
         addr_imm = re.search(r"(?<![#da])(0x[0-9a-f]+|[0-9]+) ?", args)
@@ -2646,29 +3976,10 @@ class AsmProcessorM68k(AsmProcessor):
             assert False, f"failed to find address immediate for line '{prev}'"
         start, end = addr_imm.span()
 
-        if "R_68K_NONE" in row:
-            pass
-        elif "R_68K_32" in row:
-            pass
-        elif "R_68K_16" in row:
-            pass
-        elif "R_68K_8" in row:
-            pass
-        elif "R_68K_GOT32O" in row:
-            repl = "@GOT"
-        elif "R_68K_GOT16O" in row:
-            repl += "@GOT"
-        elif "R_68K_GOT8O" in row:
-            repl += "@GOT"
-        elif "R_68K_GOT32" in row:
-            repl += "@GOTPC"
-        elif "R_68K_GOT16" in row:
-            repl += "@GOTPC"
-        elif "R_68K_GOT8" in row:
-            repl += "@GOTPC"
-        else:
-            assert False, f"unknown relocation type '{row}' for line '{prev}'"
-
+        fmt = self.reloc_format(reloc, prev)
+        if fmt is None:
+            return prev, None
+        repl = fmt.format(reloc.target())
         return f"{mnemonic}\t{args[:start] + repl + args[end:]}", repl
 
     def is_end_of_function(self, mnemonic: str, args: str) -> bool:
@@ -2693,6 +4004,11 @@ class ArchSettings:
     proc: Type[AsmProcessor] = AsmProcessor
     big_endian: Optional[bool] = True
     delay_slot_instructions: Set[str] = field(default_factory=set)
+    # Whether objdump shows pc-relative operands as absolute addresses, so
+    # that the same encoding can display differently at different addresses.
+    absolute_pc_relative_operands: bool = False
+    # The size of every instruction in bytes, or None if it varies
+    instruction_size: Optional[int] = None
 
 
 MIPS_BRANCH_LIKELY_INSTRUCTIONS = {
@@ -2774,6 +4090,15 @@ AARCH64_BRANCH_INSTRUCTIONS = {
     "tbnz",
 }
 
+# Relocations of branch instructions, which GCC may emit with a .text offset
+PPC_BRANCH_RELOCS = {
+    "R_PPC_REL24",
+    "R_PPC_PLTREL24",
+    "R_PPC_REL14",
+    "R_PPC_REL14_BRTAKEN",
+    "R_PPC_REL14_BRNTAKEN",
+}
+
 PPC_BRANCH_INSTRUCTIONS = {
     "b",
     "beq",
@@ -2919,232 +4244,281 @@ M68K_BRANCH_INSTRUCTIONS = {
 )
 
 
-MIPS_SETTINGS = ArchSettings(
-    name="mips",
-    re_int=re.compile(r"[0-9]+"),
-    re_comment=re.compile(r"<.*>"),
-    # Includes:
-    #   - General purpose registers v0..1, a0..7, t0..9, s0..8, zero, at, fp, k0..1/kt0..1
-    #   - Float registers f0..31, or fv0..1, fa0..7, ft0..15, fs0..8 plus odd complements
-    # (actually used number depends on ABI)
-    # sp, gp should not be in this list
-    re_reg=re.compile(r"\$?\b([astv][0-9]|at|f[astv]?[0-9]+f?|kt?[01]|fp|ra|zero)\b"),
-    re_sprel=re.compile(r"(?<=,)([0-9]+|0x[0-9a-f]+)\(sp\)"),
-    re_large_imm=re.compile(r"-?[1-9][0-9]{2,}|-?0x[0-9a-f]{3,}"),
-    re_imm=re.compile(
-        r"(\b|-)([0-9]+|0x[0-9a-fA-F]+)\b(?!\(sp)|%(lo|hi|got|gp_rel|call16)\([^)]*\)"
-    ),
-    re_reloc=re.compile(r"R_MIPS_"),
-    arch_flags=["-m", "mips:4300"],
-    branch_likely_instructions=MIPS_BRANCH_LIKELY_INSTRUCTIONS,
-    branch_instructions=MIPS_BRANCH_INSTRUCTIONS,
-    instructions_with_address_immediates=MIPS_BRANCH_INSTRUCTIONS.union(
-        {"j", "jal", "bal"}
-    ),
-    delay_slot_instructions=MIPS_BRANCH_INSTRUCTIONS.union(
-        {"j", "jal", "jr", "jalr", "bal"}
-    ),
-    proc=AsmProcessorMIPS,
-)
+def mips_settings() -> ArchSettings:
+    return ArchSettings(
+        name="mips",
+        re_int=re.compile(r"[0-9]+"),
+        re_comment=re.compile(r"<.*>"),
+        # Includes:
+        #   - General purpose registers v0..1, a0..7, t0..9, s0..8, zero, at, fp, k0..1/kt0..1
+        #   - Float registers f0..31, or fv0..1, fa0..7, ft0..15, fs0..8 plus odd complements
+        # (actually used number depends on ABI)
+        # sp, gp should not be in this list
+        re_reg=re.compile(
+            r"\$?\b([astv][0-9]|at|f[astv]?[0-9]+f?|kt?[01]|fp|ra|zero)\b"
+        ),
+        re_sprel=re.compile(r"(?<=,)([0-9]+|0x[0-9a-f]+)\(sp\)"),
+        re_large_imm=re.compile(r"-?[1-9][0-9]{2,}|-?0x[0-9a-f]{3,}"),
+        re_imm=re.compile(
+            r"(\b|-)([0-9]+|0x[0-9a-fA-F]+)\b(?!\(sp)|%(lo|hi|got|gp_rel|call16)\([^)]*\)"
+        ),
+        re_reloc=re.compile(r"R_MIPS_"),
+        arch_flags=["-m", "mips:4300"],
+        branch_likely_instructions=MIPS_BRANCH_LIKELY_INSTRUCTIONS,
+        branch_instructions=MIPS_BRANCH_INSTRUCTIONS,
+        instructions_with_address_immediates=MIPS_BRANCH_INSTRUCTIONS.union(
+            {"j", "jal", "bal"}
+        ),
+        delay_slot_instructions=MIPS_BRANCH_INSTRUCTIONS.union(
+            {"j", "jal", "jr", "jalr", "bal"}
+        ),
+        proc=AsmProcessorMIPS,
+        instruction_size=4,
+    )
 
-MIPSEL_SETTINGS = replace(
-    MIPS_SETTINGS, name="mipsel", big_endian=False, arch_flags=["-m", "mips:3000"]
-)
 
-MIPSEE_SETTINGS = replace(
-    MIPSEL_SETTINGS, name="mipsee", arch_flags=["-m", "mips:5900"]
-)
+MIPS_ARCH_NAMES = {"mips", "mipsel", "mipsee", "mipsel:4000"}
 
-MIPSEL_4000_SETTINGS = replace(
-    MIPSEL_SETTINGS, name="mipsel:4000", arch_flags=["-m", "mips:gs464"]
-)
 
-MIPS_ARCH_NAMES = {"mips", "mipsel", "mipsee", "mipsel:4000"}
+def arm32_settings() -> ArchSettings:
+    return ArchSettings(
+        name="arm32",
+        re_int=re.compile(r"[0-9]+"),
+        re_comment=re.compile(r"(<.*>|//.*$)"),
+        # Includes:
+        #   - General purpose registers: r0..13
+        #   - Frame pointer registers: lr (r14), pc (r15)
+        #   - VFP/NEON registers: s0..31, d0..31, q0..15, fpscr, fpexc, fpsid
+        # SP should not be in this list.
+        re_reg=re.compile(
+            r"\$?\b([rq][0-9]|[rq]1[0-5]|pc|lr|[ds][12]?[0-9]|[ds]3[01]|fp(scr|exc|sid))\b"
+        ),
+        re_sprel=re.compile(r"sp, #-?(0x[0-9a-fA-F]+|[0-9]+)\b"),
+        re_large_imm=re.compile(r"-?[1-9][0-9]{2,}|-?0x[0-9a-f]{3,}"),
+        re_imm=re.compile(r"(?<!sp, )#-?(0x[0-9a-fA-F]+|[0-9]+)\b"),
+        re_reloc=re.compile(r"R_ARM_"),
+        branch_instructions=ARM32_BRANCH_INSTRUCTIONS,
+        instructions_with_address_immediates=ARM32_BRANCH_INSTRUCTIONS.union({"adr"}),
+        proc=AsmProcessorARM32,
+    )
 
-ARM32_SETTINGS = ArchSettings(
-    name="arm32",
-    re_int=re.compile(r"[0-9]+"),
-    re_comment=re.compile(r"(<.*>|//.*$)"),
-    # Includes:
-    #   - General purpose registers: r0..13
-    #   - Frame pointer registers: lr (r14), pc (r15)
-    #   - VFP/NEON registers: s0..31, d0..31, q0..15, fpscr, fpexc, fpsid
-    # SP should not be in this list.
-    re_reg=re.compile(
-        r"\$?\b([rq][0-9]|[rq]1[0-5]|pc|lr|[ds][12]?[0-9]|[ds]3[01]|fp(scr|exc|sid))\b"
-    ),
-    re_sprel=re.compile(r"sp, #-?(0x[0-9a-fA-F]+|[0-9]+)\b"),
-    re_large_imm=re.compile(r"-?[1-9][0-9]{2,}|-?0x[0-9a-f]{3,}"),
-    re_imm=re.compile(r"(?<!sp, )#-?(0x[0-9a-fA-F]+|[0-9]+)\b"),
-    re_reloc=re.compile(r"R_ARM_"),
-    branch_instructions=ARM32_BRANCH_INSTRUCTIONS,
-    instructions_with_address_immediates=ARM32_BRANCH_INSTRUCTIONS.union({"adr"}),
-    proc=AsmProcessorARM32,
-)
 
-ARMEL_SETTINGS = replace(ARM32_SETTINGS, name="armel", big_endian=False)
-
-AARCH64_SETTINGS = ArchSettings(
-    name="aarch64",
-    re_int=re.compile(r"[0-9]+"),
-    re_comment=re.compile(r"(<.*>|//.*$)"),
-    # GPRs and FP registers: X0-X30, W0-W30, [BHSDVQ]0..31
-    # (FP registers may be followed by data width and number of elements, e.g. V0.4S)
-    # The zero registers and SP should not be in this list.
-    re_reg=re.compile(
-        r"\$?\b([bhsdvq]([12]?[0-9]|3[01])(\.\d\d?[bhsdvq])?|[xw][12]?[0-9]|[xw]30)\b"
-    ),
-    re_sprel=re.compile(r"sp, #-?(0x[0-9a-fA-F]+|[0-9]+)\b"),
-    re_large_imm=re.compile(r"-?[1-9][0-9]{2,}|-?0x[0-9a-f]{3,}"),
-    re_imm=re.compile(r"(?<!sp, )#-?(0x[0-9a-fA-F]+|[0-9]+)\b"),
-    re_reloc=re.compile(r"R_AARCH64_"),
-    arch_flags=["--no-show-raw-insn"],
-    branch_instructions=AARCH64_BRANCH_INSTRUCTIONS,
-    instructions_with_address_immediates=AARCH64_BRANCH_INSTRUCTIONS.union(
-        {"bl", "adrp"}
-    ),
-    proc=AsmProcessorAArch64,
-)
+def aarch64_settings() -> ArchSettings:
+    return ArchSettings(
+        name="aarch64",
+        re_int=re.compile(r"[0-9]+"),
+        re_comment=re.compile(r"(<.*>|//.*$)"),
+        # GPRs and FP registers: X0-X30, W0-W30, [BHSDVQ]0..31
+        # (FP registers may be followed by data width and number of elements, e.g. V0.4S)
+        # The zero registers and SP should not be in this list.
+        re_reg=re.compile(
+            r"\$?\b([bhsdvq]([12]?[0-9]|3[01])(\.\d\d?[bhsdvq])?|[xw][12]?[0-9]|[xw]30)\b"
+        ),
+        re_sprel=re.compile(r"sp, #-?(0x[0-9a-fA-F]+|[0-9]+)\b"),
+        re_large_imm=re.compile(r"-?[1-9][0-9]{2,}|-?0x[0-9a-f]{3,}"),
+        re_imm=re.compile(r"(?<!sp, )#-?(0x[0-9a-fA-F]+|[0-9]+)\b"),
+        re_reloc=re.compile(r"R_AARCH64_"),
+        arch_flags=["--no-show-raw-insn"],
+        branch_instructions=AARCH64_BRANCH_INSTRUCTIONS,
+        instructions_with_address_immediates=AARCH64_BRANCH_INSTRUCTIONS.union(
+            {"bl", "adrp"}
+        ),
+        proc=AsmProcessorAArch64,
+        instruction_size=4,
+    )
 
-PPC_SETTINGS = ArchSettings(
-    name="ppc",
-    re_int=re.compile(r"[0-9]+"),
-    re_comment=re.compile(r"(<.*>|//.*$)"),
-    # r1 not included
-    re_reg=re.compile(r"\$?\b([rf](?:[02-9]|[1-9][0-9]+)|f1)\b"),
-    re_sprel=re.compile(r"(?<=,)(-?[0-9]+|-?0x[0-9a-f]+)\(r1\)"),
-    re_large_imm=re.compile(r"-?[1-9][0-9]{2,}|-?0x[0-9a-f]{3,}"),
-    re_imm=re.compile(
-        r"(\b|-)([0-9]+|0x[0-9a-fA-F]+)\b(?!\(r1\))|[^ \t,]+@(l|ha|h|sda21)"
-    ),
-    re_reloc=re.compile(r"R_PPC_"),
-    arch_flags=["-m", "powerpc", "-M", "broadway"],
-    branch_instructions=PPC_BRANCH_INSTRUCTIONS,
-    instructions_with_address_immediates=PPC_BRANCH_INSTRUCTIONS.union({"bl"}),
-    proc=AsmProcessorPPC,
-)
 
-X86_SETTINGS = ArchSettings(
-    name="x86",
-    re_int=re.compile(r"[0-9]+"),
-    re_comment=re.compile(r"<.*>"),
-    # Includes:
-    #   - (e)a-d(x,l,h)
-    #   - (e)s,d,b(i,p)(l)
-    #   - cr0-7
-    #   - x87 st
-    #   - MMX, SSE vector registers
-    #   - cursed registers: eal ebl ebh edl edh...
-    re_reg=re.compile(
-        r"\%?\b(e?(?:(?:[sd]i|[sb]p)l?|[abcd][xhl])|[cdesfg]s|cr[0-7]|x?mm[0-7]|st)\b"
-    ),
-    re_large_imm=re.compile(r"-?[1-9][0-9]{2,}|-?0x[0-9a-f]{3,}"),
-    re_sprel=re.compile(r"(-?0x[0-9a-f]+|-?[0-9]+)(?=\((%ebp|%esi)\))"),
-    re_imm=re.compile(
-        r"(?:\b|-)(0x[0-9a-f]+|[0-9]+)|([\?$_][^ \t,]+)|(%(plt|got)\([^)]*\))"
-    ),
-    re_reloc=re.compile(
-        r"R_386_|dir32|DISP32|WRTSEG|OFF32|OFFPC32|OFF16|OFFPC16|SEG|FAR16"
-    ),
-    # The x86 architecture has a variable instruction length. The raw bytes of
-    # an instruction as displayed by objdump can line wrap if it's long enough.
-    # This destroys the objdump output processor logic, so we avoid this.
-    arch_flags=["--no-show-raw-insn"],
-    branch_instructions=X86_BRANCH_INSTRUCTIONS,
-    instructions_with_address_immediates=X86_BRANCH_INSTRUCTIONS.union({"mov", "call"}),
-    proc=AsmProcessorX86,
-)
+def ppc_settings() -> ArchSettings:
+    return ArchSettings(
+        name="ppc",
+        re_int=re.compile(r"[0-9]+"),
+        re_comment=re.compile(r"(<.*>|//.*$)"),
+        # r1 not included
+        re_reg=re.compile(r"\$?\b([rf](?:[02-9]|[1-9][0-9]+)|f1)\b"),
+        re_sprel=re.compile(r"(?<=,)(-?[0-9]+|-?0x[0-9a-f]+)\(r1\)"),
+        re_large_imm=re.compile(r"-?[1-9][0-9]{2,}|-?0x[0-9a-f]{3,}"),
+        re_imm=re.compile(
+            r"(\b|-)([0-9]+|0x[0-9a-fA-F]+)\b(?!\(r1\))|[^ \t,]+@(l|ha|h|sda21)"
+        ),
+        re_reloc=re.compile(r"R_PPC_"),
+        arch_flags=["-m", "powerpc", "-M", "broadway"],
+        branch_instructions=PPC_BRANCH_INSTRUCTIONS,
+        instructions_with_address_immediates=PPC_BRANCH_INSTRUCTIONS.union({"bl"}),
+        proc=AsmProcessorPPC,
+        instruction_size=4,
+    )
 
-I686_SETTINGS = replace(
-    X86_SETTINGS, name="i686", arch_flags=["-m", "i386", "--no-show-raw-insn"]
-)
 
-SH2_SETTINGS = ArchSettings(
-    name="sh2",
-    # match -128-127 or 0-255 preceded by a '#' with a ',' after (8 bit immediates)
-    re_int=re.compile(
-        r"(?<=#)(-?(?:12[0-8]|1[01][0-9]|[1-9][0-9]?|0)|(?:25[0-5]|2[0-4][0-9]|1[3-9][0-9]|12[8-9]))(?=,)"
+def x86_settings() -> ArchSettings:
+    return ArchSettings(
+        name="x86",
+        re_int=re.compile(r"[0-9]+"),
+        re_comment=re.compile(r"<.*>"),
+        # Includes:
+        #   - (e)a-d(x,l,h)
+        #   - (e)s,d,b(i,p)(l)
+        #   - cr0-7
+        #   - x87 st
+        #   - MMX, SSE vector registers
+        #   - cursed registers: eal ebl ebh edl edh...
+        re_reg=re.compile(
+            r"\%?\b(e?(?:(?:[sd]i|[sb]p)l?|[abcd][xhl])|[cdesfg]s|cr[0-7]|x?mm[0-7]|st)\b"
+        ),
+        re_large_imm=re.compile(r"-?[1-9][0-9]{2,}|-?0x[0-9a-f]{3,}"),
+        re_sprel=re.compile(r"(-?0x[0-9a-f]+|-?[0-9]+)(?=\((%ebp|%esi)\))"),
+        re_imm=re.compile(
+            r"(?:\b|-)(0x[0-9a-f]+|[0-9]+)|([\?$_][^ \t,]+)|(%(plt|got)\([^)]*\))"
+        ),
+        re_reloc=re.compile(
+            r"R_386_|dir32|DISP32|WRTSEG|OFF32|OFFPC32|OFF16|OFFPC16|SEG|FAR16"
+        ),
+        # The x86 architecture has a variable instruction length. The raw bytes of
+        # an instruction as displayed by objdump can line wrap if it's long enough.
+        # This destroys the objdump output processor logic, so we avoid this.
+        arch_flags=["--no-show-raw-insn"],
+        branch_instructions=X86_BRANCH_INSTRUCTIONS,
+        instructions_with_address_immediates=X86_BRANCH_INSTRUCTIONS.union(
+            {"mov", "call"}
+        ),
+        proc=AsmProcessorX86,
+    )
+
+
+def sh2_settings() -> ArchSettings:
+    return ArchSettings(
+        name="sh2",
+        # match -128-127 or 0-255 preceded by a '#' with a ',' after (8 bit immediates)
+        re_int=re.compile(
+            r"(?<=#)(-?(?:12[0-8]|1[01][0-9]|[1-9][0-9]?|0)|(?:25[0-5]|2[0-4][0-9]|1[3-9][0-9]|12[8-9]))(?=,)"
+        ),
+        # match <text>, match ! and after
+        re_comment=re.compile(r"<.*?>|!.*"),
+        #   - r0-r15 general purpose registers, r15 is stack pointer during exceptions
+        #   - sr, gbr, vbr - control registers
+        #   - mach, macl, pr, pc - system registers
+        re_reg=re.compile(r"r1[0-5]|r[0-9]"),
+        # sh2 has pc-relative and gbr-relative but not stack-pointer-relative
+        re_sprel=re.compile(r"(?<=,)([0-9]+|0x[0-9a-f]+)\(sp\)"),
+        # max immediate size is 8-bit
+        re_large_imm=re.compile(r"-?[1-9][0-9]{2,}|-?0x[0-9a-f]{3,}"),
+        re_imm=re.compile(r"\b0[xX][0-9a-fA-F]+\b"),
+        # https://github.com/bminor/binutils-gdb/blob/master/bfd/elf32-sh-relocs.h#L21
+        re_reloc=re.compile(r"R_SH_"),
+        arch_flags=["-m", "sh2"],
+        branch_instructions=SH2_BRANCH_INSTRUCTIONS,
+        instructions_with_address_immediates=SH2_BRANCH_INSTRUCTIONS.union(
+            {"bf", "bf.s", "bt", "bt.s", "bra", "bsr"}
+        ),
+        delay_slot_instructions=SH2_BRANCH_INSTRUCTIONS.union(
+            {"bf.s", "bt.s", "bra", "braf", "bsr", "bsrf", "jmp", "jsr", "rts"}
+        ),
+        proc=AsmProcessorSH2,
+        instruction_size=2,
+    )
+
+
+def sh4_settings() -> ArchSettings:
+    return replace(
+        get_arch("sh2"),
+        name="sh4",
+        #   - fr0-fr15, dr0-dr14, xd0-xd14, fv0-fv12 FP registers
+        #     dr/xd registers can only be even-numbered, and fv registers can only be a multiple of 4
+        re_reg=re.compile(
+            r"r1[0-5]|r[0-9]|fr1[0-5]|fr[0-9]|dr[02468]|dr1[024]|(?<!0)xd[02468]|(?<!0)xd1[024]|fv[048]|fv12"
+        ),
+        arch_flags=["-m", "sh4"],
+    )
+
+
+def m68k_settings() -> ArchSettings:
+    return ArchSettings(
+        name="m68k",
+        re_int=re.compile(r"[0-9]+"),
+        # '|' is used by assemblers, but is not used by objdump
+        re_comment=re.compile(r"<.*>"),
+        # Includes:
+        # - d0-d7 data registers
+        # - a0-a6 address registers
+        # - fp0-fp7 floating-point registers
+        # - usp (user sp)
+        # - fp, sr, ccr
+        # - fpcr, fpsr, fpiar
+        re_reg=re.compile(
+            r"%\b(d[0-7]|a[0-6]|usp|fp([0-7]|cr|sr|iar)?|sr|ccr)(:[wl])?\b"
+        ),
+        # This matches all stack accesses that do not use an index register
+        re_sprel=re.compile(r"-?(0x[0-9a-f]+|[0-9]+)(?=\((%sp|%a7)\))"),
+        re_imm=re.compile(r"#?-?\b(0x[0-9a-f]+|[0-9]+)(?!\()"),
+        re_large_imm=re.compile(r"#?-?([1-9][0-9]{2,}|0x[0-9a-f]{3,})"),
+        re_reloc=re.compile(r"R_68K_"),
+        arch_flags=["-m", "m68k"],
+        branch_instructions=M68K_BRANCH_INSTRUCTIONS,
+        # Pretty much every instruction can take an address immediate
+        instructions_with_address_immediates=M68K_BRANCH_INSTRUCTIONS.union(
+            "jmp", "jsr"
+        ),
+        absolute_pc_relative_operands=True,
+        proc=AsmProcessorM68k,
+    )
+
+
+# How to build the settings of each architecture. They are only built when
+# first used (see get_arch), since compiling all their regexes at import would
+# slow down startup.
+ARCH_FACTORIES: Dict[str, Callable[[], ArchSettings]] = {
+    "mips": mips_settings,
+    "mipsel": lambda: replace(
+        get_arch("mips"),
+        name="mipsel",
+        big_endian=False,
+        arch_flags=["-m", "mips:3000"],
     ),
-    # match <text>, match ! and after
-    re_comment=re.compile(r"<.*?>|!.*"),
-    #   - r0-r15 general purpose registers, r15 is stack pointer during exceptions
-    #   - sr, gbr, vbr - control registers
-    #   - mach, macl, pr, pc - system registers
-    re_reg=re.compile(r"r1[0-5]|r[0-9]"),
-    # sh2 has pc-relative and gbr-relative but not stack-pointer-relative
-    re_sprel=re.compile(r"(?<=,)([0-9]+|0x[0-9a-f]+)\(sp\)"),
-    # max immediate size is 8-bit
-    re_large_imm=re.compile(r"-?[1-9][0-9]{2,}|-?0x[0-9a-f]{3,}"),
-    re_imm=re.compile(r"\b0[xX][0-9a-fA-F]+\b"),
-    # https://github.com/bminor/binutils-gdb/blob/master/bfd/elf32-sh-relocs.h#L21
-    re_reloc=re.compile(r"R_SH_"),
-    arch_flags=["-m", "sh2"],
-    branch_instructions=SH2_BRANCH_INSTRUCTIONS,
-    instructions_with_address_immediates=SH2_BRANCH_INSTRUCTIONS.union(
-        {"bf", "bf.s", "bt", "bt.s", "bra", "bsr"}
+    "mipsee": lambda: replace(
+        get_arch("mipsel"), name="mipsee", arch_flags=["-m", "mips:5900"]
     ),
-    delay_slot_instructions=SH2_BRANCH_INSTRUCTIONS.union(
-        {"bf.s", "bt.s", "bra", "braf", "bsr", "bsrf", "jmp", "jsr", "rts"}
+    "mipsel:4000": lambda: replace(
+        get_arch("mipsel"), name="mipsel:4000", arch_flags=["-m", "mips:gs464"]
     ),
-    proc=AsmProcessorSH2,
-)
-
-SH2EL_SETTINGS = replace(SH2_SETTINGS, name="sh2el", big_endian=False)
-
-SH4_SETTINGS = replace(
-    SH2_SETTINGS,
-    name="sh4",
-    #   - fr0-fr15, dr0-dr14, xd0-xd14, fv0-fv12 FP registers
-    #     dr/xd registers can only be even-numbered, and fv registers can only be a multiple of 4
-    re_reg=re.compile(
-        r"r1[0-5]|r[0-9]|fr1[0-5]|fr[0-9]|dr[02468]|dr1[024]|(?<!0)xd[02468]|(?<!0)xd1[024]|fv[048]|fv12"
+    "arm32": arm32_settings,
+    "armel": lambda: replace(get_arch("arm32"), name="armel", big_endian=False),
+    "aarch64": aarch64_settings,
+    "ppc": ppc_settings,
+    "x86": x86_settings,
+    "i686": lambda: replace(
+        get_arch("x86"), name="i686", arch_flags=["-m", "i386", "--no-show-raw-insn"]
     ),
-    arch_flags=["-m", "sh4"],
-)
+    "sh2": sh2_settings,
+    "sh4": sh4_settings,
+    "sh4el": lambda: replace(get_arch("sh4"), name="sh4el", big_endian=False),
+    "m68k": m68k_settings,
+}
 
-SH4EL_SETTINGS = replace(SH4_SETTINGS, name="sh4el", big_endian=False)
-
-M68K_SETTINGS = ArchSettings(
-    name="m68k",
-    re_int=re.compile(r"[0-9]+"),
-    # '|' is used by assemblers, but is not used by objdump
-    re_comment=re.compile(r"<.*>"),
-    # Includes:
-    # - d0-d7 data registers
-    # - a0-a6 address registers
-    # - fp0-fp7 floating-point registers
-    # - usp (user sp)
-    # - fp, sr, ccr
-    # - fpcr, fpsr, fpiar
-    re_reg=re.compile(r"%\b(d[0-7]|a[0-6]|usp|fp([0-7]|cr|sr|iar)?|sr|ccr)(:[wl])?\b"),
-    # This matches all stack accesses that do not use an index register
-    re_sprel=re.compile(r"-?(0x[0-9a-f]+|[0-9]+)(?=\((%sp|%a7)\))"),
-    re_imm=re.compile(r"#?-?\b(0x[0-9a-f]+|[0-9]+)(?!\()"),
-    re_large_imm=re.compile(r"#?-?([1-9][0-9]{2,}|0x[0-9a-f]{3,})"),
-    re_reloc=re.compile(r"R_68K_"),
-    arch_flags=["-m", "m68k"],
-    branch_instructions=M68K_BRANCH_INSTRUCTIONS,
-    # Pretty much every instruction can take an address immediate
-    instructions_with_address_immediates=M68K_BRANCH_INSTRUCTIONS.union("jmp", "jsr"),
-    proc=AsmProcessorM68k,
-)
+# Module attributes that used to hold the settings, for compatibility
+LEGACY_ARCH_SETTINGS: Dict[str, Callable[[], ArchSettings]] = {
+    "MIPS_SETTINGS": lambda: get_arch("mips"),
+    "MIPSEL_SETTINGS": lambda: get_arch("mipsel"),
+    "MIPSEE_SETTINGS": lambda: get_arch("mipsee"),
+    "MIPSEL_4000_SETTINGS": lambda: get_arch("mipsel:4000"),
+    "ARM32_SETTINGS": lambda: get_arch("arm32"),
+    "ARMEL_SETTINGS": lambda: get_arch("armel"),
+    "AARCH64_SETTINGS": lambda: get_arch("aarch64"),
+    "PPC_SETTINGS": lambda: get_arch("ppc"),
+    "X86_SETTINGS": lambda: get_arch("x86"),
+    "I686_SETTINGS": lambda: get_arch("i686"),
+    "SH2_SETTINGS": lambda: get_arch("sh2"),
+    "SH2EL_SETTINGS": lambda: replace(get_arch("sh2"), name="sh2el", big_endian=False),
+    "SH4_SETTINGS": lambda: get_arch("sh4"),
+    "SH4EL_SETTINGS": lambda: get_arch("sh4el"),
+    "M68K_SETTINGS": lambda: get_arch("m68k"),
+}
 
-ARCH_SETTINGS = [
-    MIPS_SETTINGS,
-    MIPSEL_SETTINGS,
-    MIPSEE_SETTINGS,
-    MIPSEL_4000_SETTINGS,
-    ARM32_SETTINGS,
-    ARMEL_SETTINGS,
-    AARCH64_SETTINGS,
-    PPC_SETTINGS,
-    X86_SETTINGS,
-    I686_SETTINGS,
-    SH2_SETTINGS,
-    SH4_SETTINGS,
-    SH4EL_SETTINGS,
-    M68K_SETTINGS,
-]
+
+def __getattr__(name: str) -> Any:
+    if name == "ARCH_SETTINGS":
+        return [get_arch(arch_str) for arch_str in ARCH_FACTORIES]
+    if name in LEGACY_ARCH_SETTINGS:
+        return LEGACY_ARCH_SETTINGS[name]()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def hexify_int(row: str, pat: Match[str], arch: ArchSettings) -> str:
@@ -3216,6 +4590,185 @@ def pad_mnemonic(line: str) -> str:
     return f"{mn:<7s} {args}"
 
 
+@dataclass
+class DumpRow:
+    """
+    A line of a dump, as parsed by `parse_dump`: a function label, a line of
+    source code or other text between instructions, or an instruction along
+    with the relocations listed after it.
+    """
+
+    text: str
+    # Function name, for function labels
+    label: Optional[str] = None
+    # For "path/file.c:123" lines
+    source_filename: Optional[str] = None
+    source_line_num: Optional[int] = None
+    # Instructions have an address, and the fields after it
+    addr: Optional[int] = None
+    raw_bytes: str = ""
+    mnemonic: str = ""
+    args: str = ""
+    comment: Optional[str] = None
+    relocs: List[Relocation] = field(default_factory=list)
+
+
+@dataclass
+class AsmDump:
+    """
+    A dump parsed into rows, along with references to each instruction from
+    other sections, by address. `text` is the dump in the format of
+    --write-asm, which is kept around for writing it out; dumps compare equal
+    if their text does.
+    """
+
+    text: str
+    rows: List[DumpRow] = field(compare=False, repr=False)
+    data_refs: Dict[int, Dict[str, List[int]]] = field(compare=False, repr=False)
+
+    def __str__(self) -> str:
+        return self.text
+
+
+RAW_INSN_COLUMN_PATTERN = re.compile(r"(?:[0-9a-f]{2})+(?: (?:[0-9a-f]{2})+)* *")
+
+
+def has_raw_insn_column(tabs: List[str]) -> bool:
+    """Whether an instruction line, split at tabs, has objdump's raw bytes
+    column of whole bytes. Lines without it can come from --lean-dump when the
+    size of an instruction is unknown."""
+    return len(tabs) > 1 and RAW_INSN_COLUMN_PATTERN.fullmatch(tabs[1]) is not None
+
+
+def parse_dump(
+    dump: str,
+    config: Config,
+    rodata_refs: Sequence[Tuple[int, int, str]] = (),
+    code: Optional[InstructionBytes] = None,
+) -> AsmDump:
+    """
+    Parse a dump in the format of --write-asm, i.e. preprocessed objdump output
+    with references from other sections prepended as "DATAREF" lines. Such
+    references can also be passed separately, as from
+    `parse_elf_rodata_references`. For dumps without a raw bytes column, the
+    bytes of instructions are read from `code` if given.
+    """
+    return parse_dump_lines(dump.split("\n"), config, rodata_refs, code)
+
+
+def parse_relocs(
+    lines: Sequence[Union[str, DumpRow]], i: int, arch: ArchSettings
+) -> Tuple[List[Relocation], int]:
+    """The relocations listed from lines[i] on, and the index after them."""
+    relocs = []
+    while i < len(lines):
+        line = lines[i]
+        if not isinstance(line, str) or not arch.re_reloc.search(line):
+            break
+        relocs.append(parse_reloc(line))
+        i += 1
+    return relocs, i
+
+
+def parse_dump_lines(
+    lines: Sequence[Union[str, DumpRow]],
+    config: Config,
+    rodata_refs: Sequence[Tuple[int, int, str]] = (),
+    code: Optional[InstructionBytes] = None,
+) -> AsmDump:
+    """Like parse_dump, for a dump split into lines, some of which may be rows
+    already (from AsmProcessor.preprocess_objdump_lines)."""
+    arch = config.arch
+    raw_insn = dump_has_raw_insn(config)
+    data_refs: Dict[int, Dict[str, List[int]]] = {}
+    for text_offset, from_offset, from_section in rodata_refs:
+        data_refs.setdefault(text_offset, {}).setdefault(from_section, []).append(
+            from_offset
+        )
+
+    rows: List[DumpRow] = []
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        i += 1
+
+        if not isinstance(line, str):
+            relocs, i = parse_relocs(lines, i, arch)
+            line.relocs.extend(relocs)
+            rows.append(line)
+            continue
+
+        if not line:
+            continue
+
+        # Check if the currrent line has "OFFSET <SYMBOL>:"
+        if line.endswith(">:"):
+            function_label_match = re.match(r"^[0-9a-f]+ <(.*)>:$", line)
+            if function_label_match:
+                rows.append(DumpRow(text=line, label=function_label_match.group(1)))
+                continue
+
+        if line.startswith("DATAREF"):
+            parts = line.split(" ", 3)
+            text_offset = int(parts[1])
+            from_offset = int(parts[2])
+            from_section = parts[3]
+            data_refs.setdefault(text_offset, {}).setdefault(from_section, []).append(
+                from_offset
+            )
+            continue
+
+        if not re.match(r"^\s+[0-9a-f]+:\s+", line):
+            row = DumpRow(text=line)
+            # This regex is conservative, and assumes the file path does not contain "weird"
+            # characters like tabs or angle brackets.
+            if re.match(r"^[^ \t<>][^\t<>]*:[0-9]+( \(discriminator [0-9]+\))?$", line):
+                row.source_filename, _, tail = line.rpartition(":")
+                row.source_line_num = int(tail.partition(" ")[0])
+            rows.append(row)
+            continue
+
+        m_comment = arch.re_comment.search(line)
+        asm = arch.re_comment.sub("", line) if m_comment else line
+        addr = int(asm.split(":")[0].strip(), 16)
+        tabs = asm.rstrip().split("\t")
+        raw_bytes = ""
+        if raw_insn and has_raw_insn_column(tabs):
+            raw_bytes = tabs[1].strip()
+            asm = "\t".join(tabs[2:])
+        else:
+            asm = "\t".join(tabs[1:])
+
+        if "\t" in asm:
+            asm_parts = asm.split("\t", 1)
+        else:
+            # powerpc-eabi-objdump doesn't use tabs
+            asm_parts = [part.lstrip() for part in asm.split(" ", 1)]
+
+        relocs, i = parse_relocs(lines, i, arch)
+        rows.append(
+            DumpRow(
+                text=line,
+                addr=addr,
+                raw_bytes=raw_bytes,
+                mnemonic=asm_parts[0].strip(),
+                args=asm_parts[1].strip() if len(asm_parts) >= 2 else "",
+                comment=m_comment[0] if m_comment else None,
+                relocs=relocs,
+            )
+        )
+
+    if code is not None and not raw_insn:
+        insn_rows = [row for row in rows if row.addr is not None]
+        addrs = [row.addr for row in insn_rows if row.addr is not None]
+        for row, addr, size in zip(insn_rows, addrs, instruction_sizes(addrs, arch)):
+            if size is not None:
+                row.raw_bytes = code.read(addr, size).hex()
+
+    text = "\n".join(line if isinstance(line, str) else line.text for line in lines)
+    return AsmDump(serialize_rodata_references(rodata_refs) + text, rows, data_refs)
+
+
 @dataclass
 class Line:
     mnemonic: str
@@ -3232,11 +4785,40 @@ class Line:
     source_line_num: Optional[int] = None
     source_lines: List[str] = field(default_factory=list)
     comment: Optional[str] = None
+    raw_bytes: str = ""
+    relocs: Tuple[Relocation, ...] = ()
+
+
+def same_encoding(line1: Line, line2: Line, arch: ArchSettings) -> bool:
+    """Whether two lines are the same encoded instruction with the same
+    relocations, even if objdump printed them differently (e.g. dumps made by
+    different binutils versions). Branches and pool loads are excluded, since
+    what they mean depends on what they point to."""
+    if (
+        not line1.raw_bytes
+        or line1.raw_bytes != line2.raw_bytes
+        or line1.relocs != line2.relocs
+        or line1.branch_target is not None
+        or line2.branch_target is not None
+        or line1.data_pool_addr is not None
+        or line2.data_pool_addr is not None
+    ):
+        return False
+    if (
+        arch.absolute_pc_relative_operands
+        or line1.mnemonic in arch.instructions_with_address_immediates
+        or line2.mnemonic in arch.instructions_with_address_immediates
+    ):
+        return line1.line_num == line2.line_num
+    return True
 
 
-def process(dump: str, config: Config) -> List[Line]:
+@timed("process")
+def process(dump: Union[str, AsmDump], config: Config) -> List[Line]:
     arch = config.arch
     processor = arch.proc(config)
+    if isinstance(dump, str):
+        dump = parse_dump(dump, config)
     source_lines = []
     source_filename = None
     source_line_num = None
@@ -3244,24 +4826,15 @@ def process(dump: str, config: Config) -> List[Line]:
     prev_line_num = 0
     rets_remaining = config.stop_at_ret
 
-    i = 0
     num_instr = 0
-    data_refs: Dict[int, Dict[str, List[int]]] = defaultdict(lambda: defaultdict(list))
+    data_refs = dump.data_refs
     output: List[Line] = []
-    lines = dump.split("\n")
-    while i < len(lines):
-        row = lines[i]
-        i += 1
-
-        if not row:
-            continue
+    for dump_row in dump.rows:
+        row = dump_row.text
 
         try:
-            # Check if the currrent line has "OFFSET <SYMBOL>:"
-            function_label_match = re.match(r"^[0-9a-f]+ <(.*)>:$", row)
-
-            if function_label_match:
-                function_name = function_label_match.groups()[0] + ":"
+            if dump_row.label is not None:
+                function_name = dump_row.label + ":"
 
                 if config.diff_function_symbols:
                     # If diffing function symbols is enabled
@@ -3278,14 +4851,6 @@ def process(dump: str, config: Config) -> List[Line]:
                     )
                 continue
 
-            if row.startswith("DATAREF"):
-                parts = row.split(" ", 3)
-                text_offset = int(parts[1])
-                from_offset = int(parts[2])
-                from_section = parts[3]
-                data_refs[text_offset][from_section].append(from_offset)
-                continue
-
             if config.diff_obj and num_instr >= config.max_function_size_lines:
                 output.append(
                     Line(
@@ -3298,14 +4863,10 @@ def process(dump: str, config: Config) -> List[Line]:
                 )
                 break
 
-            if not re.match(r"^\s+[0-9a-f]+:\s+", row):
-                # This regex is conservative, and assumes the file path does not contain "weird"
-                # characters like tabs or angle brackets.
-                if re.match(
-                    r"^[^ \t<>][^\t<>]*:[0-9]+( \(discriminator [0-9]+\))?$", row
-                ):
-                    source_filename, _, tail = row.rpartition(":")
-                    source_line_num = int(tail.partition(" ")[0])
+            if dump_row.addr is None:
+                if dump_row.source_filename is not None:
+                    source_filename = dump_row.source_filename
+                    source_line_num = dump_row.source_line_num
                 source_lines.append(row)
                 continue
 
@@ -3320,25 +4881,13 @@ def process(dump: str, config: Config) -> List[Line]:
             elif pool_match_sh:
                 data_pool_addr = int(pool_match_sh.group(4), 16)
 
-            m_comment = re.search(arch.re_comment, row)
-            comment = m_comment[0] if m_comment else None
-            row = re.sub(arch.re_comment, "", row)
-            line_num_str = row.split(":")[0].strip()
-            row = row.rstrip()
-            tabs = row.split("\t")
-            line_num = int(line_num_str, 16) if line_num_str else None
+            comment = dump_row.comment
+            line_num = dump_row.addr
 
-            if line_num is not None:
-                if line_num < prev_line_num:
-                    line_group += 1
+            if line_num < prev_line_num:
+                line_group += 1
 
-                prev_line_num = line_num
-
-            # TODO: use --no-show-raw-insn for all arches
-            if "--no-show-raw-insn" in arch.arch_flags:
-                row = "\t".join(tabs[1:])
-            else:
-                row = "\t".join(tabs[2:])
+            prev_line_num = line_num
 
             if line_num in data_refs:
                 refs = data_refs[line_num]
@@ -3356,17 +4905,13 @@ def process(dump: str, config: Config) -> List[Line]:
                     )
                 )
 
-            if "\t" in row:
-                row_parts = row.split("\t", 1)
-            else:
-                # powerpc-eabi-objdump doesn't use tabs
-                row_parts = [part.lstrip() for part in row.split(" ", 1)]
-
-            mnemonic = row_parts[0].strip()
-            args = row_parts[1].strip() if len(row_parts) >= 2 else ""
+            mnemonic = dump_row.mnemonic
+            args = dump_row.args
+            row = mnemonic + "\t" + args
 
-            next_line = lines[i] if i < len(lines) else None
-            mnemonic, args = processor.pre_process(mnemonic, args, next_line, comment)
+            # Processors only look at the first relocation of an instruction.
+            next_reloc = dump_row.relocs[0] if dump_row.relocs else None
+            mnemonic, args = processor.pre_process(mnemonic, args, next_reloc, comment)
             row = mnemonic + "\t" + args.replace("\t", "  ")
 
             addr = ""
@@ -3385,17 +4930,10 @@ def process(dump: str, config: Config) -> List[Line]:
             original = row
 
             symbol = None
-            while i < len(lines):
-                reloc_row = lines[i]
-                if re.search(arch.re_reloc, reloc_row):
-                    original, reloc_symbol = processor.process_reloc(
-                        reloc_row, original
-                    )
-                    if reloc_symbol is not None:
-                        symbol = reloc_symbol
-                else:
-                    break
-                i += 1
+            for reloc in dump_row.relocs:
+                original, reloc_symbol = processor.process_reloc(reloc, original)
+                if reloc_symbol is not None:
+                    symbol = reloc_symbol
 
             is_text_relative_j = False
             if (
@@ -3480,6 +5018,8 @@ def process(dump: str, config: Config) -> List[Line]:
                 source_line_num=source_line_num,
                 source_lines=source_lines,
                 comment=comment,
+                raw_bytes=dump_row.raw_bytes,
+                relocs=tuple(dump_row.relocs),
             )
         )
         num_instr += 1
@@ -3563,10 +5103,25 @@ def split_off_address(line: str) -> Tuple[str, str]:
 def diff_sequences_difflib(
     seq1: List[str], seq2: List[str]
 ) -> Sequence[Tuple[str, int, int, int, int]]:
+    import difflib
+
     differ = difflib.SequenceMatcher(a=seq1, b=seq2, autojunk=False)
     return differ.get_opcodes()
 
 
+def encode_mnemonics(seq: List[str], remapping: Dict[str, str]) -> str:
+    """Encode a sequence as a string with one character per distinct element,
+    adding new elements to `remapping`."""
+    seq = seq[:]
+    for i in range(len(seq)):
+        val = remapping.get(seq[i])
+        if val is None:
+            val = chr(len(remapping))
+            remapping[seq[i]] = val
+        seq[i] = val
+    return "".join(seq)
+
+
 def diff_sequences(
     seq1: List[str], seq2: List[str], algorithm: str
 ) -> Sequence[Tuple[str, int, int, int, int]]:
@@ -3576,19 +5131,9 @@ def diff_sequences(
     # The Levenshtein library assumes that we compare strings, not lists. Convert.
     remapping: Dict[str, str] = {}
 
-    def remap(seq: List[str]) -> str:
-        seq = seq[:]
-        for i in range(len(seq)):
-            val = remapping.get(seq[i])
-            if val is None:
-                val = chr(len(remapping))
-                remapping[seq[i]] = val
-            seq[i] = val
-        return "".join(seq)
-
     try:
-        rem1 = remap(seq1)
-        rem2 = remap(seq2)
+        rem1 = encode_mnemonics(seq1, remapping)
+        rem2 = encode_mnemonics(seq2, remapping)
     except ValueError:
         if len(seq1) + len(seq2) < 0x110000:
             raise
@@ -3602,17 +5147,100 @@ def diff_sequences(
     return ret
 
 
+def basic_block_starts(lines: List[Line], arch: ArchSettings) -> List[int]:
+    """The indices at which basic blocks start: branch targets, and the lines
+    after branches, jumps and returns (or after their delay slots)."""
+    targets = {
+        (line.line_group, line.branch_target)
+        for line in lines
+        if line.branch_target is not None
+    }
+    starts: List[int] = []
+    next_start = 0
+    for i, line in enumerate(lines):
+        if i == next_start or (line.line_group, line.line_num) in targets:
+            if not starts or starts[-1] != i:
+                starts.append(i)
+        if line.mnemonic in arch.delay_slot_instructions:
+            next_start = i + 2
+        elif (
+            line.branch_target is not None or line.mnemonic in arch.branch_instructions
+        ):
+            next_start = i + 1
+    return starts
+
+
+def diff_blocks(
+    lines1: List[Line], lines2: List[Line], arch: ArchSettings
+) -> List[Tuple[str, int, int, int, int]]:
+    """Diff two functions block by block: basic blocks are aligned by their
+    sequences of mnemonics first, and only the stretches between identical
+    blocks are diffed instruction by instruction."""
+    edges1 = basic_block_starts(lines1, arch) + [len(lines1)]
+    edges2 = basic_block_starts(lines2, arch) + [len(lines2)]
+    mnemonics1 = [line.mnemonic for line in lines1]
+    mnemonics2 = [line.mnemonic for line in lines2]
+    blocks1 = [
+        "\n".join(mnemonics1[start:end]) for start, end in zip(edges1, edges1[1:])
+    ]
+    blocks2 = [
+        "\n".join(mnemonics2[start:end]) for start, end in zip(edges2, edges2[1:])
+    ]
+
+    ret: List[Tuple[str, int, int, int, int]] = []
+
+    def diff_stretch(i1: int, i2: int, j1: int, j2: int) -> None:
+        if i1 == i2 and j1 == j2:
+            return
+        if i1 == i2:
+            ret.append(("insert", i1, i2, j1, j2))
+        elif j1 == j2:
+            ret.append(("delete", i1, i2, j1, j2))
+        else:
+            for tag, k1, k2, l1, l2 in diff_sequences(
+                mnemonics1[i1:i2], mnemonics2[j1:j2], "levenshtein"
+            ):
+                ret.append((tag, i1 + k1, i1 + k2, j1 + l1, j1 + l2))
+
+    # Consecutive unequal blocks are diffed together, so that instructions
+    # can be paired up across block boundaries that moved.
+    i = j = 0
+    for tag, b1, b2, c1, c2 in diff_sequences(blocks1, blocks2, "levenshtein"):
+        if tag == "equal":
+            diff_stretch(i, edges1[b1], j, edges2[c1])
+            i, j = edges1[b2], edges2[c2]
+            ret.append(("equal", edges1[b1], i, edges2[c1], j))
+    diff_stretch(i, len(lines1), j, len(lines2))
+    return ret
+
+
+@timed("diff_lines")
 def diff_lines(
     lines1: List[Line],
     lines2: List[Line],
     algorithm: str,
+    arch: ArchSettings,
+) -> List[Tuple[Optional[Line], Optional[Line]]]:
+    if algorithm == "blocks":
+        opcodes: Sequence[Tuple[str, int, int, int, int]] = diff_blocks(
+            lines1, lines2, arch
+        )
+    else:
+        opcodes = diff_sequences(
+            [line.mnemonic for line in lines1],
+            [line.mnemonic for line in lines2],
+            algorithm,
+        )
+    return pair_lines(lines1, lines2, opcodes)
+
+
+def pair_lines(
+    lines1: List[Line],
+    lines2: List[Line],
+    opcodes: Sequence[Tuple[str, int, int, int, int]],
 ) -> List[Tuple[Optional[Line], Optional[Line]]]:
     ret = []
-    for tag, i1, i2, j1, j2 in diff_sequences(
-        [line.mnemonic for line in lines1],
-        [line.mnemonic for line in lines2],
-        algorithm,
-    ):
+    for tag, i1, i2, j1, j2 in opcodes:
         for line1, line2 in itertools.zip_longest(lines1[i1:i2], lines2[j1:j2]):
             if tag == "replace":
                 if line1 is None:
@@ -3691,6 +5319,7 @@ def diff_sameline(
     return (num_stack_penalties, num_regalloc_penalties, has_symbol_mismatch)
 
 
+@timed("score")
 def score_diff_lines(
     lines: List[Tuple[Optional[Line], Optional[Line]]],
     config: Config,
@@ -3734,6 +5363,8 @@ def score_diff_lines(
     for index, (line1, line2) in enumerate(lines):
         if max_index is not None and index > max_index:
             break
+        if line1 and line2 and same_encoding(line1, line2, config.arch):
+            continue
         if line1 and line2 and line1.mnemonic == line2.mnemonic:
             sp, rp, _ = diff_sameline(line1, line2, config, symbol_map)
             num_stack_penalties += sp
@@ -3781,6 +5412,25 @@ class Diff:
     max_score: int
 
 
+# Rough memory use in bytes of a Line object excluding its strings, of a source
+# line excluding its characters, and of a row in a Diff and in TableData, as
+# measured with tracemalloc on CPython 3.11.
+LINE_SIZE_ESTIMATE = 360
+SOURCE_LINE_SIZE_ESTIMATE = 80
+OUTPUT_LINE_SIZE_ESTIMATE = 1150
+
+
+def estimate_lines_size(lines: List[Line]) -> int:
+    """Estimate the memory used by a list of lines, for --memory-budget."""
+    size = 0
+    for line in lines:
+        size += LINE_SIZE_ESTIMATE + len(line.original) + len(line.diff_row)
+        size += len(line.normalized_original) + len(line.scorable_line)
+        for source_line in line.source_lines:
+            size += SOURCE_LINE_SIZE_ESTIMATE + len(source_line)
+    return size
+
+
 def trim_nops(lines: List[Line], arch: ArchSettings) -> List[Line]:
     lines = lines[:]
     while (
@@ -3792,6 +5442,53 @@ def trim_nops(lines: List[Line], arch: ArchSettings) -> List[Line]:
     return lines
 
 
+def map_line_nums_2to1(
+    diffed_lines: List[Tuple[Optional[Line], Optional[Line]]],
+) -> Dict[int, Tuple[int, int]]:
+    """Map line numbers of the second list of a diff to positions in the first,
+    as (line number, number of lines after it)."""
+    line_num_base = -1
+    line_num_offset = 0
+    line_num_2to1 = {}
+    for line1, line2 in diffed_lines:
+        if line1 is not None and line1.line_num is not None:
+            line_num_base = line1.line_num
+            line_num_offset = 0
+        else:
+            line_num_offset += 1
+        if line2 is not None and line2.line_num is not None:
+            line_num_2to1[line2.line_num] = (line_num_base, line_num_offset)
+    return line_num_2to1
+
+
+def retarget_branch(
+    line2: Line, line_num_2to1: Dict[int, Tuple[int, int]]
+) -> Tuple[Tuple[int, int], Optional[Tuple[str, str]]]:
+    """Translate the target of a branch in the second list of a diff into a
+    position in the first. Returns that, and the line's normalized_original
+    and scorable_line rewritten to branch there (None if the target is
+    ignored)."""
+    target = line2.branch_target
+    assert target is not None
+    line2_target = line_num_2to1.get(target)
+    if line2_target is None:
+        # If the target is outside the disassembly, extrapolate.
+        # This only matters near the bottom.
+        assert line2.line_num is not None
+        line2_line = line_num_2to1[line2.line_num]
+        line2_target = (line2_line[0] + (target - line2.line_num), 0)
+
+    norm2, norm_branch2 = split_off_address(line2.normalized_original)
+    if norm_branch2 == "<ignore>":
+        return line2_target, None
+    retargetted = hex(line2_target[0]).replace("0x", "")
+    if line2_target[1] != 0:
+        retargetted += f"+{line2_target[1]}"
+    sc_base, _ = split_off_address(line2.scorable_line)
+    return line2_target, (norm2 + retargetted, sc_base + retargetted)
+
+
+@timed("do_diff")
 def do_diff(lines1: List[Line], lines2: List[Line], config: Config) -> Diff:
     if config.show_source:
         import cxxfilt
@@ -3823,19 +5520,8 @@ def do_diff(lines1: List[Line], lines2: List[Line], config: Config) -> Diff:
     lines1 = trim_nops(lines1, arch)
     lines2 = trim_nops(lines2, arch)
 
-    diffed_lines = diff_lines(lines1, lines2, config.algorithm)
-
-    line_num_base = -1
-    line_num_offset = 0
-    line_num_2to1 = {}
-    for line1, line2 in diffed_lines:
-        if line1 is not None and line1.line_num is not None:
-            line_num_base = line1.line_num
-            line_num_offset = 0
-        else:
-            line_num_offset += 1
-        if line2 is not None and line2.line_num is not None:
-            line_num_2to1[line2.line_num] = (line_num_base, line_num_offset)
+    diffed_lines = diff_lines(lines1, lines2, config.algorithm, arch)
+    line_num_2to1 = map_line_nums_2to1(diffed_lines)
 
     for line1, line2 in diffed_lines:
         line_color1 = line_color2 = sym_color = BasicFormat.NONE
@@ -3843,7 +5529,11 @@ def do_diff(lines1: List[Line], lines2: List[Line], config: Config) -> Diff:
         is_data_ref = False
         out1 = Text() if not line1 else Text(pad_mnemonic(line1.original))
         out2 = Text() if not line2 else Text(pad_mnemonic(line2.original))
-        if line1 and line2 and line1.diff_row == line2.diff_row:
+        if line1 and line2 and same_encoding(line1, line2, arch):
+            # Fast path: the same instruction bytes and relocations, so there is
+            # nothing to color.
+            pass
+        elif line1 and line2 and line1.diff_row == line2.diff_row:
             if line1.diff_row == "<data-ref>":
                 if line1.normalized_original != line2.normalized_original:
                     line_prefix = "i"
@@ -3875,24 +5565,10 @@ def do_diff(lines1: List[Line], lines2: List[Line], config: Config) -> Diff:
                 )
 
                 if line2.branch_target is not None:
-                    target = line2.branch_target
-                    line2_target = line_num_2to1.get(line2.branch_target)
-                    if line2_target is None:
-                        # If the target is outside the disassembly, extrapolate.
-                        # This only matters near the bottom.
-                        assert line2.line_num is not None
-                        line2_line = line_num_2to1[line2.line_num]
-                        line2_target = (line2_line[0] + (target - line2.line_num), 0)
-
                     # Adjust the branch target for scoring and three-way diffing.
-                    norm2, norm_branch2 = split_off_address(line2.normalized_original)
-                    if norm_branch2 != "<ignore>":
-                        retargetted = hex(line2_target[0]).replace("0x", "")
-                        if line2_target[1] != 0:
-                            retargetted += f"+{line2_target[1]}"
-                        line2.normalized_original = norm2 + retargetted
-                        sc_base, _ = split_off_address(line2.scorable_line)
-                        line2.scorable_line = sc_base + retargetted
+                    line2_target, retargeted = retarget_branch(line2, line_num_2to1)
+                    if retargeted is not None:
+                        line2.normalized_original, line2.scorable_line = retargeted
                     same_target = line2_target == (line1.branch_target, 0)
                 else:
                     # Do a naive comparison for non-branches (e.g. function calls).
@@ -4080,6 +5756,126 @@ def do_diff(lines1: List[Line], lines2: List[Line], config: Config) -> Diff:
     return Diff(lines=output, score=score, max_score=max_score)
 
 
+def count_raw_bytes(lines: List[Line]) -> Tuple[Dict[str, int], Dict[str, Set[str]]]:
+    """The number of lines with each instruction encoding, and the mnemonics
+    each encoding is shown as."""
+    counts: Dict[str, int] = {}
+    mnemonics: Dict[str, Set[str]] = {}
+    for line in lines:
+        if line.raw_bytes:
+            counts[line.raw_bytes] = counts.get(line.raw_bytes, 0) + 1
+            mnemonics.setdefault(line.raw_bytes, set()).add(line.mnemonic)
+    return counts, mnemonics
+
+
+class PreparedTarget:
+    """
+    A base (target) side prepared for scoring many candidates against it, as
+    in permuter or compiler flag search loops. Everything that only depends
+    on the base is computed once, and scores are the same as from do_diff.
+    """
+
+    def __init__(self, base: Union[str, AsmDump, List[Line]], config: Config) -> None:
+        self.config = config
+        lines = base if isinstance(base, list) else process(base, config)
+        self.lines = trim_nops(lines, config.arch)
+        self.max_score = len(self.lines) * config.penalty_deletion
+        self.mnemonics = [line.mnemonic for line in self.lines]
+        self.mnemonic_counts = Counter(self.mnemonics)
+        self.byte_counts, self.byte_mnemonics = count_raw_bytes(self.lines)
+        self.truncated = any(line.original == "..." for line in self.lines)
+        self.remapping: Dict[str, str] = {}
+        self.encoded: Optional[str] = None
+        if config.algorithm == "levenshtein":
+            try:
+                self.encoded = encode_mnemonics(self.mnemonics, self.remapping)
+            except ValueError:
+                # Too many distinct mnemonics; diff_sequences falls back to difflib.
+                pass
+
+    def lower_bound(self, lines2: List[Line]) -> int:
+        """A lower bound on the score of (nop-trimmed) lines, from the number of
+        lines with each mnemonic: lines only get paired up with lines that have
+        the same mnemonic or the same bytes (see same_encoding), and all others
+        are penalized."""
+        if self.truncated or any(line.original == "..." for line in lines2):
+            # Scoring may skip the end of the diff
+            return 0
+        counts2 = Counter(line.mnemonic for line in lines2)
+        paired = sum((self.mnemonic_counts & counts2).values())
+        byte_counts2, byte_mnemonics2 = count_raw_bytes(lines2)
+        for raw, count in byte_counts2.items():
+            # Lines with these bytes may pair up despite different mnemonics.
+            count1 = self.byte_counts.get(raw, 0)
+            if count1 and len(self.byte_mnemonics[raw] | byte_mnemonics2[raw]) > 1:
+                paired += min(count1, count)
+        unpaired = max(0, len(self.lines) + len(lines2) - 2 * paired)
+        config = self.config
+        cheapest = min(config.penalty_insertion, config.penalty_deletion)
+        # Pairs of an insertion and a deletion may count as a reordering instead.
+        return min(
+            unpaired * cheapest,
+            unpaired // 2 * config.penalty_reordering + unpaired % 2 * cheapest,
+        )
+
+    def opcodes(self, lines2: List[Line]) -> Sequence[Tuple[str, int, int, int, int]]:
+        if self.config.algorithm == "blocks":
+            return diff_blocks(self.lines, lines2, self.config.arch)
+        mnemonics2 = [line.mnemonic for line in lines2]
+        if self.encoded is not None:
+            try:
+                encoded2 = encode_mnemonics(mnemonics2, dict(self.remapping))
+            except ValueError:
+                return diff_sequences(self.mnemonics, mnemonics2, "levenshtein")
+
+            import Levenshtein
+
+            ret: List[Tuple[str, int, int, int, int]] = Levenshtein.opcodes(
+                self.encoded, encoded2
+            )
+            return ret
+        return diff_sequences(self.mnemonics, mnemonics2, self.config.algorithm)
+
+    def score(
+        self,
+        candidate: Union[str, AsmDump, List[Line]],
+        cutoff: Optional[int] = None,
+    ) -> int:
+        """
+        Score a candidate dump, or lines from `process()`, which are not
+        modified. If `cutoff` is given and the score is certain to exceed it,
+        this may return early with some number greater than `cutoff` instead.
+        """
+        config = self.config
+        lines = candidate if isinstance(candidate, list) else process(candidate, config)
+        lines2 = trim_nops(lines, config.arch)
+        if cutoff is not None:
+            bound = self.lower_bound(lines2)
+            if bound > cutoff:
+                return bound
+
+        diffed_lines = pair_lines(self.lines, lines2, self.opcodes(lines2))
+        line_num_2to1 = map_line_nums_2to1(diffed_lines)
+        for i, (line1, line2) in enumerate(diffed_lines):
+            # Branches get retargeted the same way as in do_diff.
+            if (
+                line1 is not None
+                and line2 is not None
+                and line2.branch_target is not None
+                and line1.diff_row == line2.diff_row
+                and line1.diff_row != "<data-ref>"
+            ):
+                _, retargeted = retarget_branch(line2, line_num_2to1)
+                if retargeted is not None:
+                    line2 = replace(
+                        line2,
+                        normalized_original=retargeted[0],
+                        scorable_line=retargeted[1],
+                    )
+                    diffed_lines[i] = (line1, line2)
+        return score_diff_lines(diffed_lines, config, {})
+
+
 def chunk_diff_lines(
     diff: List[OutputLine],
 ) -> List[Union[List[OutputLine], OutputLine]]:
@@ -4138,12 +5934,19 @@ def compress_matching(
     return ret
 
 
-def align_diffs(old_diff: Diff, new_diff: Diff, config: Config) -> TableData:
+@timed("align_diffs")
+def align_diffs(
+    old_diff: Diff, new_diff: Diff, config: Config, *, old_dropped: bool = False
+) -> TableData:
+    """Lay out diffs as table columns. With `old_dropped`, the previous diff
+    was dropped to save memory, and `old_diff` is the new diff again."""
     headers: Tuple[Text, ...]
     diff_lines: List[Tuple[OutputLine, ...]]
     padding = " " * 7 if config.show_line_numbers else " " * 2
 
     if config.diff_mode in (DiffMode.THREEWAY_PREV, DiffMode.THREEWAY_BASE):
+        import difflib
+
         old_chunks = chunk_diff_lines(old_diff.lines)
         new_chunks = chunk_diff_lines(new_diff.lines)
         diff_lines = []
@@ -4181,7 +5984,11 @@ def align_diffs(old_diff: Diff, new_diff: Diff, config: Config) -> TableData:
         headers = (
             Text("TARGET"),
             Text(f"{padding}CURRENT ({new_diff.score})"),
-            Text(f"{padding}PREVIOUS ({old_diff.score})"),
+            Text(
+                f"{padding}PREVIOUS (dropped for --memory-budget)"
+                if old_dropped
+                else f"{padding}PREVIOUS ({old_diff.score})"
+            ),
         )
         current_score = new_diff.score
         max_score = new_diff.max_score
@@ -4228,21 +6035,125 @@ def align_diffs(old_diff: Diff, new_diff: Diff, config: Config) -> TableData:
     )
 
 
+def parse_depfile(contents: str) -> List[str]:
+    """Extract the prerequisites from a Makefile-style dependency file, as
+    generated by e.g. `gcc -MMD`. Phony targets (-MP) don't add anything."""
+    deps: List[str] = []
+    contents = contents.replace("\\\r\n", " ").replace("\\\n", " ")
+    for line in contents.splitlines():
+        # A colon followed by whitespace separates targets from prerequisites.
+        # (Requiring the whitespace keeps Windows drive letters intact.)
+        m = re.search(r":(?:\s|$)", line)
+        if not m:
+            continue
+        rhs = line[m.end() :]
+        word = ""
+        i = 0
+        while i < len(rhs):
+            c = rhs[i]
+            if c == "\\" and rhs[i + 1 : i + 2] in (" ", "#"):
+                word += rhs[i + 1]
+                i += 2
+                continue
+            if c == "$" and rhs[i + 1 : i + 2] == "$":
+                word += "$"
+                i += 2
+                continue
+            if c.isspace():
+                if word:
+                    deps.append(word)
+                word = ""
+            else:
+                word += c
+            i += 1
+        if word:
+            deps.append(word)
+    return list(dict.fromkeys(deps))
+
+
+def read_depfile(depfile: str) -> Optional[List[str]]:
+    try:
+        with open(depfile, encoding="utf-8", errors="replace") as f:
+            deps = parse_depfile(f.read())
+    except OSError:
+        return None
+    return deps or None
+
+
+class Debouncer:
+    """Chooses how long to wait for more file system events before rebuilding.
+
+    Cheap builds keep the delay at DEBOUNCE_DELAY. Expensive builds wait
+    longer, since a build started too early is a costly waste. And when a burst
+    of events arrives shortly after the previous one (e.g. an editor saving
+    several files, or formatting on save), that gap was evidently part of the
+    same burst, so we learn to wait it out next time."""
+
+    build_time: Optional[float]
+    burst_gap: float
+    last_burst_end: Optional[float]
+    last_delay: float
+
+    # Fraction of the (smoothed) build duration to wait.
+    BUILD_TIME_FACTOR = 0.15
+
+    def __init__(self) -> None:
+        self.build_time = None
+        self.burst_gap = 0.0
+        self.last_burst_end = None
+        self.last_delay = DEBOUNCE_DELAY
+
+    def record_build(self, duration: float) -> None:
+        if self.build_time is None:
+            self.build_time = duration
+        else:
+            self.build_time = 0.5 * self.build_time + 0.5 * duration
+
+    def burst_started(self, t: float) -> None:
+        if self.last_burst_end is not None:
+            gap = t - self.last_burst_end
+            if 0 <= gap <= MAX_DEBOUNCE_DELAY:
+                self.burst_gap = max(gap, self.burst_gap)
+            else:
+                self.burst_gap *= 0.5
+
+    def burst_ended(self, t: float, delay: float) -> None:
+        self.last_burst_end = t
+        self.last_delay = delay
+
+    def delay(self) -> float:
+        delay = DEBOUNCE_DELAY
+        if self.build_time is not None:
+            delay = max(delay, self.build_time * self.BUILD_TIME_FACTOR)
+        delay = max(delay, self.burst_gap * 1.25)
+        return min(delay, MAX_DEBOUNCE_DELAY)
+
+
 def debounced_fs_watch(
     targets: List[str],
     outq: "queue.Queue[Optional[float]]",
     config: Config,
     project: ProjectSettings,
-) -> None:
-    import watchdog.events
-    import watchdog.observers
+    match_source_extensions: bool = True,
+    debouncer: Optional[Debouncer] = None,
+) -> Callable[[List[str], bool], None]:
+    """Start watching `targets` (files or directories) for changes, posting
+    debounced change times to `outq`. With `match_source_extensions`, a change
+    to any file with a source extension also counts.
+
+    Returns a function that replaces the set of watched targets (and the
+    `match_source_extensions` flag), for watch sets that change over time."""
+    try:
+        import watchdog.events
+        import watchdog.observers
+    except ModuleNotFoundError as e:
+        fail(MISSING_PREREQUISITES.format(e.name))
 
     class WatchEventHandler(watchdog.events.FileSystemEventHandler):
-        def __init__(
-            self, queue: "queue.Queue[float]", file_targets: List[str]
-        ) -> None:
+        def __init__(self, queue: "queue.Queue[float]") -> None:
             self.queue = queue
-            self.file_targets = file_targets
+            self.file_targets: Set[str] = set()
+            self.match_source_extensions = True
 
         def on_modified(self, ev: object) -> None:
             if isinstance(ev, watchdog.events.FileModifiedEvent):
@@ -4255,11 +6166,12 @@ def debounced_fs_watch(
                 self.changed(ev.dest_path)
 
         def should_notify(self, path: str) -> bool:
-            for target in self.file_targets:
-                if os.path.abspath(path) == target:
-                    return True
-            if config.make and any(
-                path.endswith(suffix) for suffix in project.source_extensions
+            if os.path.abspath(path) in self.file_targets:
+                return True
+            if (
+                self.match_source_extensions
+                and config.make
+                and any(path.endswith(suffix) for suffix in project.source_extensions)
             ):
                 return True
             return False
@@ -4268,46 +6180,56 @@ def debounced_fs_watch(
             if self.should_notify(path):
                 self.queue.put(time.time())
 
-    def debounce_thread() -> NoReturn:
-        listenq: "queue.Queue[float]" = queue.Queue()
-        file_targets: List[str] = []
-        event_handler = WatchEventHandler(listenq, file_targets)
-        observer = watchdog.observers.Observer()
-        observed = set()
+    listenq: "queue.Queue[float]" = queue.Queue()
+    debouncer = debouncer or Debouncer()
+    event_handler = WatchEventHandler(listenq)
+    observer = watchdog.observers.Observer()
+    watches: Dict[Tuple[str, bool], Any] = {}
+
+    def set_targets(targets: List[str], match_source_extensions: bool) -> None:
+        file_targets: Set[str] = set()
+        wanted: Set[Tuple[str, bool]] = set()
         for target in targets:
             if os.path.isdir(target):
-                observer.schedule(event_handler, target, recursive=True)  # type: ignore
+                wanted.add((target, True))
             else:
-                file_targets.append(os.path.abspath(target))
-                target = os.path.dirname(target) or "."
-                if target not in observed:
-                    observed.add(target)
-                    observer.schedule(event_handler, target)  # type: ignore
-        observer.start()  # type: ignore
+                file_targets.add(os.path.abspath(target))
+                wanted.add((os.path.dirname(target) or ".", False))
+        event_handler.file_targets = file_targets
+        event_handler.match_source_extensions = match_source_extensions
+        for key in list(watches):
+            if key not in wanted:
+                observer.unschedule(watches.pop(key))  # type: ignore
+        for key in wanted:
+            path, recursive = key
+            if key not in watches and os.path.isdir(path):
+                watches[key] = observer.schedule(  # type: ignore
+                    event_handler, path, recursive=recursive
+                )
+
+    def debounce_thread() -> NoReturn:
         while True:
             t = listenq.get()
-            more = True
-            while more:
-                delay = t + DEBOUNCE_DELAY - time.time()
-                if delay > 0:
-                    time.sleep(delay)
-                # consume entire queue
-                more = False
+            debouncer.burst_started(t)
+            while True:
+                # Wait until `delay` has passed since the latest event.
+                delay = debouncer.delay()
                 try:
-                    while True:
-                        t = listenq.get(block=False)
-                        more = True
+                    t = listenq.get(timeout=max(t + delay - time.time(), 0))
                 except queue.Empty:
-                    pass
+                    break
+            debouncer.burst_ended(t, delay)
             outq.put(t)
 
+    set_targets(targets, match_source_extensions)
+    observer.start()  # type: ignore
     th = threading.Thread(target=debounce_thread, daemon=True)
     th.start()
+    return set_targets
 
 
 class Display:
-    basedump: str
-    mydump: str
+    mydump: Union[str, AsmDump]
     last_refresh_key: object
     config: Config
     emsg: Optional[str]
@@ -4317,19 +6239,38 @@ class Display:
     watch_queue: "queue.Queue[Optional[float]]"
     less_proc: "Optional[subprocess.Popen[bytes]]"
 
-    def __init__(self, basedump: str, mydump: str, config: Config) -> None:
+    def __init__(
+        self,
+        basedump: Union[str, AsmDump],
+        mydump: Union[str, AsmDump],
+        config: Config,
+        *,
+        base_lines: Optional[List[Line]] = None,
+    ) -> None:
         self.config = config
-        self.base_lines = process(basedump, config)
+        if base_lines is None:
+            base_lines = process(basedump, config)
+        self.base_lines = base_lines
         self.mydump = mydump
         self.emsg = None
         self.last_refresh_key = None
         self.last_diff_output = None
+        # Whether the base diff of -b was dropped for --memory-budget, after
+        # which no later diff takes its place.
+        self.base_diff_dropped = False
 
     def run_diff(self) -> Tuple[str, object]:
         if self.emsg is not None:
             return (self.emsg, self.emsg)
 
         my_lines = process(self.mydump, self.config)
+        keep_history = True
+        if self.config.memory_budget is not None:
+            keep_history = self.fit_memory_budget(my_lines, self.config.memory_budget)
+        if not keep_history:
+            # Free the previous diff before making the new one, which isn't
+            # kept either
+            self.last_diff_output = None
 
         if self.config.diff_mode == DiffMode.SINGLE_BASE:
             diff_output = do_diff(self.base_lines, self.base_lines, self.config)
@@ -4339,11 +6280,20 @@ class Display:
             diff_output = do_diff(self.base_lines, my_lines, self.config)
 
         last_diff_output = self.last_diff_output or diff_output
-        if self.config.diff_mode != DiffMode.THREEWAY_BASE or not self.last_diff_output:
+        if keep_history and (
+            self.config.diff_mode != DiffMode.THREEWAY_BASE or not self.last_diff_output
+        ):
             self.last_diff_output = diff_output
 
-        data = align_diffs(last_diff_output, diff_output, self.config)
-        output = self.config.formatter.table(data)
+        data = align_diffs(
+            last_diff_output, diff_output, self.config, old_dropped=not keep_history
+        )
+        if _timings is not None:
+            data = replace(data, timings=_timings.as_dict())
+        with timing_stage("format") as timing:
+            output = self.config.formatter.table(data)
+            if timing is not None:
+                timing.lines += count_output_lines(output)
 
         refresh_key = (
             [line.key2 for line in diff_output.lines],
@@ -4352,27 +6302,50 @@ class Display:
 
         return (output, refresh_key)
 
-    def run_less(
-        self, output: str
-    ) -> "Tuple[subprocess.Popen[bytes], subprocess.Popen[bytes]]":
-        # Pipe the output through 'tail' and only then to less, to ensure the
-        # write call doesn't block. ('tail' has to buffer all its input before
-        # it starts writing.) This also means we don't have to deal with pipe
-        # closure errors.
-        buffer_proc = subprocess.Popen(
-            BUFFER_CMD, stdin=subprocess.PIPE, stdout=subprocess.PIPE
+    def fit_memory_budget(self, my_lines: List[Line], budget: int) -> bool:
+        """Drop source lines if the lines would otherwise not fit in the memory
+        budget, together with a diff of them. Returns whether a previous diff
+        also fits, for threeway diffing."""
+        lines_size = estimate_lines_size(self.base_lines)
+        lines_size += estimate_lines_size(my_lines)
+        diff_size = OUTPUT_LINE_SIZE_ESTIMATE * max(len(self.base_lines), len(my_lines))
+        has_source = any(line.source_lines for line in self.base_lines) or any(
+            line.source_lines for line in my_lines
         )
-        less_proc = subprocess.Popen(LESS_CMD, stdin=buffer_proc.stdout)
-        assert buffer_proc.stdin
-        assert buffer_proc.stdout
-        buffer_proc.stdin.write(output.encode())
-        buffer_proc.stdin.close()
-        buffer_proc.stdout.close()
-        return (buffer_proc, less_proc)
+        if lines_size + diff_size > budget and has_source:
+            # The base lines may be shared with a cache, so leave them as is
+            self.base_lines = [
+                replace(line, source_lines=[]) if line.source_lines else line
+                for line in self.base_lines
+            ]
+            for line in my_lines:
+                line.source_lines = []
+            memory_note("Dropped source lines to stay within --memory-budget.")
+            lines_size = estimate_lines_size(self.base_lines)
+            lines_size += estimate_lines_size(my_lines)
+        if self.config.diff_mode not in (
+            DiffMode.THREEWAY_PREV,
+            DiffMode.THREEWAY_BASE,
+        ):
+            return True
+        if self.config.diff_mode == DiffMode.THREEWAY_BASE and (
+            self.base_diff_dropped or lines_size + 2 * diff_size > budget
+        ):
+            self.base_diff_dropped = True
+            memory_note(
+                "Dropped the base diff of -b to stay within --memory-budget; "
+                "restart to pick a new base."
+            )
+            return False
+        if lines_size + 2 * diff_size > budget:
+            memory_note("Dropped the previous diff to stay within --memory-budget.")
+            return False
+        return True
 
     def run_sync(self) -> None:
         output, _ = self.run_diff()
-        proca, procb = self.run_less(output)
+        with timing_stage("pager"):
+            proca, procb = run_less(output)
         procb.wait()
         proca.wait()
 
@@ -4387,7 +6360,7 @@ class Display:
         self.ready_queue.get()
 
     def display_thread(self, initial_output: str) -> None:
-        proca, procb = self.run_less(initial_output)
+        proca, procb = run_less(initial_output)
         self.less_proc = procb
         self.ready_queue.put(None)
         while True:
@@ -4401,7 +6374,7 @@ class Display:
                 # killed by program with the intent to refresh
                 output = self.pending_update
                 self.pending_update = None
-                proca, procb = self.run_less(output)
+                proca, procb = run_less(output)
                 self.less_proc = procb
                 self.ready_queue.put(None)
             else:
@@ -4415,7 +6388,7 @@ class Display:
         sys.stdout.write("\x1b7\x1b[1;1f{}\x1b8".format(msg + " "))
         sys.stdout.flush()
 
-    def update(self, text: str, error: bool) -> None:
+    def update(self, text: Union[str, AsmDump], error: bool) -> None:
         if not error and not self.emsg and text == self.mydump:
             self.progress("Unchanged. ")
             return
@@ -4423,7 +6396,7 @@ class Display:
             self.mydump = text
             self.emsg = None
         else:
-            self.emsg = text
+            self.emsg = str(text)
         output, refresh_key = self.run_diff()
         if refresh_key == self.last_refresh_key:
             self.progress("Unchanged. ")
@@ -4442,23 +6415,123 @@ class Display:
         self.ready_queue.get()
 
 
-def main_late() -> None:
-    assert parser is not None, "set by main_early"
-    args = parser.parse_args()
+# ==== LIBRARY API ====
 
-    import diff_settings
 
-    # Apply project-specific configuration.
-    settings: Dict[str, Any] = {}
-    diff_settings.apply(settings, args)  # type: ignore
-    project = create_project_settings(settings)
+def make_config(arch: str = "mips", **overrides: Any) -> Config:
+    """
+    Create a Config with the same defaults as the command line has with -o,
+    for using diff.py as a library. Keyword arguments override Config fields
+    and score options, e.g. `make_config("mips", ignore_addr_diffs=True)`.
+    """
+    arch_settings = get_arch(arch)
+    config = Config(
+        arch=arch_settings,
+        diff_obj=True,
+        file=None,
+        ref_file=None,
+        make=False,
+        source_old_binutils=False,
+        diff_section=".text",
+        inlines=False,
+        max_function_size_lines=1024,
+        max_function_size_bytes=1024 * 4,
+        formatter=JsonFormatter(arch_str=arch_settings.name),
+        diff_mode=DiffMode.NORMAL,
+        base_shift=0,
+        skip_lines=0,
+        compress=None,
+        show_rodata_refs=True,
+        show_branches=True,
+        show_line_numbers=False,
+        show_source=False,
+        stop_at_ret=None,
+        ignore_large_imms=False,
+        ignore_addr_diffs=False,
+        algorithm="levenshtein",
+        reg_categories={},
+        diff_function_symbols=False,
+    )
+    field_names = {f.name for f in fields(Config)}
+    config = replace(config, **{k: v for k, v in overrides.items() if k in field_names})
+    for key, value in overrides.items():
+        if key in field_names:
+            continue
+        if not key.startswith(("penalty_", "score_")) or not hasattr(Config, key):
+            raise TypeError(f"Unknown config option: {key}")
+        setattr(config, key, value)
+    return config
+
+
+def disassemble_object(
+    data: bytes,
+    fn_name: str,
+    config: Config,
+    *,
+    objdump_executable: Optional[str] = None,
+) -> AsmDump:
+    """
+    Disassemble the function `fn_name` from the contents of an object file,
+    the way -o does, into a dump for `diff_dumps`. str() of the dump gives its
+    text form, as written by --write-asm.
+    """
+    import tempfile
+
+    project = create_project_settings(
+        {"arch": config.arch.name, "objdump_executable": objdump_executable}
+    )
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "object.o")
+        with open(path, "wb") as f:
+            f.write(data)
+        cmd: ObjdumpCommand = (objfile_objdump_flags(config, project), path, None)
+        out = run_objdump_raw(cmd, config, project)
+    code = lean_dump_bytes(data, cmd[0], path, config)
+    return preprocess_objdump_out(fn_name, data, out, config, code)
+
+
+@dataclass
+class DiffResult:
+    current_score: int
+    max_score: int
+    # Rows in the format of --format=json
+    rows: List[Dict[str, Any]]
+
+
+def diff_dumps(
+    base: Union[str, AsmDump, List[Line]],
+    current: Union[str, AsmDump, List[Line]],
+    config: Config,
+) -> DiffResult:
+    """
+    Diff two dumps, as produced by `disassemble_object` or --write-asm.
+    Either side can instead be a list of lines from `process(dump, config)`.
+    Processing the base once and passing the result lets many diffs against
+    the same base skip that work; the lists are not modified.
+    """
+    base_lines = base if isinstance(base, list) else process(base, config)
+    if not isinstance(current, list):
+        my_lines = process(current, config)
+    else:
+        # do_diff rewrites branch targets of its second list in place
+        my_lines = [replace(line) for line in current]
+    diff_output = do_diff(base_lines, my_lines, config)
+    data = align_diffs(diff_output, diff_output, config)
+    output = PythonFormatter(arch_str=config.arch.name).raw(data)
+    return DiffResult(
+        current_score=diff_output.score,
+        max_score=diff_output.max_score,
+        rows=output["rows"],
+    )
+
 
+def create_checked_config(args: argparse.Namespace, project: ProjectSettings) -> Config:
     try:
         config = create_config(args, project)
     except ValueError as e:
         fail(str(e))
 
-    if config.algorithm == "levenshtein":
+    if config.algorithm in ("levenshtein", "blocks"):
         try:
             import Levenshtein
         except ModuleNotFoundError as e:
@@ -4476,6 +6549,15 @@ def main_late() -> None:
     ):
         fail("Threeway diffing requires -w.")
 
+    return config
+
+
+def dump_commands(
+    args: argparse.Namespace, config: Config, project: ProjectSettings
+) -> Tuple[str, ObjdumpCommand, ObjdumpCommand]:
+    if args.start is None:
+        fail("Missing function name or address to start diffing from.")
+
     if args.diff_elf_symbol:
         make_target, basecmd, mycmd = dump_elf(
             args.start, args.end, args.diff_elf_symbol, config, project
@@ -4487,17 +6569,672 @@ def main_late() -> None:
     else:
         make_target, basecmd, mycmd = dump_binary(args.start, args.end, config, project)
 
+    import diff_settings
+
     map_build_target_fn = getattr(diff_settings, "map_build_target", None)
     if map_build_target_fn:
         make_target = map_build_target_fn(make_target=make_target)
 
+    return make_target, basecmd, mycmd
+
+
+def file_stamp(path: str) -> Optional[Tuple[int, int]]:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+def write_cache_file(path: str, data: object, **json_options: Any) -> None:
+    """Write data as JSON to a file in the cache directory, atomically. The
+    cache is only there to save work, so failing to write it isn't an error."""
+    import json
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, **json_options)
+        os.replace(tmp_path, path)
+    except OSError:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+
+def process_cache_key(config: Config) -> Tuple[object, ...]:
+    """The options that processing a dump, from objdump to process(), depends
+    on, beyond the objdump command itself."""
+    return (
+        config.arch.name,
+        config.diff_obj,
+        config.diff_section,
+        config.max_function_size_lines,
+        config.diff_function_symbols,
+        config.stop_at_ret,
+        config.show_rodata_refs,
+        config.ignore_large_imms,
+        config.ignore_addr_diffs,
+        config.score_stack_differences,
+        config.lean_dump,
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def script_hash() -> str:
+    with open(__file__, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+LINE_FIELDS = [f.name for f in fields(Line)]
+
+
+def serialize_lines(lines: List[Line]) -> List[List[Any]]:
+    """Lines as lists of field values, in the order of LINE_FIELDS."""
+    return [
+        [
+            (
+                [astuple(reloc) for reloc in line.relocs]
+                if name == "relocs"
+                else getattr(line, name)
+            )
+            for name in LINE_FIELDS
+        ]
+        for line in lines
+    ]
+
+
+def deserialize_lines(rows: List[List[Any]]) -> List[Line]:
+    relocs_index = LINE_FIELDS.index("relocs")
+    lines = []
+    for row in rows:
+        row[relocs_index] = tuple(Relocation(*reloc) for reloc in row[relocs_index])
+        lines.append(Line(*row))
+    return lines
+
+
+def process_with_cache(
+    dump: Union[str, AsmDump], config: Config, project: ProjectSettings
+) -> List[Line]:
+    """process() a dump, reusing the lines from an earlier run if the dump and
+    the options that processing depends on are unchanged. Used for the base
+    dump when the cache_base_lines setting is on; the lines are kept in the
+    cache directory, keyed by a hash of the dump text."""
+    import json
+
+    if not project.cache_base_lines:
+        return process(dump, config)
+    key = (script_hash(), str(dump), process_cache_key(config))
+    cache_path = os.path.join(
+        project.cache_dir,
+        f"base-lines-{hashlib.sha1(repr(key).encode()).hexdigest()}.json",
+    )
+    try:
+        with open(cache_path, encoding="utf-8") as f:
+            data = json.load(f)
+        if data["fields"] == LINE_FIELDS:
+            return deserialize_lines(data["lines"])
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    lines = process(dump, config)
+    write_cache_file(
+        cache_path,
+        {"fields": LINE_FIELDS, "lines": serialize_lines(lines)},
+        separators=(",", ":"),
+    )
+    return lines
+
+
+def batch_objects(
+    source: str, config: Config, project: ProjectSettings
+) -> Dict[str, Optional[List[str]]]:
+    """Map each object file to the functions of it to diff, or None for all
+    of them."""
+    if source == "map":
+        if not project.mapfile:
+            fail("No map file configured; cannot list functions.")
+        if project.map_format != "gnu":
+            fail("--batch map is only supported for GNU map files.")
+        try:
+            map_file = load_map_file(project.mapfile)
+        except Exception:
+            fail(f"Failed to open map file {project.mapfile} for reading.")
+        return {obj: None for obj in map_file.gnu_object_files(config.diff_section)}
+
+    try:
+        with open(source, "rb") as f:
+            data = f.read()
+    except OSError as e:
+        fail(f"Failed to read {source}: {e}")
+    if data[:4] == b"\x7fELF":
+        return {source: None}
+
+    ret: Dict[str, Optional[List[str]]] = {}
+    for fn_name in data.decode("utf-8", "replace").split():
+        objfile = config.file
+        if not objfile:
+            objfile, _ = search_map_file(fn_name, project, config, for_binary=False)
+        if not objfile:
+            fail(f"Not able to find .o file for function {fn_name}.")
+        fns = ret.setdefault(objfile, [])
+        assert fns is not None
+        fns.append(fn_name)
+    return ret
+
+
+# (function name, object file, preprocessed base dump, preprocessed current dump),
+# where the dumps come with their instruction bytes from preprocess_function_dump
+BatchTask = Tuple[
+    str,
+    str,
+    Tuple[str, Optional[InstructionBytes]],
+    Tuple[str, Optional[InstructionBytes]],
+]
+
+_batch_config: Optional[Config] = None
+
+
+def init_batch_worker(config: Config) -> None:
+    global _batch_config
+    _batch_config = config
+
+
+def score_batch_task(task: BatchTask) -> Dict[str, Any]:
+    config = _batch_config
+    assert config is not None, "set by init_batch_worker"
+    fn_name, objfile, (basedump, basecode), (mydump, mycode) = task
+    diff_output = do_diff(
+        process(parse_dump(basedump, config, code=basecode), config),
+        process(parse_dump(mydump, config, code=mycode), config),
+        config,
+    )
+    return {
+        "function": fn_name,
+        "object": objfile,
+        "current_score": diff_output.score,
+        "max_score": diff_output.max_score,
+    }
+
+
+def batch_commands(
+    objfile: str, refobjfile: str, config: Config, project: ProjectSettings
+) -> Tuple[ObjdumpCommand, ObjdumpCommand]:
+    objdump_flags = objfile_objdump_flags(config, project)
+    return (
+        (objdump_flags, refobjfile, None),
+        (objdump_flags + maybe_get_objdump_source_flags(config), objfile, None),
+    )
+
+
+def report_missing_function(
+    objfile: str, fn_name: str, functions: Collection[str]
+) -> bool:
+    """Tell the user if a function asked for with --batch isn't in its object,
+    and return whether it's missing."""
+    if fn_name in functions:
+        return False
+    print(f"Skipping {fn_name}: not found in {objfile}.", file=sys.stderr)
+    return True
+
+
+def batch_tasks(
+    objfile: str,
+    basecmd: ObjdumpCommand,
+    mycmd: ObjdumpCommand,
+    fn_names: Optional[List[str]],
+    config: Config,
+    project: ProjectSettings,
+) -> List[BatchTask]:
+    dumps = []
+    for cmd in (basecmd, mycmd):
+        with open(cmd[1], "rb") as f:
+            obj_data = f.read()
+        code = lean_dump_bytes(obj_data, cmd[0], cmd[1], config)
+        out = run_objdump_raw(cmd, config, project)
+        rodata_refs = ""
+        if config.show_rodata_refs:
+            rodata_refs = serialize_rodata_references(
+                parse_elf_rodata_references(obj_data, config)
+            )
+        functions = split_objdump_functions(
+            decode_objdump_out(out),
+            set(elf_function_names(obj_data, config.diff_section)),
+        )
+        dumps.append((functions, rodata_refs, code))
+        if cmd is mycmd and fn_names is None:
+            fn_names = list(functions)
+
+    assert fn_names is not None
+    (base_functions, base_refs, base_code), (my_functions, my_refs, my_code) = dumps
+    fn_names = [
+        fn_name
+        for fn_name in fn_names
+        if not report_missing_function(objfile, fn_name, my_functions)
+    ]
+    return [
+        (
+            fn_name,
+            objfile,
+            preprocess_function_dump(
+                base_functions.get(fn_name, ""), base_refs, config, base_code
+            ),
+            preprocess_function_dump(
+                my_functions.get(fn_name, ""), my_refs, config, my_code
+            ),
+        )
+        for fn_name in fn_names
+    ]
+
+
+def score_config_key(config: Config, project: ProjectSettings) -> str:
+    """Identifies everything besides the object files that a --batch score
+    depends on, including diff.py itself."""
+    key = (
+        script_hash(),
+        project.objdump_executable,
+        project.objdump_flags,
+        objfile_objdump_flags(config, project),
+        maybe_get_objdump_source_flags(config),
+        process_cache_key(config),
+        config.algorithm,
+        config.score_stack_differences,
+        config.penalty_stackdiff,
+        config.penalty_regalloc,
+        config.penalty_reordering,
+        config.penalty_insertion,
+        config.penalty_deletion,
+    )
+    return hashlib.sha1(repr(key).encode()).hexdigest()
+
+
+class ScoreStore:
+    """Per-function scores from earlier --batch runs, in an sqlite database.
+    The scores of an object are reused as long as the object, its reference
+    object and the scoring configuration are unchanged."""
+
+    def __init__(self, path: str) -> None:
+        import sqlite3
+
+        self.db = sqlite3.connect(path)
+        self.db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS objects (
+                object TEXT NOT NULL,
+                config_key TEXT NOT NULL,
+                object_hash TEXT NOT NULL,
+                ref_hash TEXT NOT NULL,
+                PRIMARY KEY (object, config_key)
+            );
+            CREATE TABLE IF NOT EXISTS scores (
+                object TEXT NOT NULL,
+                config_key TEXT NOT NULL,
+                function TEXT NOT NULL,
+                current_score INTEGER NOT NULL,
+                max_score INTEGER NOT NULL,
+                PRIMARY KEY (object, config_key, function)
+            );
+            """
+        )
+
+    def get(
+        self, objfile: str, config_key: str, object_hash: str, ref_hash: str
+    ) -> Optional[List[Dict[str, Any]]]:
+        found = self.db.execute(
+            "SELECT 1 FROM objects WHERE object = ? AND config_key = ? "
+            "AND object_hash = ? AND ref_hash = ?",
+            (objfile, config_key, object_hash, ref_hash),
+        ).fetchone()
+        if found is None:
+            return None
+        return [
+            {
+                "function": function,
+                "object": objfile,
+                "current_score": current_score,
+                "max_score": max_score,
+            }
+            for function, current_score, max_score in self.db.execute(
+                "SELECT function, current_score, max_score FROM scores "
+                "WHERE object = ? AND config_key = ? ORDER BY rowid",
+                (objfile, config_key),
+            )
+        ]
+
+    def put(
+        self,
+        objfile: str,
+        config_key: str,
+        object_hash: str,
+        ref_hash: str,
+        rows: List[Dict[str, Any]],
+    ) -> None:
+        with self.db:
+            self.db.execute(
+                "DELETE FROM scores WHERE object = ? AND config_key = ?",
+                (objfile, config_key),
+            )
+            self.db.executemany(
+                "INSERT INTO scores VALUES (?, ?, ?, ?, ?)",
+                [
+                    (
+                        objfile,
+                        config_key,
+                        row["function"],
+                        row["current_score"],
+                        row["max_score"],
+                    )
+                    for row in rows
+                ],
+            )
+            self.db.execute(
+                "INSERT OR REPLACE INTO objects VALUES (?, ?, ?, ?)",
+                (objfile, config_key, object_hash, ref_hash),
+            )
+
+    def close(self) -> None:
+        self.db.close()
+
+
+def run_batch(
+    args: argparse.Namespace, config: Config, project: ProjectSettings
+) -> None:
+    if args.start is not None:
+        fail("--batch does not take a function name or address.")
+    if not config.diff_obj:
+        fail("--batch requires -o.")
+    if args.watch:
+        fail("--batch does not support -w.")
+
+    objects = batch_objects(args.batch, config, project)
+    if len(objects) != 1 and config.ref_file:
+        fail("--ref-file can only be used with --batch on a single object.")
+
+    store = ScoreStore(args.score_store) if args.score_store else None
+    config_key = score_config_key(config, project) if store else ""
+    rows = []
+    tasks = []
+    # Objects that are diffed anew, with the hashes to record them under
+    to_store: Dict[str, Tuple[str, str]] = {}
+    for objfile, fn_names in objects.items():
+        if config.make:
+            run_make(objfile, project)
+        if not os.path.isfile(objfile):
+            print(f"Skipping {objfile}: not a file.", file=sys.stderr)
+            continue
+        refobjfile = config.ref_file or os.path.join(project.expected_dir, objfile)
+        if not os.path.isfile(refobjfile):
+            print(
+                f"Skipping {objfile}: no reference object {refobjfile}.",
+                file=sys.stderr,
+            )
+            continue
+        basecmd, mycmd = batch_commands(objfile, refobjfile, config, project)
+        if store is None:
+            tasks.extend(
+                batch_tasks(objfile, basecmd, mycmd, fn_names, config, project)
+            )
+            continue
+
+        object_hash = (hash_objdump_target(mycmd) or b"").hex()
+        ref_hash = (hash_objdump_target(basecmd) or b"").hex()
+        stored = store.get(objfile, config_key, object_hash, ref_hash)
+        if stored is not None:
+            rows.extend(stored)
+        else:
+            # Score all functions, so that the stored scores are complete.
+            to_store[objfile] = (object_hash, ref_hash)
+            tasks.extend(batch_tasks(objfile, basecmd, mycmd, None, config, project))
+
+    jobs = args.jobs or os.cpu_count() or 1
+    if jobs > 1 and len(tasks) > 1:
+        import concurrent.futures
+
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=jobs, initializer=init_batch_worker, initargs=(config,)
+        ) as executor:
+            chunksize = max(1, len(tasks) // (jobs * 4))
+            new_rows = list(executor.map(score_batch_task, tasks, chunksize=chunksize))
+    else:
+        init_batch_worker(config)
+        new_rows = [score_batch_task(task) for task in tasks]
+    rows.extend(new_rows)
+
+    if store is not None:
+        for objfile, (object_hash, ref_hash) in to_store.items():
+            obj_rows = [row for row in new_rows if row["object"] == objfile]
+            store.put(objfile, config_key, object_hash, ref_hash, obj_rows)
+        store.close()
+        # Everything was scored to be stored; only list what was asked for.
+        scored: Dict[str, Set[str]] = {}
+        for row in rows:
+            scored.setdefault(row["object"], set()).add(row["function"])
+        for objfile, fn_names in objects.items():
+            if fn_names is not None and objfile in scored:
+                for fn_name in fn_names:
+                    report_missing_function(objfile, fn_name, scored[objfile])
+        wanted_rows = []
+        for row in rows:
+            fn_names = objects[row["object"]]
+            if fn_names is None or row["function"] in fn_names:
+                wanted_rows.append(row)
+        rows = wanted_rows
+
+    rows.sort(key=lambda row: (-row["current_score"], row["function"]))
+    if args.top is not None:
+        rows = rows[: args.top]
+
+    if args.format == "json":
+        import json
+
+        print(json.dumps(rows))
+    else:
+        import csv
+
+        writer = csv.DictWriter(
+            sys.stdout, fieldnames=["function", "object", "current_score", "max_score"]
+        )
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+class DiffDaemon:
+    """Answers requests from `--connect` clients (see `--serve`), one at a time.
+    Project settings, map files and processed reference assembly are kept in
+    memory between requests; reference assembly is redone when the reference
+    file changes on disk."""
+
+    BASE_CACHE_SIZE = 256
+
+    def __init__(self, cwd: str) -> None:
+        self.cwd = cwd
+        self.projects: Dict[str, ProjectSettings] = {}
+        self.base_lines: "OrderedDict[Tuple[object, ...], List[Line]]" = OrderedDict()
+
+    def project_settings(self, settings: Dict[str, Any]) -> ProjectSettings:
+        key = repr(sorted(settings.items()))
+        project = self.projects.get(key)
+        if project is None:
+            project = create_project_settings(settings)
+            self.projects[key] = project
+        return project
+
+    def get_base_lines(
+        self,
+        args: argparse.Namespace,
+        config: Config,
+        project: ProjectSettings,
+        basecmd: ObjdumpCommand,
+    ) -> List[Line]:
+        if args.base_asm is not None:
+            path = args.base_asm
+            key: Tuple[object, ...] = (path,)
+        elif config.diff_mode != DiffMode.SINGLE:
+            path = basecmd[1]
+            key = (
+                project.objdump_executable,
+                tuple(project.objdump_flags),
+                tuple(basecmd[0]),
+                basecmd[1],
+                basecmd[2],
+            )
+        else:
+            return []
+
+        stamp = file_stamp(path)
+        key += (stamp,) + process_cache_key(config)
+        # do_diff retargets branches in its second list in place, so lines that
+        # get diffed against themselves must not be shared.
+        cacheable = stamp is not None and config.diff_mode != DiffMode.SINGLE_BASE
+        if cacheable and key in self.base_lines:
+            self.base_lines.move_to_end(key)
+            return self.base_lines[key]
+
+        basedump: Union[str, AsmDump]
+        if args.base_asm is not None:
+            with open(path) as f:
+                basedump = f.read()
+        else:
+            basedump = run_objdump(basecmd, config, project)
+        lines = process_with_cache(basedump, config, project)
+        if cacheable:
+            self.base_lines[key] = lines
+            if len(self.base_lines) > self.BASE_CACHE_SIZE:
+                self.base_lines.popitem(last=False)
+        return lines
+
+    def diff(self, argv: List[str]) -> Optional[Diff]:
+        assert parser is not None, "set by main_early"
+        args = parser.parse_args(argv)
+        if args.watch:
+            fail("The diff daemon does not support -w.")
+        if args.serve:
+            fail("Already serving.")
+        with timing_session(args):
+            return self.run(args)
+
+    def run(self, args: argparse.Namespace) -> Optional[Diff]:
+        import diff_settings
+
+        settings: Dict[str, Any] = {}
+        diff_settings.apply(settings, args)  # type: ignore
+        project = self.project_settings(settings)
+        config = create_checked_config(args, project)
+        if args.batch is not None:
+            run_batch(args, config, project)
+            return None
+        make_target, basecmd, mycmd = dump_commands(args, config, project)
+
+        mydump = run_objdump(mycmd, config, project)
+        if args.write_asm is not None:
+            with open(args.write_asm, "w") as f:
+                f.write(str(mydump))
+            print(f"Wrote assembly to {args.write_asm}.")
+            return None
+
+        base_lines = self.get_base_lines(args, config, project, basecmd)
+        display = Display("", mydump, config, base_lines=base_lines)
+        print(display.run_diff()[0])
+        return display.last_diff_output
+
+    def handle(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        out = io.StringIO()
+        err = io.StringIO()
+        status = 0
+        diff_output = None
+        with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+            try:
+                if request.get("cwd") != self.cwd:
+                    fail(
+                        f"The diff daemon serves {self.cwd}, "
+                        f"not {request.get('cwd')}."
+                    )
+                diff_output = self.diff(request["argv"])
+            except SystemExit as e:
+                if isinstance(e.code, int):
+                    status = e.code
+                elif e.code is not None:
+                    print(e.code, file=sys.stderr)
+                    status = 1
+            except Exception:
+                import traceback
+
+                traceback.print_exc()
+                status = 1
+        return {
+            "status": status,
+            "stdout": out.getvalue(),
+            "stderr": err.getvalue(),
+            "current_score": diff_output.score if diff_output else None,
+            "max_score": diff_output.max_score if diff_output else None,
+        }
+
+
+def run_daemon(socket_path: str) -> None:
+    import json
+    import socketserver
+
+    if os.path.exists(socket_path):
+        if not stat.S_ISSOCK(os.stat(socket_path).st_mode):
+            fail(f"{socket_path} exists and is not a socket.")
+        os.unlink(socket_path)
+
+    daemon = DiffDaemon(os.getcwd())
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self) -> None:
+            try:
+                request = json.loads(self.rfile.read())
+            except ValueError:
+                return
+            response = daemon.handle(request)
+            self.wfile.write(json.dumps(response).encode())
+
+    with socketserver.UnixStreamServer(socket_path, Handler) as server:
+        print(f"Serving diffs for {os.getcwd()} on {socket_path}.")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            os.unlink(socket_path)
+
+
+def main_late() -> None:
+    assert parser is not None, "set by main_early"
+    args = parser.parse_args()
+    with timing_session(args):
+        run_main(args)
+
+
+def run_main(args: argparse.Namespace) -> None:
+    import diff_settings
+
+    if args.serve:
+        if args.start is not None:
+            fail("--serve does not take a function name or address.")
+        run_daemon(args.serve)
+        return
+
+    # Apply project-specific configuration.
+    settings: Dict[str, Any] = {}
+    diff_settings.apply(settings, args)  # type: ignore
+    project = create_project_settings(settings)
+    config = create_checked_config(args, project)
+    if args.batch is not None:
+        run_batch(args, config, project)
+        return
+    make_target, basecmd, mycmd = dump_commands(args, config, project)
+
     if args.write_asm is not None:
         mydump = run_objdump(mycmd, config, project)
         with open(args.write_asm, "w") as f:
-            f.write(mydump)
+            f.write(str(mydump))
         print(f"Wrote assembly to {args.write_asm}.")
         sys.exit(0)
 
+    basedump: Union[str, AsmDump]
     if args.base_asm is not None:
         with open(args.base_asm) as f:
             basedump = f.read()
@@ -4506,9 +7243,13 @@ def main_late() -> None:
     else:
         basedump = ""
 
+    last_obj_hash = hash_objdump_target(mycmd)
     mydump = run_objdump(mycmd, config, project)
 
-    display = Display(basedump, mydump, config)
+    base_lines = None
+    if config.diff_mode != DiffMode.SINGLE:
+        base_lines = process_with_cache(basedump, config, project)
+    display = Display(basedump, mydump, config, base_lines=base_lines)
 
     if args.no_pager or args.format in ("html", "json"):
         print(display.run_diff()[0])
@@ -4522,6 +7263,18 @@ def main_late() -> None:
             )
             if yn.lower() == "n":
                 return
+        depfile: Optional[str] = None
+        depfile_sources: Optional[List[str]] = None
+        if args.watch_depfile:
+            if not args.make:
+                fail("--watch-depfile requires -m.")
+            depfile_for_target_fn = getattr(diff_settings, "depfile_for_target", None)
+            if depfile_for_target_fn:
+                depfile = depfile_for_target_fn(mycmd[1])
+            else:
+                depfile = os.path.splitext(mycmd[1])[0] + ".d"
+            assert depfile is not None
+            depfile_sources = read_depfile(depfile)
         if args.make:
             watch_sources = None
             watch_sources_for_target_fn = getattr(
@@ -4530,12 +7283,39 @@ def main_late() -> None:
             if watch_sources_for_target_fn:
                 watch_sources = watch_sources_for_target_fn(make_target)
             watch_sources = watch_sources or project.source_directories
-            if not watch_sources:
+            if not watch_sources and not depfile_sources:
                 fail("Missing source_directories config, don't know what to watch.")
         else:
             watch_sources = [make_target]
+        compile_command: Optional[CompileCommand] = None
+        if args.direct_compile:
+            if not args.make:
+                fail("--direct-compile requires -m.")
+            compile_command_for_target_fn = getattr(
+                diff_settings, "compile_command_for_target", None
+            )
+            if compile_command_for_target_fn:
+                arguments = compile_command_for_target_fn(mycmd[1])
+                if arguments:
+                    compile_command = CompileCommand(directory=".", arguments=arguments)
+            if compile_command is None:
+                compile_command = find_compile_command(mycmd[1], project)
         q: "queue.Queue[Optional[float]]" = queue.Queue()
-        debounced_fs_watch(watch_sources, q, config, project)
+        debouncer = Debouncer()
+        if depfile_sources:
+            set_watch_targets = debounced_fs_watch(
+                depfile_sources,
+                q,
+                config,
+                project,
+                match_source_extensions=False,
+                debouncer=debouncer,
+            )
+        else:
+            assert watch_sources
+            set_watch_targets = debounced_fs_watch(
+                watch_sources, q, config, project, debouncer=debouncer
+            )
         display.run_async(q)
         last_build = 0.0
         try:
@@ -4546,9 +7326,17 @@ def main_late() -> None:
                 if t < last_build:
                     continue
                 last_build = time.time()
+                if _timings is not None:
+                    _timings.add("debounce", debouncer.last_delay)
                 if args.make:
-                    display.progress("Building...")
-                    ret = run_make_capture_output(make_target, project)
+                    display.progress(
+                        f"Building... (waited {debouncer.last_delay * 1000:.0f} ms)"
+                    )
+                    if compile_command is not None:
+                        ret = run_compile_capture_output(compile_command)
+                    else:
+                        ret = run_make_capture_output(make_target, project)
+                    debouncer.record_build(time.time() - last_build)
                     if ret.returncode != 0:
                         display.update(
                             ret.stderr.decode("utf-8-sig", "replace")
@@ -4556,6 +7344,22 @@ def main_late() -> None:
                             error=True,
                         )
                         continue
+                    if depfile is not None:
+                        depfile_sources = read_depfile(depfile)
+                        if depfile_sources:
+                            set_watch_targets(depfile_sources, False)
+                # With --source, objdump output also depends on the source
+                # files themselves, so we can't skip based on the object alone.
+                obj_hash = hash_objdump_target(mycmd)
+                if (
+                    obj_hash is not None
+                    and obj_hash == last_obj_hash
+                    and display.emsg is None
+                    and not config.show_source
+                ):
+                    display.progress("Unchanged. ")
+                    continue
+                last_obj_hash = obj_hash
                 mydump = run_objdump(mycmd, config, project)
                 display.update(mydump, error=False)
         except KeyboardInterrupt:
@@ -10,3 +10,7 @@ def apply(config, args):
     # config["expected_dir"] = "expected/" # needed for -o
     # config["makeflags"] = []
     # config["objdump_executable"] = ""
+    # config["compile_commands"] = "compile_commands.json" # used by --direct-compile
+    # config["base_code_range"] = (0x1000, 0x100000) # binary mode: disassemble this part of baseimg once, and slice functions out of it
+    # config["cache_dir"] = ".asm-differ-cache/" # where that disassembly is kept
+    # config["cache_base_lines"] = False # keep processed base dumps in cache_dir too
@@ -1,6 +1,16 @@
 import unittest
+import argparse
+import contextlib
+import corpus
+import dataclasses
 import diff
+import io
 import json
+import os
+import struct
+import sys
+import tempfile
+from typing import List, Tuple
 
 
 class TestSh2(unittest.TestCase):
@@ -409,5 +419,528 @@ class TestSh4(unittest.TestCase):
             i += 1
 
 
+class TestArm32(unittest.TestCase):
+    def test_arm32_switch(self) -> None:
+        # The number of jump table entries comes from the most recent cmp with
+        # a non-zero immediate.
+        objdump_raw = "00000000 <f>:\n   0:\t2902      \tcmp\tr1, #2\n   2:\t2800      \tcmp\tr0, #0\n   4:\td805      \tbhi.n\t12 <f+0x12>\n   6:\t4487      \tadd\tpc, r0\n   8:\t0002      \t.short\t0x0002\n   a:\t0004      \t.short\t0x0004\n   c:\t0006      \t.short\t0x0006\n   e:\t2001      \tmovs\tr0, #1\n  10:\t4770      \tbx\tlr"
+
+        config = diff.make_config("arm32")
+        processor = config.arch.proc(config)
+        lines = processor.preprocess_objdump(objdump_raw).splitlines()
+
+        self.assertEqual(
+            lines[5:9],
+            [
+                "  8:\t0002      \t.short\t0x0002  ; 0xc",
+                "  a:\t0004      \t.short\t0x0004  ; 0xe",
+                "  c:\t0006      \t.short\t0x0006  ; 0x10",
+                "   e:\t2001      \tmovs\tr0, #1",
+            ],
+        )
+
+        # Rewritten lines come out as rows, the same as parsing their text
+        rows = diff.parse_dump_lines(
+            processor.preprocess_objdump_lines(objdump_raw), config
+        ).rows
+        assert isinstance(
+            processor.preprocess_objdump_lines(objdump_raw)[5], diff.DumpRow
+        )
+        assert rows == diff.parse_dump("\n".join(lines), config).rows
+
+
+class TestMemory(unittest.TestCase):
+    def test_memory_budget(self) -> None:
+        dump = (
+            "func():\n"
+            "src/func.c:3\n"
+            "   0:\t00 0b       \trts\t\n"
+            "   2:\t00 09       \tnop\t\n"
+        )
+        config = diff.make_config("sh2", show_source=True)
+        display = diff.Display(dump, dump, config)
+        rows = json.loads(display.run_diff()[0])["rows"]
+        assert rows[0]["base"]["src"] == ["func():", "src/func.c:3"]
+
+        config = diff.make_config("sh2", show_source=True, memory_budget=1000)
+        display = diff.Display(dump, dump, config)
+        rows = json.loads(display.run_diff()[0])["rows"]
+        assert "src" not in rows[0]["base"]
+        assert [row["base"]["text"] for row in rows] == [
+            [{"text": "0:    rts     "}],
+            [{"text": "2:    nop     "}],
+        ]
+
+        # A threeway base diff that doesn't fit isn't silently replaced
+        config = diff.make_config(
+            "sh2", memory_budget=10, diff_mode=diff.DiffMode.THREEWAY_BASE
+        )
+        config.formatter = diff.PlainFormatter(column_width=40)
+        display = diff.Display(dump, dump, config)
+        for _ in range(2):
+            output = display.run_diff()[0]
+            assert "PREVIOUS (dropped for --memory-budget)" in output
+            assert display.last_diff_output is None
+
+        # Nor does a later diff that fits take the place of a dropped base
+        display = diff.Display(
+            dump, dump, dataclasses.replace(config, memory_budget=None)
+        )
+        display.run_diff()
+        assert display.last_diff_output is not None
+        for budget in [10, 10**9]:
+            display.config = dataclasses.replace(config, memory_budget=budget)
+            output = display.run_diff()[0]
+            assert "PREVIOUS (dropped for --memory-budget)" in output
+            assert display.last_diff_output is None
+
+
+class TestWatch(unittest.TestCase):
+    def test_parse_depfile(self) -> None:
+        # gcc -MMD -MP output, with an escaped space and a line continuation
+        depfile = (
+            "build/src/foo.o: src/foo.c include/my\\ header.h \\\n"
+            " include/common.h\n"
+            "\n"
+            "include/my\\ header.h:\n"
+            "\n"
+            "include/common.h:\n"
+        )
+        assert diff.parse_depfile(depfile) == [
+            "src/foo.c",
+            "include/my header.h",
+            "include/common.h",
+        ]
+
+
+class TestArguments(unittest.TestCase):
+    def test_report_files(self) -> None:
+        diff.main_early()
+        assert diff.parser is not None
+        args = diff.parser.parse_args(["--timings", "func_80001000"])
+        assert (args.start, args.timings, args.timings_out) == (
+            "func_80001000",
+            True,
+            None,
+        )
+        args = diff.parser.parse_args(["--timings-out", "t.json", "func_80001000"])
+        assert (args.start, args.timings_out) == ("func_80001000", "t.json")
+        args = diff.parser.parse_args(["--memory-report", "func_80001000"])
+        assert (args.start, args.memory_report) == ("func_80001000", True)
+
+
+class TestApi(unittest.TestCase):
+    def test_diff_dumps(self) -> None:
+        base = "   0:\t8d 02       \tbt.s\t4 <lab_0606B780>\n   2:\t6e f3       \tmov\tr15,r14\n   4:\t00 0b       \trts\t\n   6:\t00 09       \tnop\t"
+        current = base.replace(
+            "6e f3       \tmov\tr15,r14", "6d f3       \tmov\tr15,r13"
+        )
+        config = diff.make_config("sh2", ignore_addr_diffs=True)
+        base_lines = diff.process(base, config)
+
+        result = diff.diff_dumps(base_lines, base, config)
+        assert result.current_score == 0
+        assert [row["current"]["mnemonic"] for row in result.rows] == [
+            "bt.s",
+            "mov",
+            "rts",
+            "nop",
+        ]
+
+        result = diff.diff_dumps(base_lines, current, config)
+        assert result.current_score == config.penalty_regalloc
+        assert result.rows[1]["base"]["mnemonic"] == "mov"
+
+    def test_parse_dump(self) -> None:
+        text = "DATAREF 2 8 .rodata\n00000000 <f>:\nsrc/f.c:3\n   0:\t8d 02       \tbt.s\t4 <f+0x4>\n   2:\td0 01       \tmov.l\t8 <f+0x8>,r0\n\t\t\t2: R_SH_DIR8WPL\t.text+0x8"
+        config = diff.make_config("sh2")
+        dump = diff.parse_dump(text, config)
+        assert str(dump) == text
+        assert dump.data_refs == {2: {".rodata": [8]}}
+        assert [row.label for row in dump.rows] == ["f", None, None, None]
+        assert dump.rows[1].source_line_num == 3
+        insn = dump.rows[3]
+        assert (insn.addr, insn.raw_bytes, insn.mnemonic, insn.args) == (
+            2,
+            "d0 01",
+            "mov.l",
+            "8 ,r0",
+        )
+        assert insn.relocs == [diff.Relocation("R_SH_DIR8WPL", ".text", "+0x8")]
+        assert diff.process(dump, config) == diff.process(text, config)
+
+    def test_relocations(self) -> None:
+        reloc = diff.parse_reloc("\t\t\t8: R_MIPS_LO16\tD_80001000+0x10")
+        assert reloc == diff.Relocation("R_MIPS_LO16", "D_80001000", "+0x10")
+        processor = diff.AsmProcessorMIPS(diff.make_config("mips"))
+        assert processor.process_reloc(reloc, "lw\tv0,0(v0)") == (
+            "lw\tv0,%lo(D_80001000+0x10)(v0)",
+            "%lo(D_80001000+0x10)",
+        )
+
+        reloc = diff.parse_reloc("\t\t\t8: R_MIPS_TLS_GD\tfoo")
+        with self.assertRaises(diff.UnknownRelocationError) as cm:
+            processor.process_reloc(reloc, "addiu\ta0,gp,0")
+        assert cm.exception.reloc.type == "R_MIPS_TLS_GD"
+
+        # x86 drops positive addends of dir32 relocations, but not negative ones
+        x86_processor = diff.AsmProcessorX86(diff.make_config("x86"))
+        reloc = diff.Relocation("dir32", "_foo", "+0x4")
+        assert x86_processor.process_reloc(reloc, "mov 0x0,%eax")[1] == "_foo"
+        reloc = diff.Relocation("dir32", "_foo", "-0x4")
+        assert x86_processor.process_reloc(reloc, "mov 0x0,%eax")[1] == "_foo-0x4"
+
+    def test_same_encoding(self) -> None:
+        # Older binutils print this instruction as "or" rather than "move".
+        base = "   0:\t00a02025 \tmove\ta0,a1\n   4:\t03e00008 \tjr\tra\n   8:\t00000000 \tnop"
+        current = base.replace("move\ta0,a1", "or\ta0,a1,zero")
+        config = diff.make_config("mips")
+        result = diff.diff_dumps(base, current, config)
+        assert result.current_score == 0
+        assert result.rows[0]["current"]["text"] == [
+            {"text": "  0:    or      a0,a1,zero"}
+        ]
+
+        target = diff.PreparedTarget(base, config)
+        assert target.score(current) == 0
+        assert target.score(current, cutoff=0) == 0
+
+        current = current.replace("00a02025", "00a62025")
+        assert diff.diff_dumps(base, current, config).current_score > 0
+
+    def test_process_with_cache(self) -> None:
+        dump = "   0:\t3c020000 \tlui\tv0,0x0\n\t\t\t0: R_MIPS_HI16\tD_80001000\n   4:\t10400002 \tbeqz\tv0,10 <.L1>\n   8:\t00000000 \tnop\n   c:\t03e00008 \tjr\tra\n  10:\t00000000 \tnop"
+        config = diff.make_config("mips")
+        with tempfile.TemporaryDirectory() as tmpdir:
+            project = diff.create_project_settings(
+                {
+                    "objdump_executable": "objdump",
+                    "cache_dir": tmpdir,
+                    "cache_base_lines": True,
+                }
+            )
+            lines = diff.process(dump, config)
+            assert diff.process_with_cache(dump, config, project) == lines
+            assert len(os.listdir(tmpdir)) == 1
+            cached = diff.process_with_cache(dump, config, project)
+            assert cached == lines
+            assert cached[0].relocs == (diff.Relocation("R_MIPS_HI16", "D_80001000"),)
+
+            # An unusable cache directory only means no caching
+            project.cache_dir = os.path.join(tmpdir, os.listdir(tmpdir)[0], "cache")
+            assert diff.process_with_cache(dump, config, project) == lines
+
+    def test_diff_blocks(self) -> None:
+        base = "   0:\t3c020000 \tlui\tv0,0x0\n   4:\t10400002 \tbeqz\tv0,10 <.L1>\n   8:\t00000000 \tnop\n   c:\t03e00008 \tjr\tra\n  10:\t00000000 \tnop"
+        current = "   0:\t00000000 \tnop\n   4:\t3c020000 \tlui\tv0,0x0\n   8:\t10400002 \tbeqz\tv0,14 <.L1>\n   c:\t00000000 \tnop\n  10:\t03e00008 \tjr\tra\n  14:\t00000000 \tnop"
+        config = diff.make_config("mips", algorithm="blocks")
+        lines = diff.process(base, config)
+        assert diff.basic_block_starts(lines, config.arch) == [0, 3, 4]
+
+        result = diff.diff_dumps(base, current, config)
+        assert result.current_score == config.penalty_insertion
+        assert ["base" in row for row in result.rows] == [False] + [True] * 5
+        target = diff.PreparedTarget(base, config)
+        assert target.score(current) == result.current_score
+
+    def test_prepared_target(self) -> None:
+        base = "   0:\t8d 02       \tbt.s\t8 <lab_0606B780>\n   2:\t6e f3       \tmov\tr15,r14\n   4:\ta0 01       \tbra\ta <lab_0606B8E0>\n   6:\t00 09       \tnop\t\n   8:\tdb 32       \tmov.l\td4 <lab_0606B8E0+0xca>,r11\n   a:\t00 0b       \trts\t\n   c:\t00 09       \tnop\t"
+        config = diff.make_config("sh2")
+        target = diff.PreparedTarget(base, config)
+        lines = base.split("\n")
+        candidates = [
+            base,
+            "\n".join(lines[1:]),
+            "\n".join([lines[1], lines[0]] + lines[2:]),
+            base.replace("6e f3       \tmov\tr15,r14", "6f e3       \tmov\tr14,r15"),
+        ]
+        for candidate in candidates:
+            expected = diff.do_diff(
+                diff.process(base, config), diff.process(candidate, config), config
+            ).score
+            assert target.score(candidate) == expected
+            assert target.score(candidate, cutoff=expected) == expected
+            if expected > 0:
+                assert target.score(candidate, cutoff=expected - 1) > expected - 1
+
+
+class TestDaemon(unittest.TestCase):
+    def test_base_lines(self) -> None:
+        dump = "   0:\t27bdffe8 \taddiu\tsp,sp,-24\n   4:\t8fbf0014 \tlw\tra,20(sp)"
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "base.s")
+            with open(path, "w") as f:
+                f.write(dump)
+            daemon = diff.DiffDaemon(tmpdir)
+            args = argparse.Namespace(base_asm=path)
+            project = diff.create_project_settings({"objdump_executable": "objdump"})
+            basecmd: diff.ObjdumpCommand = ([], path, None)
+            config = diff.make_config("mips")
+            lines = daemon.get_base_lines(args, config, project, basecmd)
+            assert daemon.get_base_lines(args, config, project, basecmd) is lines
+
+            # Lines processed with other options aren't reused
+            config = diff.make_config("mips", score_stack_differences=False)
+            lines = daemon.get_base_lines(args, config, project, basecmd)
+            assert lines[1].scorable_line == "lw\tra,addr(sp)"
+
+    def test_make_output(self) -> None:
+        # Build output reaches the client along with the diff
+        script = "import sys; print('compiling', sys.argv[1]); sys.exit('error')"
+        project = diff.create_project_settings(
+            {
+                "objdump_executable": "objdump",
+                "make_command": [sys.executable, "-c", script],
+            }
+        )
+        out = io.StringIO()
+        err = io.StringIO()
+        with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+            with self.assertRaises(SystemExit):
+                diff.run_make("a.o", project)
+        assert out.getvalue().strip() == "compiling a.o"
+        assert err.getvalue().splitlines() == [
+            "error",
+            "Building a.o failed with exit code 1.",
+        ]
+
+
+class TestMapFile(unittest.TestCase):
+    def test_gnu_index(self) -> None:
+        map_file = diff.MapFile(
+            " .text          0x80000400     0x1000 build/src/a.o\n"
+            "                0x80000400                func_a\n"
+            "                0x80000480                func_b\n"
+            " .text          0x80001400      0x800 build/src/b.o\n"
+            "                0x80001400                func_c = 0x80001400\n"
+        )
+        # The first lookup scans linearly, later ones go through the index.
+        for _ in range(2):
+            for fn_name, objfile in [
+                ("func_a", "build/src/a.o"),
+                ("func_b", "build/src/a.o"),
+                ("func_c", "build/src/b.o"),
+            ]:
+                lines = map_file.gnu_symbol_lines(fn_name, ".text")
+                assert [line[1] for line in lines] == [objfile]
+            assert map_file.gnu_symbol_lines("func", ".text") == []
+
+
+def make_elf(
+    symbols: List[Tuple[str, int, int]], text: bytes = b"", text_addr: int = 0
+) -> bytes:
+    """A little-endian ELF32 with a symbol table, for (name, address, size)
+    function symbols in .text, and the given contents of .text."""
+    shstrtab = b"\0.text\0.symtab\0.strtab\0.shstrtab\0"
+    strtab = b"\0"
+    symtab = bytes(16)
+    for name, value, size in symbols:
+        symtab += struct.pack("<IIIBBH", len(strtab), value, size, 0x12, 0, 1)
+        strtab += name.encode() + b"\0"
+    symtab_offset = 52 + len(shstrtab) + len(strtab)
+    text_offset = symtab_offset + len(symtab)
+    shoff = text_offset + len(text)
+    header = b"\x7fELF\x01\x01\x01" + bytes(9)
+    header += struct.pack("<HHIIIIIHHHHHH", 2, 8, 1, 0, 0, shoff, 0, 52, 0, 0, 40, 5, 4)
+    sections = [
+        (0, 0, 0, 0, 0, 0, 0),
+        (1, 1, text_addr, text_offset, len(text), 0, 0),
+        (7, 2, 0, symtab_offset, len(symtab), 3, 16),
+        (15, 3, 0, 52 + len(shstrtab), len(strtab), 0, 0),
+        (23, 3, 0, 52, len(shstrtab), 0, 0),
+    ]
+    data = header + shstrtab + strtab + symtab + text
+    for name_offset, sh_type, addr, offset, size, link, entsize in sections:
+        data += struct.pack(
+            "<IIIIIIIIII",
+            name_offset,
+            sh_type,
+            0,
+            addr,
+            offset,
+            size,
+            link,
+            0,
+            0,
+            entsize,
+        )
+    return data
+
+
+class TestElf(unittest.TestCase):
+    def test_symbol_range(self) -> None:
+        elf = make_elf([("func_a", 0x80000400, 0x20), ("func_b", 0x80000420, 0x10)])
+        config = diff.make_config("mips")
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "my.elf")
+            with open(path, "wb") as f:
+                f.write(elf)
+            assert diff.elf_symbol_range(path, "func_b", config) == (
+                0x80000420,
+                0x80000430,
+            )
+            flags = ["-d", "--disassemble=func_a"]
+            assert diff.bound_disassembled_symbol(flags, path, config) == [
+                "-d",
+                f"--start-address={0x80000400}",
+                f"--stop-address={0x80000420}",
+            ]
+            flags = ["-d", "--disassemble=func_c"]
+            assert diff.bound_disassembled_symbol(flags, path, config) == flags
+
+    def test_lean_dump(self) -> None:
+        text = bytes.fromhex("27bdffe8" "03e00008" "27bd0018")
+        elf = make_elf([("func_a", 0x400, 12)], text, 0x400)
+        config = diff.make_config("mips", lean_dump=True)
+        code = diff.InstructionBytes.from_file(elf, ["-d"], config)
+        assert code is not None
+        assert code.read(0x404, 4) == bytes.fromhex("03e00008")
+
+        dump = "00000400 <func_a>:\n 400:\taddiu\tsp,sp,-24\n 404:\tjr\tra\n 408:\taddiu\tsp,sp,24"
+        parsed = diff.parse_dump(dump, config, code=code)
+        assert [row.raw_bytes for row in parsed.rows] == [
+            "",
+            "27bdffe8",
+            "03e00008",
+            "27bd0018",
+        ]
+
+        # SH2 jump table and pool handling reads the raw bytes column, so that
+        # gets restored from the file
+        config = diff.make_config("sh2", lean_dump=True)
+        code = diff.InstructionBytes(0, bytes.fromhex("000b" "0009"))
+        out = b"\n" * 6 + b"   0:\trts\t\n   2:\tnop\t\n"
+        parsed = diff.preprocess_objdump_out(None, None, out, config, code)
+        assert [row.raw_bytes for row in parsed.rows] == ["00 0b", "00 09"]
+        assert [row.mnemonic for row in parsed.rows] == ["rts", "nop"]
+
+        # ARM32 instruction sizes vary, so the last one is sized by mode
+        config = diff.make_config("arm32", lean_dump=True)
+        code = diff.InstructionBytes(0, bytes.fromhex("e3a00000" "e12fff1e"))
+        out = b"\n" * 6 + b"   0:\tmov\tr0, #0\n   4:\tbx\tlr\n"
+        parsed = diff.preprocess_objdump_out(None, None, out, config, code)
+        assert [row.raw_bytes for row in parsed.rows] == ["e3a00000", "e12fff1e"]
+        assert [row.mnemonic for row in parsed.rows] == ["mov", "bx"]
+
+        code = diff.InstructionBytes(0, bytes.fromhex("2000" "4770" "0000"))
+        out = b"\n" * 6 + b"   0:\tmovs\tr0, #0\n   2:\tbx\tlr\n"
+        parsed = diff.preprocess_objdump_out(None, None, out, config, code)
+        assert [row.raw_bytes for row in parsed.rows] == ["2000", "4770"]
+        assert diff.parse_dump("   4:\tbx\tlr", config).rows[0].mnemonic == "bx"
+
+        # 32-bit Thumb encodings are sized by their first halfword, and shown
+        # as two halfwords
+        code = diff.InstructionBytes(0, bytes.fromhex("2000" "f240" "0101"))
+        out = b"\n" * 6 + b"   0:\tmovs\tr0, #0\n   2:\tmovw\tr1, #1\n"
+        parsed = diff.preprocess_objdump_out(None, None, out, config, code)
+        assert [row.raw_bytes for row in parsed.rows] == ["2000", "f240 0101"]
+
+        # Whether a lone instruction is ARM or Thumb code is unknown
+        out = b"\n" * 6 + b"   0:\tmovs\tr0, #0\n"
+        parsed = diff.preprocess_objdump_out(None, None, out, config, code)
+        assert [row.raw_bytes for row in parsed.rows] == [""]
+
+
+class TestBaseRomDump(unittest.TestCase):
+    def test_window(self) -> None:
+        header = (
+            "\nbase.bin:     file format binary\n\n\n"
+            "Disassembly of section .data:\n\n"
+        )
+        lines = [
+            "    1000:\t27bdffe8 \taddiu\tsp,sp,-24\n",
+            "    1004:\tafbf0014 \tsw\tra,20(sp)\n",
+            "    1008:\t03e00008 \tjr\tra\n",
+            "    100c:\t00000000 \tnop\n",
+        ]
+        out = header + "00001000 <.data+0x1000>:\n" + "".join(lines)
+        dump = diff.BaseRomDump.from_objdump(out.encode(), 0x1010)
+        assert dump.window(0x1000, 0x1010) == out.encode()
+        assert dump.window(0x1004, 0x100C) == (
+            (header + "00001004 <.data+0x1004>:\n" + lines[1] + lines[2]).encode()
+        )
+        assert dump.window(0x1002, 0x1008) is None
+        assert dump.window(0x1008, 0x1020) is None
+
+    def test_unwritable_cache(self) -> None:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            not_a_dir = os.path.join(tmpdir, "file")
+            with open(not_a_dir, "w"):
+                pass
+            diff.write_cache_file(os.path.join(not_a_dir, "cache.json"), {})
+            assert os.listdir(tmpdir) == ["file"]
+
+
+class TestObjdumpOutput(unittest.TestCase):
+    def test_preprocess(self) -> None:
+        out = (
+            b"\r\nfunc.o:     file format elf32-tradbigmips\r\n\r\n\r\n"
+            b"Disassembly of section .text:\r\n\r\n"
+            b"00000000 <func_a>:\r\n"
+            b"   0:\t03e00008 \tjr\tra\r\n"
+            b"   4:\t00000000 \tnop\r\n"
+            b"\r\n"
+            b"00000008 <func_b>:\r\n"
+            b"   8:\t03e00008 \tjr\tra\r\n"
+            b"   c:\t00000000 \tnop\r\n\r\n"
+        )
+        config = diff.make_config("mips")
+        whole = diff.preprocess_objdump_out(None, None, out, config)
+        assert str(whole).startswith("00000000 <func_a>:\n   0:\t03e00008")
+        assert str(whole).endswith("c:\t00000000 \tnop")
+        func_b = diff.preprocess_objdump_out("func_b", None, out, config)
+        assert [row.text for row in func_b.rows] == [
+            "00000008 <func_b>:",
+            "   8:\t03e00008 \tjr\tra",
+            "   c:\t00000000 \tnop",
+        ]
+
+
+class TestBatch(unittest.TestCase):
+    def test_split_objdump_functions(self) -> None:
+        dump = (
+            "00000000 <func_a>:\n"
+            "   0:\t27bdffe8 \taddiu\tsp,sp,-24\n"
+            "00000004 <.L1>:\n"
+            "   4:\t03e00008 \tjr\tra\n"
+            "   8:\t00000000 \tnop\n"
+            "\n"
+            "0000000c <func_b>:\n"
+            "   c:\t03e00008 \tjr\tra\n"
+        )
+        functions = diff.split_objdump_functions(dump, {"func_a", "func_b"})
+        assert list(functions) == ["func_a", "func_b"]
+        assert functions["func_a"].endswith("nop")
+        assert functions["func_b"].startswith("0000000c <func_b>:")
+
+    def test_lean_dump_tasks(self) -> None:
+        # Workers get the instruction bytes along with lean dumps, so that
+        # lines with equal bytes score the same as outside of --batch.
+        config = diff.make_config("mips", lean_dump=True)
+        code = diff.InstructionBytes(0, bytes.fromhex("00a02025" "03e00008" "00000000"))
+        base = "   0:\tmove\ta0,a1\n   4:\tjr\tra\n   8:\tnop"
+        current = base.replace("move\ta0,a1", "or\ta0,a1,zero")
+        base_dump = diff.preprocess_function_dump(base, "", config, code)
+        current_dump = diff.preprocess_function_dump(current, "", config, code)
+        diff.init_batch_worker(config)
+        result = diff.score_batch_task(("f", "a.o", base_dump, current_dump))
+        assert result["current_score"] == 0
+
+    def test_missing_function(self) -> None:
+        stderr = io.StringIO()
+        with contextlib.redirect_stderr(stderr):
+            assert not diff.report_missing_function("a.o", "f", {"f", "g"})
+            assert diff.report_missing_function("a.o", "h", {"f", "g"})
+        assert stderr.getvalue() == "Skipping h: not found in a.o.\n"
+
+
+class TestCorpus(unittest.TestCase):
+    def test_corpus(self) -> None:
+        cases = corpus.load_cases(corpus.CORPUS_DIR)
+        assert cases
+        for case in cases:
+            assert corpus.check_case(case) == [], case.name
+
+
 if __name__ == "__main__":
     unittest.main()